@@ -0,0 +1,235 @@
+# admission.py
+import asyncio
+import json
+import math
+import re
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional
+
+from config import settings
+
+# Chemins jamais limités : sondes de santé, documentation, diagnostic et flux longs
+EXEMPT_PREFIXES = ("/health", "/debug/", "/docs", "/redoc", "/openapi.json", "/stream/")
+# Lectures envoyées en POST (corps de requête trop long pour une URL)
+READ_POSTS = ("/products/batch-get", "/baskets/compare")
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+READ = "read"
+WRITE = "write"
+ANALYTICS = "analytics"
+
+class Bulkhead:
+    """Limite de concurrence d'une classe de routes, avec file d'attente bornée
+
+    Une requête au-delà de `concurrency` attend au plus `queue_timeout`
+    secondes qu'une place se libère ; si `queue_size` requêtes attendent déjà,
+    elle est refusée sans attendre. Les places sont rendues dans l'ordre
+    d'arrivée. Un compartiment appartient à la boucle d'événements du worker.
+    """
+
+    def __init__(self, name: str, concurrency: int, queue_size: int, queue_timeout: float, retry_after: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self._waiters: deque = deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    async def acquire(self) -> bool:
+        if self.in_flight < self.concurrency and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+        if len(self._waiters) >= self.queue_size:
+            self.rejected += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            # Si la place est attribuée au moment de l'échéance, wait_for la retourne quand même
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            return False
+        except asyncio.CancelledError:
+            # Client parti pendant l'attente : rendre la place si elle venait d'être attribuée
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if not waiter.done() or waiter.cancelled():
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+        self.admitted += 1
+        return True
+
+    def release(self):
+        # La place passe directement au premier en attente (in_flight inchangé)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float):
+        self.tokens = tokens
+        self.updated = time.monotonic()
+
+class RateLimiter:
+    """Seaux à jetons par client : `rate` jetons par seconde, au plus `burst` en réserve
+
+    Les clients inactifs les plus anciens sont oubliés au-delà de `max_clients`.
+    """
+
+    def __init__(self, rate: float, burst: int, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.limited = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def take(self, client: str, cost: int) -> float:
+        """Retire `cost` jetons ; retourne 0 si accepté, sinon l'attente avant un nouvel essai (s)"""
+        bucket = self._buckets.get(client)
+        now = time.monotonic()
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self.burst)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+        bucket.updated = now
+        if bucket.tokens >= cost:
+            bucket.tokens -= cost
+            return 0.0
+        self.limited += 1
+        return (cost - bucket.tokens) / self.rate
+
+class AdmissionController:
+    """Contrôle d'admission par classe de routes et limite de débit par client
+
+    Chaque classe (lecture, écriture, analytique) a son propre compartiment :
+    une vague de requêtes analytiques remplit sa file puis reçoit des 503
+    sans retarder les lectures simples ni les écritures de prix.
+    """
+
+    def __init__(self, enabled: bool, concurrency: Dict[str, int], queue_size: Dict[str, int],
+                 queue_timeout: Dict[str, float], retry_after: Dict[str, int], analytics_paths: List[str],
+                 rate_limiter: RateLimiter, costs: Dict[str, int], client_header: str):
+        self.enabled = enabled
+        self.bulkheads = {
+            name: Bulkhead(name, concurrency[name], queue_size[name], queue_timeout[name], retry_after[name])
+            for name in (READ, WRITE, ANALYTICS)
+        }
+        self._analytics = [re.compile(pattern) for pattern in analytics_paths]
+        self.rate_limiter = rate_limiter
+        self.costs = costs
+        self.client_header = client_header.lower().encode("latin-1")
+
+    def classify(self, method: str, path: str) -> Optional[str]:
+        """Classe de la requête, None si elle n'est pas limitée"""
+        if path == "/" or path.startswith(EXEMPT_PREFIXES):
+            return None
+        if any(pattern.search(path) for pattern in self._analytics):
+            return ANALYTICS
+        if method in WRITE_METHODS and path not in READ_POSTS:
+            return WRITE
+        return READ
+
+    def client_key(self, scope) -> str:
+        key = dict(scope["headers"]).get(self.client_header)
+        if key:
+            return "key:" + key.decode("latin-1")
+        client = scope.get("client")
+        return "ip:" + (client[0] if client else "unknown")
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "enabled": self.enabled,
+            "classes": {name: bulkhead.stats() for name, bulkhead in self.bulkheads.items()},
+            "rate_limit": {
+                "per_second": self.rate_limiter.rate,
+                "burst": self.rate_limiter.burst,
+                "limited": self.rate_limiter.limited,
+            },
+        }
+
+async def _reject(send, status_code: int, detail: str, retry_after: float):
+    body = json.dumps({"detail": detail}).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status_code,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+class AdmissionMiddleware:
+    """Middleware ASGI : 429 au-delà du débit du client, 503 + Retry-After si la classe est saturée"""
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.controller.enabled:
+            return await self.app(scope, receive, send)
+        route_class = self.controller.classify(scope["method"], scope["path"])
+        if route_class is None:
+            return await self.app(scope, receive, send)
+
+        limiter = self.controller.rate_limiter
+        if limiter.enabled:
+            wait = limiter.take(self.controller.client_key(scope), self.controller.costs.get(route_class, 1))
+            if wait:
+                return await _reject(send, 429, "Limite de débit atteinte", wait)
+
+        bulkhead = self.controller.bulkheads[route_class]
+        if not await bulkhead.acquire():
+            return await _reject(send, 503, f"Service saturé ({route_class}), réessayez plus tard", bulkhead.retry_after)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            bulkhead.release()
+
+controller = AdmissionController(
+    enabled=settings.admission_enabled,
+    concurrency=settings.admission_concurrency,
+    queue_size=settings.admission_queue_size,
+    queue_timeout=settings.admission_queue_timeout_seconds,
+    retry_after=settings.admission_retry_after_seconds,
+    analytics_paths=settings.admission_analytics_paths,
+    rate_limiter=RateLimiter(settings.admission_rate_limit_per_second, settings.admission_rate_limit_burst),
+    costs=settings.admission_rate_limit_costs,
+    client_header=settings.admission_client_header
+)
@@ -11,17 +11,22 @@ config = context.config
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
-if config.config_file_name is not None:
+# (sauf si l'appelant garde sa configuration, ex. les tests qui migrent une base temporaire)
+if config.config_file_name is not None and config.attributes.get("configure_logger", True):
     fileConfig(config.config_file_name)
 
 # add your model's MetaData object here
 # for 'autogenerate' support
 import models
 # target_metadata = mymodel.Base.metadata
+import databases
 from databases import Base, metadata
 
 target_metadata = models.Base.metadata
 
+# Même URL que l'application (DATABASE_URL, ou databases.configure() dans les tests)
+config.set_main_option("sqlalchemy.url", databases.SQLALCHEMY_DATABASE_URL.replace("%", "%%"))
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -0,0 +1,33 @@
+"""price validity interval
+
+Revision ID: 5357c0c87cfa
+Revises: ae8fa14b6bcf
+Create Date: 2026-10-19 10:50:37.166827
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5357c0c87cfa'
+down_revision: Union[str, None] = 'ae8fa14b6bcf'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Mode batch : SQLite ne sait pas ajouter une contrainte par ALTER (la table est recréée)
+    with op.batch_alter_table('prices') as batch_op:
+        batch_op.add_column(sa.Column('id_date_last_seen', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_prices_id_date_last_seen_dates', 'dates', ['id_date_last_seen'], ['id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('prices') as batch_op:
+        batch_op.drop_constraint('fk_prices_id_date_last_seen_dates', type_='foreignkey')
+        batch_op.drop_column('id_date_last_seen')
@@ -0,0 +1,37 @@
+"""price as-of index
+
+Revision ID: b3e91c7d2f64
+Revises: fa815b346a88
+Create Date: 2026-10-19 15:42:08.214537
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3e91c7d2f64'
+down_revision: Union[str, None] = 'fa815b346a88'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Construction sans verrouiller les écritures sur la table des prix (PostgreSQL)
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_prices_as_of', 'prices',
+            ['id_product', 'id_sale_point', sa.text('id_date DESC')],
+            unique=False,
+            postgresql_include=['price'],
+            postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_prices_as_of', table_name='prices', postgresql_concurrently=True)
@@ -0,0 +1,34 @@
+"""sale point shards
+
+Revision ID: b7d2e5c81f43
+Revises: e4f7b2a91c36
+Create Date: 2026-10-19 21:04:12.518337
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7d2e5c81f43'
+down_revision: Union[str, None] = 'e4f7b2a91c36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'sale_point_shards',
+        sa.Column('id_sale_point', sa.Integer(), nullable=False),
+        sa.Column('shard', sa.String(), nullable=False),
+        sa.ForeignKeyConstraint(['id_sale_point'], ['sale_points.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id_sale_point')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('sale_point_shards')
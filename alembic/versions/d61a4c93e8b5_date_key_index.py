@@ -0,0 +1,36 @@
+"""date key index
+
+Revision ID: d61a4c93e8b5
+Revises: b3e91c7d2f64
+Create Date: 2026-10-19 17:05:31.602118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd61a4c93e8b5'
+down_revision: Union[str, None] = 'b3e91c7d2f64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_dates_key', 'dates',
+            [sa.text('(year * 10000 + month * 100 + day)')],
+            unique=False,
+            postgresql_include=['id'],
+            postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_dates_key', table_name='dates', postgresql_concurrently=True)
@@ -0,0 +1,32 @@
+"""idempotency scope and headers
+
+Revision ID: e4f7b2a91c36
+Revises: d61a4c93e8b5
+Create Date: 2026-10-19 18:22:47.913402
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4f7b2a91c36'
+down_revision: Union[str, None] = 'd61a4c93e8b5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('idempotency_keys', sa.Column('headers', sa.Text(), nullable=True))
+    # Les clés sont désormais propres à chaque client : les anciennes réservations ne correspondraient plus
+    op.execute("DELETE FROM idempotency_keys")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('idempotency_keys') as batch_op:
+        batch_op.drop_column('headers')
+    op.execute("DELETE FROM idempotency_keys")
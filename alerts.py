@@ -0,0 +1,122 @@
+# alerts.py
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from sqlalchemy import update, insert
+from sqlalchemy.orm import Session
+
+import dimension_cache
+import models
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+class AlertRule(NamedTuple):
+    id: int
+    id_product: int
+    threshold: float
+    city: Optional[str]
+    id_sale_point: Optional[int]
+
+class AlertEngine:
+    """Évaluation incrémentale des alertes de baisse de prix
+
+    Les alertes actives sont indexées par produit : chaque prix reçu n'est
+    comparé qu'aux règles de son produit. Une alerte déclenchée est
+    désactivée (déclenchement unique) et une notification est écrite dans
+    la table alert_outbox, d'où elle est ensuite livrée.
+    """
+
+    def __init__(self, refresh_seconds: int = 30):
+        self._rules: Dict[int, Dict[int, AlertRule]] = {}
+        self._lock = threading.Lock()
+        self._refresh_seconds = refresh_seconds
+        self._loaded_at = 0.0
+        self.fired = 0
+
+    def warm(self, db: Session):
+        """Charge les alertes actives"""
+        rules: Dict[int, Dict[int, AlertRule]] = {}
+        for alert in db.query(models.PriceAlert).filter(models.PriceAlert.active.is_(True)):
+            rules.setdefault(alert.id_product, {})[alert.id] = self._rule(alert)
+        with self._lock:
+            self._rules = rules
+            self._loaded_at = time.monotonic()
+
+    @staticmethod
+    def _rule(alert: models.PriceAlert) -> AlertRule:
+        return AlertRule(alert.id, alert.id_product, alert.threshold, alert.city, alert.id_sale_point)
+
+    def add(self, alert: models.PriceAlert):
+        with self._lock:
+            self._rules.setdefault(alert.id_product, {})[alert.id] = self._rule(alert)
+
+    def remove(self, alert_id: int, product_id: int):
+        with self._lock:
+            self._rules.get(product_id, {}).pop(alert_id, None)
+
+    @staticmethod
+    def _city(db: Session, sale_point_id: int) -> Optional[str]:
+        sale_point = dimension_cache.cache.sale_point(db, sale_point_id)
+        return sale_point.city if sale_point else None
+
+    def evaluate(self, db: Session, prices: Iterable) -> int:
+        """Compare les prix reçus aux règles de leur produit, retourne le nombre d'alertes déclenchées"""
+        if time.monotonic() - self._loaded_at > self._refresh_seconds:
+            # Récupère les alertes créées ou supprimées par les autres workers
+            self.warm(db)
+        if not self._rules:
+            return 0
+
+        fired: List[tuple] = []
+        with self._lock:
+            for price in prices:
+                rules = self._rules.get(price.id_product)
+                if not rules:
+                    continue
+                for rule in list(rules.values()):
+                    if price.price >= rule.threshold:
+                        continue
+                    if rule.id_sale_point is not None and rule.id_sale_point != price.id_sale_point:
+                        continue
+                    if rule.city is not None and self._city(db, price.id_sale_point) != rule.city:
+                        continue
+                    fired.append((rule, price))
+                    del rules[rule.id]
+
+        if fired:
+            self._write_outbox(db, fired)
+        return len(fired)
+
+    def _write_outbox(self, db: Session, fired: List[tuple]):
+        now = datetime.now()
+        written = 0
+        try:
+            for rule, price in fired:
+                # La désactivation conditionnelle évite un double déclenchement entre workers
+                result = db.execute(
+                    update(models.PriceAlert)
+                    .where(models.PriceAlert.id == rule.id, models.PriceAlert.active.is_(True))
+                    .values(active=False)
+                )
+                if result.rowcount != 1:
+                    continue
+                db.execute(insert(models.AlertOutbox).values(
+                    id_alert=rule.id,
+                    id_product=price.id_product,
+                    id_sale_point=price.id_sale_point,
+                    id_date=price.id_date,
+                    price=price.price,
+                    created_at=now
+                ))
+                written += 1
+            db.commit()
+            self.fired += written
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Échec de l'écriture des alertes déclenchées : {e}")
+
+engine = AlertEngine(refresh_seconds=settings.alerts_refresh_seconds)
@@ -0,0 +1,335 @@
+# archive.py
+import argparse
+import bisect
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from datetime import date, timedelta
+from typing import Dict, List, NamedTuple, Optional
+
+from sqlalchemy import delete, func, or_, tuple_
+from sqlalchemy.orm import Session, aliased
+
+import models
+import price_dedup
+import sharding
+from config import settings
+from utils import date_to_key
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# FORMAT DES SEGMENTS
+# ============================================================================
+#
+# Un segment contient les prix archivés d'une plage de dates (et d'un shard).
+# Les lignes sont regroupées par produit ; chaque produit forme un bloc zlib
+# de colonnes contiguës (date_key, id_date, id_sale_point, price, last_seen_key,
+# next_key), triées par date puis point de vente. L'index JSON (position et taille de
+# chaque bloc) est écrit en fin de fichier, suivi d'un pied de page fixe :
+# seul le bloc du produit demandé est lu (via mmap) puis décompressé.
+
+MAGIC = b"PRCSEG01"
+FOOTER = struct.Struct("<QI8s")  # position de l'index, taille de l'index, MAGIC
+COLUMNS = (
+    ("date_key", "i"), ("id_date", "q"), ("id_sale_point", "q"), ("price", "d"),
+    ("last_seen_key", "i"), ("next_key", "i")
+)
+
+class ArchivedPrice(NamedTuple):
+    date_key: int
+    id_date: int
+    id_sale_point: int
+    price: float
+    last_seen_key: int  # 0 si le prix n'a pas d'intervalle de validité
+    next_key: int  # date de l'observation suivante du même couple, 0 si aucune
+
+def _encode_block(rows: List[tuple]) -> bytes:
+    payload = b"".join(
+        array(typecode, [row[i] for row in rows]).tobytes()
+        for i, (_, typecode) in enumerate(COLUMNS)
+    )
+    return zlib.compress(payload, settings.archive_compression_level)
+
+def _decode_block(data: bytes, rows: int, byteorder: str) -> List[ArchivedPrice]:
+    payload = zlib.decompress(data)
+    columns = []
+    offset = 0
+    for _, typecode in COLUMNS:
+        values = array(typecode)
+        size = rows * values.itemsize
+        values.frombytes(payload[offset:offset + size])
+        if byteorder != sys.byteorder:
+            values.byteswap()
+        columns.append(values)
+        offset += size
+    return [ArchivedPrice(*row) for row in zip(*columns)]
+
+class Segment:
+    """Segment ouvert en lecture (mmap) avec son index"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        index_offset, index_size, magic = FOOTER.unpack(self._mmap[-FOOTER.size:])
+        if magic != MAGIC:
+            raise ValueError(f"Not a price archive segment: {path}")
+        self.index = json.loads(self._mmap[index_offset:index_offset + index_size])
+        self.start_key = self.index["start_key"]
+        self.end_key = self.index["end_key"]
+
+    def prices(self, product_id: int) -> List[ArchivedPrice]:
+        block = self.index["products"].get(str(product_id))
+        if block is None:
+            return []
+        offset, size, rows = block
+        return _decode_block(self._mmap[offset:offset + size], rows, self.index["byteorder"])
+
+    def close(self):
+        self._mmap.close()
+
+# ============================================================================
+# LECTURE DES ARCHIVES
+# ============================================================================
+
+class ArchiveStore:
+    """Accès en lecture aux segments d'un répertoire d'archives
+
+    La liste des segments est relue lorsque le répertoire change (nouvelle
+    archive écrite par un autre processus).
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._segments: Dict[str, Segment] = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        try:
+            version = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            version = None
+        if version == self._version:
+            return
+        names = set()
+        if version is not None:
+            names = {n for n in os.listdir(self.directory) if n.endswith(".seg")}
+        for name in set(self._segments) - names:
+            self._segments.pop(name).close()
+        for name in names - set(self._segments):
+            self._segments[name] = Segment(os.path.join(self.directory, name))
+        self._version = version
+
+    def segments(self, start_key: Optional[int] = None, end_key: Optional[int] = None) -> List[Segment]:
+        """Segments dont la plage de dates recoupe [start_key, end_key]"""
+        with self._lock:
+            self._refresh()
+            return [
+                s for s in self._segments.values()
+                if (start_key is None or s.end_key >= start_key) and (end_key is None or s.start_key <= end_key)
+            ]
+
+    def prices(
+        self,
+        product_id: int,
+        sale_point_id: Optional[int] = None,
+        start_key: Optional[int] = None,
+        end_key: Optional[int] = None
+    ) -> List[ArchivedPrice]:
+        """Prix archivés d'un produit, triés par date puis point de vente"""
+        rows = []
+        for segment in self.segments(start_key, end_key):
+            rows.extend(
+                r for r in segment.prices(product_id)
+                if (sale_point_id is None or r.id_sale_point == sale_point_id)
+                and (start_key is None or r.date_key >= start_key)
+                and (end_key is None or r.date_key <= end_key)
+            )
+        rows.sort(key=lambda r: (r.date_key, r.id_sale_point))
+        return rows
+
+    def daily_prices(
+        self,
+        db: Session,
+        product_id: int,
+        sale_point_id: Optional[int] = None,
+        start_key: Optional[int] = None,
+        end_key: Optional[int] = None,
+        strategy: str = "interval"
+    ) -> List[tuple]:
+        """Une ligne (date_key, id_date, id_sale_point, price) par jour de validité des prix archivés"""
+        # Un prix peut couvrir des jours antérieurs à start_key : on part de toutes les observations
+        rows = self.prices(product_id, sale_point_id, None, end_key)
+        if not rows:
+            return []
+        day_ids = _date_ids(db, rows[0].date_key, max(max(r.date_key, r.last_seen_key, r.next_key) for r in rows))
+        day_keys = list(day_ids)
+        low = start_key if start_key is not None else day_keys[0] if day_keys else 0
+
+        daily = []
+        for r in rows:
+            if strategy == "skip":
+                # Valable jusqu'à l'observation suivante (exclue)
+                stop = r.next_key - 1 if r.next_key else r.date_key
+            else:
+                stop = r.last_seen_key or r.date_key
+            if end_key is not None:
+                stop = min(stop, end_key)
+            first = bisect.bisect_left(day_keys, max(r.date_key, low))
+            last = bisect.bisect_right(day_keys, stop)
+            daily.extend((k, day_ids[k], r.id_sale_point, r.price) for k in day_keys[first:last])
+        daily.sort(key=lambda r: (r[0], r[2]))
+        return daily
+
+def _date_ids(db: Session, start_key: int, end_key: int) -> Dict[int, int]:
+    """Identifiants des dates existantes entre deux clés, indexés par clé (ordre croissant)"""
+    from crud import date_key_column
+    date_key = date_key_column()
+    return dict(
+        db.query(date_key, models.Date.id)
+        .filter(date_key >= start_key, date_key <= end_key)
+        .order_by(date_key)
+        .all()
+    )
+
+# ============================================================================
+# ARCHIVAGE
+# ============================================================================
+
+def _archive_session(db: Session, shard: Optional[str], cutoff_key: int, batch_size: int = 1000) -> Optional[dict]:
+    """Exporte les prix terminés avant cutoff_key vers un segment puis les supprime"""
+    from crud import date_key_column
+    first_day = aliased(models.Date)
+    last_day = aliased(models.Date)
+    start_key = date_key_column(first_day)
+    last_seen_key = date_key_column(last_day)
+    observations = (
+        db.query(
+            models.Price.id_product,
+            start_key.label("date_key"),
+            models.Price.id_date,
+            models.Price.id_sale_point,
+            models.Price.price,
+            func.coalesce(last_seen_key, 0).label("last_seen_key"),
+            func.lead(start_key).over(
+                partition_by=[models.Price.id_product, models.Price.id_sale_point],
+                order_by=[start_key]
+            ).label("next_key")
+        )
+        .join(first_day, models.Price.id_date == first_day.id)
+        .outerjoin(last_day, models.Price.id_date_last_seen == last_day.id)
+        .subquery()
+    )
+    # Un prix dont la validité se prolonge au-delà de la coupure reste dans la table chaude
+    if price_dedup.cache.strategy == "skip":
+        still_valid = or_(observations.c.next_key.is_(None), observations.c.next_key > cutoff_key)
+    else:
+        still_valid = func.nullif(observations.c.last_seen_key, 0) >= cutoff_key
+    query = (
+        db.query(
+            observations.c.id_product,
+            observations.c.date_key,
+            observations.c.id_date,
+            observations.c.id_sale_point,
+            observations.c.price,
+            observations.c.last_seen_key,
+            func.coalesce(observations.c.next_key, 0).label("next_key")
+        )
+        .filter(observations.c.date_key < cutoff_key, ~func.coalesce(still_valid, False))
+        .order_by(observations.c.id_product, observations.c.date_key, observations.c.id_sale_point)
+    )
+
+    os.makedirs(settings.archive_dir, exist_ok=True)
+    tmp_path = os.path.join(settings.archive_dir, f".prices-{shard or 'main'}-{cutoff_key}.tmp")
+    index = {"byteorder": sys.byteorder, "shard": shard, "products": {}}
+    keys: List[tuple] = []
+    start, end = None, None
+    with open(tmp_path, "wb") as f:
+        current_product, block = None, []
+
+        def flush_block():
+            data = _encode_block(block)
+            index["products"][str(current_product)] = [f.tell(), len(data), len(block)]
+            f.write(data)
+
+        for r in query.yield_per(10000):
+            if r.id_product != current_product and block:
+                flush_block()
+                block = []
+            current_product = r.id_product
+            block.append((r.date_key, r.id_date, r.id_sale_point, r.price, r.last_seen_key, r.next_key))
+            keys.append((r.id_product, r.id_sale_point, r.id_date))
+            start = r.date_key if start is None else min(start, r.date_key)
+            end = max(end or 0, r.date_key, r.last_seen_key)
+        if block:
+            flush_block()
+        index.update(start_key=start, end_key=end, rows=len(keys))
+        payload = json.dumps(index).encode("utf-8")
+        index_offset = f.tell()
+        f.write(payload)
+        f.write(FOOTER.pack(index_offset, len(payload), MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+
+    if not keys:
+        os.remove(tmp_path)
+        return None
+
+    path = os.path.join(settings.archive_dir, f"prices-{shard or 'main'}-{start}-{end}-{cutoff_key}.seg")
+    try:
+        # Suppression des lignes exactement exportées, dans la même transaction que la publication du segment
+        key_columns = tuple_(models.Price.id_product, models.Price.id_sale_point, models.Price.id_date)
+        for i in range(0, len(keys), batch_size):
+            db.execute(delete(models.Price).where(key_columns.in_(keys[i:i + batch_size])))
+        db.flush()
+        os.replace(tmp_path, path)
+        db.commit()
+    except Exception:
+        db.rollback()
+        for leftover in (tmp_path, path):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        raise
+    logger.info(f"{len(keys)} prix archivés dans {path}")
+    return {"path": path, "shard": shard, "rows": len(keys), "start_key": start, "end_key": end}
+
+def archive_prices(db: Session, before: Optional[date] = None) -> List[dict]:
+    """Archive les prix antérieurs à `before` (par défaut archive_after_days jours) sur chaque shard"""
+    if before is None:
+        before = date.today() - timedelta(days=settings.archive_after_days)
+    cutoff_key = date_to_key(before)
+    segments = []
+    for shard in sharding.router.names or [None]:
+        with sharding.router.session(db, shard) as price_db:
+            segment = _archive_session(price_db, shard, cutoff_key)
+        if segment:
+            segments.append(segment)
+    return segments
+
+store = ArchiveStore(settings.archive_dir)
+
+if __name__ == "__main__":
+    # Exemple : python archive.py --before 2023-01-01
+    from datetime import datetime
+    from databases import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Archive les prix anciens vers des segments compressés")
+    parser.add_argument("--before", help="Archiver les prix antérieurs à cette date (YYYY-MM-DD)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    db = SessionLocal()
+    try:
+        before = datetime.strptime(args.before, "%Y-%m-%d").date() if args.before else None
+        for segment in archive_prices(db, before):
+            print(json.dumps(segment))
+    finally:
+        db.close()
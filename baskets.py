@@ -0,0 +1,135 @@
+# baskets.py
+import time
+from itertools import combinations
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+import crud
+import dimension_cache
+from config import settings
+
+def _rank(option: dict):
+    # Le plus d'articles trouvés d'abord, puis le total le plus bas
+    return (-option["items_found"], option["total"])
+
+def _summary(prices: Dict[int, float], quantities: Dict[int, float]) -> dict:
+    found = [product_id for product_id in quantities if product_id in prices]
+    return {
+        "total": round(sum(prices[product_id] * quantities[product_id] for product_id in found), 2),
+        "items_found": len(found),
+        "coverage": len(found) / len(quantities),
+        "missing_product_ids": [product_id for product_id in quantities if product_id not in prices],
+    }
+
+def _sale_point_option(db: Session, sale_point_id: int, prices: Dict[int, float], quantities: Dict[int, float]) -> dict:
+    sale_point = dimension_cache.cache.sale_point(db, sale_point_id)
+    return {
+        "sale_point_id": sale_point_id,
+        "sale_point_name": sale_point.name if sale_point else None,
+        "city": sale_point.city if sale_point else None,
+        **_summary(prices, quantities),
+    }
+
+def _ranked_sale_points(db: Session, quantities: Dict[int, float], city: Optional[str]) -> List[dict]:
+    """Points de vente classés d'après l'agrégat SQL (une requête par shard)"""
+    return sorted(
+        (
+            {"sale_point_id": row.id_sale_point, "total": row.total, "items_found": row.items_found}
+            for row in crud.get_basket_totals(db, quantities, city)
+        ),
+        key=_rank
+    )
+
+def _best_splits(db: Session, candidates: List[int], prices: Dict[int, Dict[int, float]],
+                 quantities: Dict[int, float], min_coverage: float, limit: int, deadline: float):
+    """Meilleures répartitions du panier entre deux points de vente
+
+    Chaque article est acheté au moins cher des deux. Les paires sont
+    examinées dans l'ordre du classement individuel jusqu'à l'échéance,
+    une fois au moins `limit` répartitions trouvées : la recherche peut
+    donc s'arrêter avant d'avoir tout vu.
+    """
+    splits = []
+    exhaustive = True
+    for first, second in combinations(candidates, 2):
+        if len(splits) >= limit and time.monotonic() >= deadline:
+            exhaustive = False
+            break
+        a, b = prices[first], prices[second]
+        assignment = {first: [], second: []}
+        for product_id in quantities:
+            if product_id in a and (product_id not in b or a[product_id] <= b[product_id]):
+                assignment[first].append(product_id)
+            elif product_id in b:
+                assignment[second].append(product_id)
+        if not assignment[first] or not assignment[second]:
+            continue  # un seul point de vente suffit : déjà dans les résultats individuels
+        if len(assignment[first]) + len(assignment[second]) < min_coverage * len(quantities):
+            continue
+        cheapest = {p: a[p] for p in assignment[first]}
+        cheapest.update((p, b[p]) for p in assignment[second])
+        splits.append((assignment, _summary(cheapest, quantities)))
+    splits.sort(key=lambda split: _rank(split[1]))
+
+    results = []
+    for assignment, summary in splits[:limit]:
+        sale_points = []
+        for sale_point_id, product_ids in assignment.items():
+            sale_point = dimension_cache.cache.sale_point(db, sale_point_id)
+            sale_points.append({
+                "sale_point_id": sale_point_id,
+                "sale_point_name": sale_point.name if sale_point else None,
+                "product_ids": product_ids,
+                "subtotal": round(sum(prices[sale_point_id][p] * quantities[p] for p in product_ids), 2),
+            })
+        results.append({"sale_points": sale_points, **summary})
+    return results, exhaustive
+
+def compare(
+    db: Session,
+    quantities: Dict[int, float],
+    group_by: str = "sale_point",
+    city: Optional[str] = None,
+    min_coverage: float = 0.0,
+    split: bool = False,
+    limit: int = 10,
+    started: Optional[float] = None
+) -> dict:
+    """Points de vente (ou villes) où la liste de courses revient le moins cher
+
+    Les totaux reposent sur le dernier prix connu de chaque produit dans
+    chaque point de vente. Un article introuvable n'entre pas dans le total
+    et réduit la couverture ; les résultats sont classés par nombre
+    d'articles trouvés puis par total. En mode ville, chaque article est
+    compté au prix du point de vente le moins cher de la ville.
+    """
+    started = started if started is not None else time.monotonic()
+    deadline = started + settings.basket_budget_ms / 1000
+    response = {"items": len(quantities), "group_by": group_by, "results": [], "splits": None, "split_exhaustive": None}
+
+    if group_by == "city":
+        needed = min_coverage * len(quantities)
+        options = [
+            {"city": city_name, **_summary(prices, quantities)}
+            for city_name, prices in crud.get_basket_city_prices(db, list(quantities), city).items()
+            if len(prices) >= needed
+        ]
+        response["results"] = sorted(options, key=_rank)[:limit]
+    else:
+        ranked = _ranked_sale_points(db, quantities, city)
+        selected = [r["sale_point_id"] for r in ranked if r["items_found"] >= min_coverage * len(quantities)][:limit]
+        # Candidats de la répartition : les mieux classés seuls, même sous la couverture minimale
+        candidates = [r["sale_point_id"] for r in ranked[:settings.basket_split_candidates]] if split else []
+        prices = crud.get_basket_prices(db, list(quantities), list(dict.fromkeys(selected + candidates)))
+        response["results"] = [
+            _sale_point_option(db, sale_point_id, prices[sale_point_id], quantities)
+            for sale_point_id in selected
+        ]
+        if split:
+            response["splits"], response["split_exhaustive"] = _best_splits(
+                db, candidates, prices, quantities, min_coverage, limit, deadline
+            )
+
+    response["elapsed_ms"] = round((time.monotonic() - started) * 1000, 2)
+    return response
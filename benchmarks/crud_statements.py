@@ -0,0 +1,129 @@
+# benchmarks/crud_statements.py
+"""Coût par appel des lectures crud les plus fréquentes
+
+Compare sur une base remplie pour l'occasion :
+  - query  : ancienne écriture `db.query(...).filter(...)`, reconstruite et
+             recompilée à chaque appel
+  - lambda : `crud.get_product`, `crud._get_price` et
+             `crud.get_price_comparison` (instructions lambda en cache)
+
+Exemple :
+    python benchmarks/crud_statements.py --calls 20000
+    python benchmarks/crud_statements.py --database-url postgresql+psycopg://... --calls 20000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import func
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def seed(db, products: int, sale_points: int, days: int):
+    import models
+    db.add_all(models.Product(title=f"Produit {i}") for i in range(products))
+    db.add_all(models.SalePoint(name=f"Point {i}", city="Paris", type="supermarket") for i in range(sale_points))
+    first = date.today() - timedelta(days=days)
+    db.add_all(
+        models.Date(day=d.day, month=d.month, year=d.year)
+        for d in (first + timedelta(days=k) for k in range(days))
+    )
+    db.flush()
+    rnd = random.Random(1)
+    db.bulk_insert_mappings(models.Price, [
+        {"id_product": p, "id_sale_point": s, "id_date": d, "price": round(rnd.uniform(1, 100), 2)}
+        for p in range(1, products + 1)
+        for s in range(1, sale_points + 1)
+        for d in range(1, days + 1)
+    ])
+    db.commit()
+
+def legacy_get_product(db, product_id):
+    import models
+    return db.query(models.Product).filter(models.Product.id == product_id).first()
+
+def legacy_get_price(db, product_id, sale_point_id, date_id):
+    import models
+    return (
+        db.query(models.Price)
+        .filter(
+            models.Price.id_product == product_id,
+            models.Price.id_sale_point == sale_point_id,
+            models.Price.id_date == date_id
+        )
+        .first()
+    )
+
+def legacy_get_price_comparison(db, product_id):
+    import models
+    latest_date = (
+        db.query(func.max(models.Price.id_date))
+        .filter(models.Price.id_product == product_id)
+        .scalar()
+    )
+    return (
+        db.query(
+            models.SalePoint.id.label("sale_point_id"),
+            models.SalePoint.name.label("sale_point_name"),
+            models.Price.price,
+            models.Date.id.label("date_id")
+        )
+        .join(models.SalePoint, models.Price.id_sale_point == models.SalePoint.id)
+        .join(models.Date, models.Price.id_date == models.Date.id)
+        .filter(models.Price.id_product == product_id, models.Price.id_date == latest_date)
+        .all()
+    )
+
+def measure(db, function, arguments, calls: int) -> float:
+    """Durée moyenne d'un appel en microsecondes (session vidée entre deux appels)"""
+    for args in arguments[:100]:
+        function(db, *args)
+    started = time.perf_counter()
+    for i in range(calls):
+        function(db, *arguments[i % len(arguments)])
+        db.expunge_all()
+    return (time.perf_counter() - started) / calls * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="base déjà remplie (par défaut : SQLite temporaire)")
+    parser.add_argument("--calls", type=int, default=10000)
+    parser.add_argument("--products", type=int, default=50)
+    parser.add_argument("--sale-points", type=int, default=20)
+    parser.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+
+    import databases
+    database_url = args.database_url or f"sqlite:///{tempfile.mkdtemp()}/crud_statements.db"
+    databases.configure(database_url)
+    import crud
+    import models
+    db = databases.SessionLocal()
+    if not args.database_url:
+        models.Base.metadata.create_all(bind=databases.get_engine())
+        seed(db, args.products, args.sale_points, args.days)
+
+    rnd = random.Random(2)
+    product_ids = [(rnd.randint(1, args.products),) for _ in range(1000)]
+    price_keys = [
+        (rnd.randint(1, args.products), rnd.randint(1, args.sale_points), rnd.randint(1, args.days))
+        for _ in range(1000)
+    ]
+    cases = [
+        ("get_product", legacy_get_product, crud.get_product, product_ids),
+        ("get_price", legacy_get_price, crud._get_price, price_keys),
+        ("get_price_comparison", legacy_get_price_comparison, crud.get_price_comparison, product_ids),
+    ]
+    print(f"{'lecture':<22}{'query µs':>12}{'lambda µs':>12}{'gain':>8}")
+    for name, legacy, current, arguments in cases:
+        before = measure(db, legacy, arguments, args.calls)
+        after = measure(db, current, arguments, args.calls)
+        print(f"{name:<22}{before:>12.1f}{after:>12.1f}{(1 - after / before) * 100:>7.0f}%")
+    db.close()
+
+if __name__ == "__main__":
+    main()
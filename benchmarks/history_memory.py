@@ -0,0 +1,140 @@
+# benchmarks/history_memory.py
+"""Pic de mémoire (RSS) de l'historique des prix d'un produit
+
+Compare, chacun dans un processus neuf :
+  - rows    : ancienne représentation (liste d'objets Row puis dictionnaires
+              imbriqués encodés en une fois)
+  - columns : colonnes typées (HistoryColumns) et encodage JSON par tranches
+
+Exemple :
+    python benchmarks/history_memory.py --rows 1000000
+    python benchmarks/history_memory.py --database-url postgresql://... --rows 1000000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss est en Ko sous Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _current_rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+def _bind(database_url: str):
+    """Fait pointer l'application sur la base de mesure"""
+    import databases
+    databases.configure(database_url)
+    return databases
+
+def seed(database_url: str, rows: int, sale_points: int = 50):
+    """Crée un produit avec `rows` prix répartis sur `sale_points` points de vente"""
+    databases = _bind(database_url)
+    import models
+    models.Base.metadata.create_all(bind=databases.get_engine())
+    db = databases.SessionLocal()
+    try:
+        if db.query(models.Price).filter(models.Price.id_product == 1).count() == rows:
+            return
+        db.query(models.Price).delete()
+        db.query(models.Date).delete()
+        db.query(models.SalePoint).delete()
+        db.query(models.Product).delete()
+        db.add(models.Product(id=1, title="benchmark"))
+        db.bulk_insert_mappings(models.SalePoint, [
+            {"id": i, "name": f"Point de vente {i}", "city": "Paris"} for i in range(1, sale_points + 1)
+        ])
+        days = -(-rows // sale_points)
+        first = date.today() - timedelta(days=days)
+        db.bulk_insert_mappings(models.Date, [
+            {"id": k + 1, "day": d.day, "month": d.month, "year": d.year}
+            for k, d in ((k, first + timedelta(days=k)) for k in range(days))
+        ])
+        batch = []
+        for n in range(rows):
+            batch.append({
+                "id_product": 1,
+                "id_sale_point": n % sale_points + 1,
+                "id_date": n // sale_points + 1,
+                "price": 10 + (n * 7919 % 1000) / 100
+            })
+            if len(batch) == 50000:
+                db.bulk_insert_mappings(models.Price, batch)
+                batch = []
+        if batch:
+            db.bulk_insert_mappings(models.Price, batch)
+        db.commit()
+    finally:
+        db.close()
+
+def measure(database_url: str, mode: str) -> dict:
+    """Exécuté dans un processus dédié : construit et encode l'historique du produit 1"""
+    os.environ["OFFLOAD_POOL_SIZE"] = "0"  # tout le travail reste dans ce processus
+    databases = _bind(database_url)
+    import crud
+    from utils import encode_price_history
+    db = databases.SessionLocal()
+    baseline = _current_rss_mb()
+    started = time.perf_counter()
+    if mode == "rows":
+        results = crud._price_history_query(db, 1, fill_daily=False).all()
+        names = crud._sale_point_names(db, {r.sale_point_id for r in results})
+        entries = [
+            {
+                "date": {"id": r.date_id, "day": r.day, "month": r.month, "year": r.year},
+                "price": r.price,
+                "sale_point": {"id": r.sale_point_id, "name": names.get(r.sale_point_id)}
+            }
+            for r in results
+        ]
+        payload = json.dumps(entries, separators=(",", ":")).encode("utf-8")
+        count = len(results)
+    else:
+        columns, names = crud.get_price_history_columns(db, 1, fill_daily=False)
+        payload = encode_price_history(columns, names)
+        count = len(columns["date_id"])
+    elapsed = time.perf_counter() - started
+    db.close()
+    return {
+        "mode": mode,
+        "rows": count,
+        "seconds": round(elapsed, 2),
+        "payload_mb": round(len(payload) / (1024 * 1024), 1),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "peak_over_baseline_mb": round(_peak_rss_mb() - baseline, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Pic de mémoire de l'historique des prix")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--database-url", default="sqlite:///./benchmark_history.db")
+    parser.add_argument("--mode", choices=["rows", "columns"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(measure(args.database_url, args.mode)))
+        return
+
+    seed(args.database_url, args.rows)
+    for mode in ("rows", "columns"):
+        output = subprocess.run(
+            [sys.executable, __file__, "--database-url", args.database_url, "--mode", mode],
+            check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{result['mode']:8} {result['rows']:>9} lignes  {result['seconds']:>6.2f} s  "
+            f"JSON {result['payload_mb']:>6.1f} Mo  pic RSS {result['peak_rss_mb']:>7.1f} Mo "
+            f"(+{result['peak_over_baseline_mb']:.1f} Mo)"
+        )
+
+if __name__ == "__main__":
+    main()
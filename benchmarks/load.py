@@ -0,0 +1,140 @@
+# benchmarks/load.py
+"""Charge HTTP sur l'API : débit, latences et arrêt gracieux
+
+Lance le serveur (profil de production `serve.py` ou profil de développement
+uvicorn à un seul processus), le soumet à `--concurrency` clients pendant
+`--duration` secondes, puis l'arrête par SIGTERM et vérifie qu'aucune requête
+en cours n'a échoué.
+
+Exemple :
+    python benchmarks/load.py --profile serve --workers 4
+    python benchmarks/load.py --profile dev
+    python benchmarks/load.py --url http://127.0.0.1:8000   # serveur déjà lancé
+"""
+import argparse
+import asyncio
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_PATHS = ["/health/dimensions", "/products/?limit=20", "/prices/?limit=20", "/stats/prices-by-month"]
+
+def start_server(profile: str, port: int, workers: int, database_url: str = None) -> subprocess.Popen:
+    env = dict(os.environ, SERVE_PORT=str(port), SERVE_HOST="127.0.0.1")
+    if workers:
+        env["SERVE_WORKERS"] = str(workers)
+    if database_url:
+        env["DATABASE_URL"] = database_url
+    if profile == "serve":
+        command = [sys.executable, "serve.py"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)]
+    return subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+async def wait_ready(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=url) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/health")).status_code < 500:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Le serveur {url} ne répond pas")
+
+async def run_load(url: str, paths, concurrency: int, duration: float, stop_after: float = None, server=None):
+    """Boucle de `concurrency` clients ; envoie SIGTERM au serveur après `stop_after` secondes"""
+    latencies, errors, statuses = [], 0, {}
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async def client_loop(client: httpx.AsyncClient, index: int):
+        nonlocal errors
+        i = index
+        while time.monotonic() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            started = time.perf_counter()
+            try:
+                response = await client.get(path)
+            except httpx.TransportError:
+                if stop_after is not None and time.monotonic() >= deadline - duration + stop_after:
+                    return  # serveur arrêté : plus de nouvelles connexions
+                errors += 1
+                continue
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if response.status_code >= 500:
+                errors += 1
+
+    async def terminate():
+        await asyncio.sleep(stop_after)
+        server.send_signal(signal.SIGTERM)
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30.0) as client:
+        tasks = [asyncio.create_task(client_loop(client, n)) for n in range(concurrency)]
+        if stop_after is not None:
+            tasks.append(asyncio.create_task(terminate()))
+        started = time.monotonic()
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - started
+    return latencies, errors, statuses, elapsed
+
+def report(label: str, latencies, errors, statuses, elapsed):
+    if not latencies:
+        print(f"{label}: aucune réponse")
+        return
+    ordered = sorted(latencies)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    print(
+        f"{label}: {len(latencies)} requêtes en {elapsed:.1f} s = {len(latencies) / elapsed:.0f} req/s  "
+        f"p50 {statistics.median(ordered):.1f} ms  p95 {pct(95):.1f} ms  p99 {pct(99):.1f} ms  "
+        f"erreurs {errors}  statuts {dict(sorted(statuses.items()))}"
+    )
+
+async def main():
+    parser = argparse.ArgumentParser(description="Charge HTTP sur l'API")
+    parser.add_argument("--url", help="Serveur déjà lancé (sinon le benchmark le démarre)")
+    parser.add_argument("--profile", choices=["serve", "dev"], default="serve")
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--database-url")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--path", action="append", dest="paths", help="Chemin à interroger (répétable)")
+    args = parser.parse_args()
+    paths = args.paths or DEFAULT_PATHS
+
+    if args.url:
+        report(args.url, *await run_load(args.url, paths, args.concurrency, args.duration))
+        return
+
+    url = f"http://127.0.0.1:{args.port}"
+    server = start_server(args.profile, args.port, args.workers, args.database_url)
+    try:
+        await wait_ready(url)
+        report(f"{args.profile} (charge)", *await run_load(url, paths, args.concurrency, args.duration))
+        # Arrêt pendant la charge : les requêtes déjà acceptées doivent aboutir
+        latencies, errors, statuses, elapsed = await run_load(
+            url, paths, args.concurrency, args.duration, stop_after=min(2.0, args.duration / 2), server=server
+        )
+        stopped = time.monotonic()
+        code = server.wait(timeout=60)
+        report(f"{args.profile} (arrêt sous charge)", latencies, errors, statuses, elapsed)
+        print(f"arrêt : code de sortie {code}, {time.monotonic() - stopped:.1f} s après la fin de la charge")
+    finally:
+        if server.poll() is None:
+            server.kill()
+
+if __name__ == "__main__":
+    asyncio.run(main())
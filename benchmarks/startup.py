@@ -0,0 +1,75 @@
+# benchmarks/startup.py
+"""Temps de démarrage à froid d'un worker
+
+Chaque essai tourne dans un processus neuf et mesure :
+  - import  : `import main` (doit rester sans accès à la base)
+  - startup : lifespan (connexion, préchauffage des caches et des pools)
+  - request : première requête GET /health
+
+Exemple :
+    alembic upgrade head
+    python benchmarks/startup.py --runs 10
+    python benchmarks/startup.py --database-url sqlite:///./product_price_api.db
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import asyncio, json, sys, time
+sys.path.insert(0, {root!r})
+import httpx
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+import databases
+touched = databases._engine is not None
+
+async def run():
+    async with main.app.router.lifespan_context(main.app):
+        ready = time.perf_counter()
+        async with httpx.AsyncClient(app=main.app, base_url="http://bench") as client:
+            await client.get("/health")
+        return ready, time.perf_counter()
+
+ready, answered = asyncio.run(run())
+print(json.dumps({{
+    "import_ms": (imported - started) * 1000,
+    "startup_ms": (ready - imported) * 1000,
+    "request_ms": (answered - ready) * 1000,
+    "engine_created_on_import": touched,
+}}))
+"""
+
+def main():
+    parser = argparse.ArgumentParser(description="Temps de démarrage à froid d'un worker")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--database-url", help="Base utilisée par les workers (DATABASE_URL)")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if args.database_url:
+        env["DATABASE_URL"] = args.database_url
+    # Le pool de processus est mesuré à part : son préchauffage dépend du nombre de cœurs
+    env.setdefault("OFFLOAD_POOL_SIZE", "0")
+
+    results = []
+    for _ in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, "-c", CHILD.format(root=ROOT)],
+            check=True, capture_output=True, text=True, env=env, cwd=ROOT
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    for name in ("import_ms", "startup_ms", "request_ms"):
+        values = [r[name] for r in results]
+        print(f"{name:11} médiane {statistics.median(values):8.1f} ms  max {max(values):8.1f} ms")
+    print("moteur créé à l'import :", any(r["engine_created_on_import"] for r in results))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# benchmarks/trace_collector.py
+"""Collecteur OTLP/HTTP minimal et rapport de latence par span
+
+Remplace localement un collecteur OpenTelemetry : reçoit les spans envoyés
+avec TRACING_EXPORTER=otlp et les écrit au format de l'exportateur fichier
+(un span JSON par ligne). Le rapport retient, pour chaque route, les traces
+les plus lentes et détaille leur temps par fonction crud et par requête SQL.
+
+Exemple :
+    python benchmarks/trace_collector.py --port 4318 --output traces.jsonl
+    TRACING_ENABLED=true TRACING_EXPORTER=otlp python serve.py
+    python benchmarks/trace_collector.py --report traces.jsonl --percentile 99
+"""
+import argparse
+import json
+import os
+import sys
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+KINDS = {1: "internal", 2: "server", 3: "client"}
+
+def _attribute_value(value: dict):
+    if "intValue" in value:
+        return int(value["intValue"])
+    for key in ("boolValue", "doubleValue", "stringValue"):
+        if key in value:
+            return value[key]
+    return None
+
+def spans_from_otlp(payload: dict):
+    for resource_spans in payload.get("resourceSpans", []):
+        for scope_spans in resource_spans.get("scopeSpans", []):
+            for span in scope_spans.get("spans", []):
+                start, end = int(span["startTimeUnixNano"]), int(span["endTimeUnixNano"])
+                status = span.get("status", {})
+                yield {
+                    "trace_id": span["traceId"],
+                    "span_id": span["spanId"],
+                    "parent_id": span.get("parentSpanId") or None,
+                    "name": span["name"],
+                    "kind": KINDS.get(span.get("kind"), "internal"),
+                    "start_ns": start,
+                    "duration_ms": round((end - start) / 1e6, 3),
+                    "attributes": {a["key"]: _attribute_value(a["value"]) for a in span.get("attributes", [])},
+                    "error": status.get("message") if status.get("code") == 2 else None,
+                }
+
+def serve(host: str, port: int, output: str):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            spans = list(spans_from_otlp(json.loads(body)))
+            with open(output, "a", encoding="utf-8") as f:
+                for span in spans:
+                    f.write(json.dumps(span) + "\n")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, format, *args):
+            pass
+
+    print(f"Collecteur OTLP sur http://{host}:{port}/v1/traces -> {output}")
+    ThreadingHTTPServer((host, port), Handler).serve_forever()
+
+def report(path: str, percentile: float, top: int):
+    traces = defaultdict(list)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            span = json.loads(line)
+            traces[span["trace_id"]].append(span)
+
+    # Span racine de chaque trace, regroupé par route
+    by_route = defaultdict(list)
+    for spans in traces.values():
+        ids = {s["span_id"] for s in spans}
+        for span in spans:
+            if span["kind"] == "server" and span["parent_id"] not in ids:
+                by_route[span["name"]].append((span, spans))
+
+    for route, roots in sorted(by_route.items()):
+        roots.sort(key=lambda item: item[0]["duration_ms"])
+        durations = [root["duration_ms"] for root, _ in roots]
+        cutoff = durations[min(len(durations) - 1, int(percentile / 100 * len(durations)))]
+        print(f"\n{route} : {len(roots)} traces, médiane {durations[len(durations) // 2]:.1f} ms, p{percentile:g} {cutoff:.1f} ms")
+
+        # Temps cumulé par span enfant dans les traces au-delà du percentile
+        tail = [spans for root, spans in roots if root["duration_ms"] >= cutoff]
+        totals = defaultdict(lambda: [0, 0.0, 0])
+        for spans in tail:
+            for span in spans:
+                if span["kind"] == "server":
+                    continue
+                label = span["name"]
+                if span["kind"] == "client":
+                    label = "sql " + " ".join(str(span["attributes"].get("db.statement", "")).split())[:80]
+                entry = totals[label]
+                entry[0] += 1
+                entry[1] += span["duration_ms"]
+                entry[2] += span["attributes"].get("db.rows", span["attributes"].get("rows", 0)) or 0
+        for label, (calls, total_ms, rows) in sorted(totals.items(), key=lambda item: -item[1][1])[:top]:
+            print(f"  {total_ms / len(tail):9.2f} ms/trace  {calls / len(tail):5.1f} appels  {rows / len(tail):8.1f} lignes  {label}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Collecteur OTLP/HTTP local et rapport de traces")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4318)
+    parser.add_argument("--output", default="traces.jsonl")
+    parser.add_argument("--report", metavar="FICHIER", help="Analyse un fichier de spans au lieu de collecter")
+    parser.add_argument("--percentile", type=float, default=95)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+    if args.report:
+        if not os.path.exists(args.report):
+            sys.exit(f"{args.report} introuvable")
+        report(args.report, args.percentile, args.top)
+    else:
+        serve(args.host, args.port, args.output)
+
+if __name__ == "__main__":
+    main()
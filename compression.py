@@ -0,0 +1,124 @@
+# compression.py
+import zlib
+from typing import Optional
+
+from config import settings
+
+try:
+    import brotli  # dépendance optionnelle
+except ImportError:
+    brotli = None
+
+# Réponses déjà compressées ou diffusées en continu : laissées telles quelles
+EXCLUDED_TYPES = ("text/event-stream", "image/", "video/", "audio/", "application/zip", "application/gzip")
+
+def choose_encoding(accept_encoding: str, brotli_available: bool) -> Optional[str]:
+    """Encodage retenu d'après Accept-Encoding (valeurs q comprises), br de préférence"""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    candidates = (["br"] if brotli_available else []) + ["gzip"]
+    wildcard = accepted.get("*", 0.0)
+    best = max(candidates, key=lambda name: accepted.get(name, wildcard))
+    return best if accepted.get(best, wildcard) > 0 else None
+
+class _Gzip:
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        # Vidage synchronisé entre deux morceaux : le client reçoit chaque morceau sans attendre la fin
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+class _Brotli:
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        out = self._compressor.process(data)
+        return out + (self._compressor.finish() if final else self._compressor.flush())
+
+class CompressionMiddleware:
+    """Middleware ASGI : compression gzip ou brotli négociée avec le client
+
+    Une réponse d'un seul morceau est compressée si elle dépasse
+    `minimum_size` ; une réponse en flux (StreamingResponse) est compressée
+    morceau par morceau, chaque morceau restant lisible dès sa réception.
+    """
+
+    def __init__(self, app, enabled: bool = True, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.enabled = enabled
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.enabled:
+            return await self.app(scope, receive, send)
+        accept = dict(scope["headers"]).get(b"accept-encoding", b"").decode("latin-1")
+        encoding = choose_encoding(accept, brotli is not None) if accept else None
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+        compressor = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                headers = {k.lower(): v for k, v in message.get("headers", [])}
+                content_type = headers.get(b"content-type", b"").decode("latin-1")
+                passthrough = (
+                    b"content-encoding" in headers
+                    or message["status"] in (204, 304)
+                    or content_type.startswith(EXCLUDED_TYPES)
+                )
+                if passthrough:
+                    await send(start)
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                return await send(message)
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                if not more_body and len(body) < self.minimum_size:
+                    # Petite réponse complète : le coût de la compression ne se justifie pas
+                    passthrough = True
+                    await send(start)
+                    return await send(message)
+                compressor = _Brotli(self.brotli_quality) if encoding == "br" else _Gzip(self.gzip_level)
+                headers = [
+                    (k, v) for k, v in start.get("headers", [])
+                    if k.lower() not in (b"content-length", b"vary")
+                ]
+                vary = dict((k.lower(), v) for k, v in start.get("headers", [])).get(b"vary")
+                headers.append((b"vary", vary + b", Accept-Encoding" if vary else b"Accept-Encoding"))
+                headers.append((b"content-encoding", encoding.encode()))
+                compressed = compressor.compress(body, final=not more_body)
+                if not more_body:
+                    headers.append((b"content-length", str(len(compressed)).encode()))
+                await send({**start, "headers": headers})
+                return await send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+            await send({"type": "http.response.body", "body": compressor.compress(body, final=not more_body), "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+def middleware_options() -> dict:
+    return {
+        "enabled": settings.compression_enabled,
+        "minimum_size": settings.compression_minimum_size,
+        "gzip_level": settings.compression_gzip_level,
+        "brotli_quality": settings.compression_brotli_quality,
+    }
@@ -1,6 +1,6 @@
 # config.py
 import os
-from typing import Optional
+from typing import Dict, List, Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -21,6 +21,145 @@ class Settings(BaseSettings):
     # Configuration CORS
     backend_cors_origins: list = ["http://localhost:3000", "http://localhost:8080"]
     
+    # Mutualisation des requêtes concurrentes identiques (single-flight)
+    singleflight_enabled: bool = True
+    singleflight_redis_url: Optional[str] = None  # ex : "redis://localhost:6379/0" pour partager entre workers
+    singleflight_lock_timeout_ms: int = 5000
+    singleflight_result_ttl_ms: int = 500
+    
+    # Écriture différée des prix (write-behind) avec commits groupés
+    price_write_mode: str = "sync"  # "sync" ou "write_behind"
+    price_write_durability: str = "flush"  # "enqueue" (ack immédiat) ou "flush" (ack après commit)
+    price_write_batch_size: int = 500
+    price_write_flush_interval_ms: int = 50
+    price_write_queue_size: int = 10000
+    price_write_enqueue_timeout_ms: int = 100
+    price_write_flush_timeout_ms: int = 5000  # attente maximale du commit en durabilité 'flush'
+    
+    # Ingestion par changements uniquement : les prix inchangés n'ajoutent pas de ligne
+    price_ingest_mode: str = "all"  # "all" ou "changes_only"
+    price_dedup_strategy: str = "interval"  # "interval" (prolonge la validité) ou "skip"
+    
+    # Flux des changements de prix (SSE / WebSocket)
+    events_redis_url: Optional[str] = None  # pub/sub Redis pour diffuser entre workers
+    events_channel: str = "price-events"
+    events_queue_size: int = 1000
+    events_keepalive_seconds: int = 15
+    
+    # Alertes de baisse de prix
+    alerts_refresh_seconds: int = 30
+    
+    # Travaux d'arrière-plan (analyses longues, exports)
+    jobs_dir: str = "jobs"
+    jobs_max_concurrency: int = 2
+    jobs_start_method: str = "spawn"  # "spawn" ou "fork"
+    jobs_retention_seconds: int = 86400  # fichiers des travaux terminés supprimés après ce délai
+    
+    # Pool de processus pour le post-traitement CPU (0 = désactivé)
+    offload_pool_size: int = 2
+    offload_min_rows: int = 5000
+    offload_timeout_s: float = 30.0
+    offload_start_method: str = "spawn"  # "spawn" ou "fork"
+    
+    # Répartition des prix sur plusieurs bases (vide = base unique)
+    shard_urls: Dict[str, str] = {}  # ex : {"eu": "postgresql://...", "af": "postgresql://..."}
+    shard_key: str = "sale_point"  # "sale_point" ou "city"
+    shard_city_map: Dict[str, str] = {}  # ville -> shard, les autres villes sont hachées
+    
+    # Archivage des prix anciens en segments compressés
+    archive_dir: str = "archive"
+    archive_after_days: int = 730
+    archive_compression_level: int = 6
+    
+    # Cache mémoire des dimensions (produits, points de vente, dates)
+    dimension_cache_enabled: bool = True
+    dimension_cache_refresh_seconds: int = 300  # rechargement complet si Redis n'est pas configuré
+    dimension_cache_redis_url: Optional[str] = None  # invalidations partagées entre workers
+    
+    # Clés d'idempotence (en-tête Idempotency-Key) des requêtes d'écriture
+    idempotency_enabled: bool = True
+    idempotency_ttl_seconds: int = 86400  # durée de conservation des réponses
+    idempotency_pending_timeout_seconds: int = 60  # reprise d'une requête restée sans réponse
+    
+    # Service en production (serve.py / gunicorn_conf.py)
+    serve_host: str = "0.0.0.0"
+    serve_port: int = 8000
+    serve_workers: int = 0  # 0 = un worker par cœur
+    serve_preload: bool = True  # importe l'application une fois avant le fork des workers
+    serve_loop: str = "auto"  # "auto" (uvloop si installé), "uvloop" ou "asyncio"
+    serve_http: str = "auto"  # "auto" (httptools si installé), "httptools" ou "h11"
+    serve_keepalive_seconds: int = 5
+    serve_backlog: int = 2048
+    serve_timeout_seconds: int = 60  # worker bloqué au-delà : redémarré
+    serve_graceful_timeout_seconds: int = 30  # drainage des requêtes en cours à l'arrêt
+    serve_max_requests: int = 0  # recyclage des workers (0 = jamais)
+    serve_max_requests_jitter: int = 0
+    serve_limit_concurrency: Optional[int] = None  # connexions simultanées par worker
+
+    # Profilage à la demande (/debug/profile, en-tête X-Profile)
+    profiling_enabled: bool = False
+    profiling_token: Optional[str] = None  # obligatoire : sans jeton le profilage reste désactivé
+    profiling_interval_ms: int = 10  # période d'échantillonnage
+    profiling_max_seconds: int = 60  # durée maximale d'une mesure du worker
+    profiling_keep: int = 50  # profils de requête conservés par worker
+
+    # Traces distribuées (spans HTTP, crud et SQL, en-tête traceparent)
+    tracing_enabled: bool = False
+    tracing_sample_ratio: float = 1.0  # part des traces démarrées ici (un parent échantillonné est toujours suivi)
+    tracing_exporter: str = "file"  # "file" (JSON par ligne) ou "otlp" (OTLP/HTTP JSON)
+    tracing_file_path: str = "traces.jsonl"
+    tracing_otlp_endpoint: str = "http://localhost:4318/v1/traces"
+    tracing_service_name: str = "entrepot-api"
+    tracing_batch_size: int = 512
+    tracing_flush_seconds: float = 2.0
+
+    # Contrôle d'admission par classe de routes (lecture, écriture, analytique)
+    # Total des concurrences ≤ 40 : threads du pool d'exécution des endpoints synchrones
+    admission_enabled: bool = True
+    admission_concurrency: Dict[str, int] = {"read": 24, "write": 12, "analytics": 4}
+    admission_queue_size: Dict[str, int] = {"read": 128, "write": 64, "analytics": 8}
+    admission_queue_timeout_seconds: Dict[str, float] = {"read": 1.0, "write": 2.0, "analytics": 5.0}
+    admission_retry_after_seconds: Dict[str, int] = {"read": 1, "write": 1, "analytics": 10}
+    admission_analytics_paths: List[str] = [
+        r"^/stats/",
+        r"^/products/[^/]+/prices$",
+        r"^/products/[^/]+/prices/as-of$",
+        r"^/products/[^/]+/price-comparison$",
+        r"^/prices/comparison/",
+        r"^/sale-points/[^/]+/prices$",
+        r"^/jobs/[^/]+/result$",
+    ]
+    # Limite de débit par client (clé d'API ou adresse IP), 0 = sans limite
+    admission_rate_limit_per_second: float = 0
+    admission_rate_limit_burst: int = 50
+    admission_rate_limit_costs: Dict[str, int] = {"read": 1, "write": 1, "analytics": 10}
+    admission_client_header: str = "x-api-key"
+
+    # Budget des requêtes SQL par route (gabarit FastAPI), 0 = sans limite
+    query_timeout_ms: int = 30000
+    query_timeouts_ms: Dict[str, int] = {
+        "/products/{product_id}": 2000,
+        "/prices/": 5000,
+        "/prices/{product_id}/{sale_point_id}/{date_id}": 2000,
+        "/stats/price-trends": 10000,
+        "/stats/price-volatility": 15000,
+        "/baskets/compare": 2000,
+    }
+    query_cancel_on_disconnect: bool = True  # annule les requêtes SQL d'un client déconnecté
+
+    # Compression des réponses (Accept-Encoding : br si le paquet brotli est installé, sinon gzip)
+    compression_enabled: bool = True
+    compression_minimum_size: int = 1024  # octets, en dessous la réponse part non compressée
+    compression_gzip_level: int = 6
+    compression_brotli_quality: int = 4
+
+    # Comparaison de paniers (POST /baskets/compare)
+    basket_budget_ms: int = 50  # temps accordé à la recherche des répartitions entre deux points de vente
+    basket_split_candidates: int = 30  # points de vente les mieux classés seuls, combinés deux à deux
+
+    # Prix à une date (GET /products/{id}/prices/as-of)
+    as_of_max_snapshots: int = 366  # instantanés par requête
+
     class Config:
         env_file = ".env"
 
@@ -1,10 +1,23 @@
 # crud.py
-from sqlalchemy.orm import Session
-from sqlalchemy import func, extract, case, text, and_, or_
-from datetime import datetime, timedelta
-from typing import List, Optional, Dict, Any
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy import func, extract, case, text, and_, or_, update, exists, Float, lambda_stmt, literal_column, select
+from array import array
+from datetime import date, datetime, timedelta
+from itertools import islice
+from typing import List, Optional, Dict, Any, NamedTuple, Callable
+import bisect
+import heapq
+import statistics
+import alerts
+import archive
+import dimension_cache
+import events
 import models
+import offload
+import price_dedup
 import schemas
+import sharding
+from utils import date_to_key, key_to_date, percentile_cont, lttb_indices, encode_price_history
 
 # ============================================================================
 # FONCTIONS UTILITAIRES
@@ -16,6 +29,83 @@ def to_dict(instance):
         return None
     return {c.key: getattr(instance, c.key) for c in instance.__table__.columns}
 
+def sparse_columns(available: Dict[str, Any], fields: Optional[List[str]]) -> tuple:
+    """Noms et colonnes SQL des champs demandés (paramètre fields=), tous par défaut
+
+    Seules ces colonnes sont sélectionnées : un champ non demandé n'est ni lu
+    ni joint.
+    """
+    if not fields:
+        return list(available), list(available.values())
+    unknown = [f for f in fields if f not in available]
+    if unknown:
+        raise ValueError(f"Champs inconnus : {', '.join(unknown)} (disponibles : {', '.join(available)})")
+    names = list(dict.fromkeys(fields))
+    return names, [available[name] for name in names]
+
+def _sparse_rows(query, names: List[str]) -> List[dict]:
+    return [dict(zip(names, row)) for row in query.yield_per(10000)]
+
+def is_postgresql(db: Session) -> bool:
+    """Indique si la session est liée à une base PostgreSQL"""
+    return db.get_bind().dialect.name == "postgresql"
+
+def upsert(db: Session, model, rows: List[dict], on_conflict: Optional[Callable] = None):
+    """INSERT ... ON CONFLICT sur la clé primaire (PostgreSQL et SQLite)
+
+    `on_conflict(excluded)` retourne les colonnes à modifier en cas de conflit
+    (les valeurs proposées sont dans `excluded`) ; sans `on_conflict`, la ligne
+    existante est conservée (DO NOTHING). Les doublons d'un même lot sont
+    fusionnés, la dernière occurrence l'emportant.
+    """
+    keys = [column.name for column in model.__table__.primary_key]
+    rows = list({tuple(row[k] for k in keys): row for row in rows}.values())
+    if not rows:
+        return
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        # Autres bases : fusion ligne par ligne via l'ORM
+        for row in rows:
+            if on_conflict or db.get(model, tuple(row[k] for k in keys)) is None:
+                db.merge(model(**row))
+        return
+    stmt = dialect_insert(model)
+    if on_conflict:
+        stmt = stmt.on_conflict_do_update(index_elements=keys, set_=on_conflict(stmt.excluded))
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=keys)
+    db.execute(stmt, rows)
+
+def date_key_column(dates=models.Date):
+    """Expression SQL de la date sous forme de clé triable YYYYMMDD"""
+    # Constantes écrites en clair : PostgreSQL n'utilise l'index ix_dates_key que si l'expression est identique
+    return dates.year * literal_column("10000") + dates.month * literal_column("100") + dates.day
+
+def date_range_filters(start_date: Optional[str] = None, end_date: Optional[str] = None, dates=models.Date):
+    """Filtres SQL pour une plage de dates au format YYYY-MM-DD (bornes incluses)"""
+    filters = []
+    if start_date:
+        start_date_obj = datetime.strptime(start_date, "%Y-%m-%d").date()
+        filters.append(date_key_column(dates) >= date_to_key(start_date_obj))
+    if end_date:
+        end_date_obj = datetime.strptime(end_date, "%Y-%m-%d").date()
+        filters.append(date_key_column(dates) <= date_to_key(end_date_obj))
+    return filters
+
+def epoch_days_column():
+    """Expression SQL du nombre de jours depuis le 1970-01-01 (arithmétique entière portable)"""
+    # Algorithme days_from_civil : l'année commence en mars pour simplifier les années bissextiles
+    year = models.Date.year - case((models.Date.month <= 2, 1), else_=0)
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * ((models.Date.month + 9) % 12) + 2) // 5 + models.Date.day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
 # ============================================================================
 # CRUD POUR LES PRODUITS
 # ============================================================================
@@ -28,14 +118,30 @@ def create_product(db: Session, product: schemas.ProductCreate):
     db.add(db_product)
     db.commit()
     db.refresh(db_product)
+    sharding.router.replicate_upsert(db_product)
+    dimension_cache.cache.put(db_product)
     return db_product
 
 def get_product(db: Session, product_id: int):
-    return db.query(models.Product).filter(models.Product.id == product_id).first()
+    # Instruction lambda : construite et compilée une fois, product_id devient un paramètre lié
+    return db.execute(
+        lambda_stmt(lambda: select(models.Product).where(models.Product.id == product_id))
+    ).scalars().first()
 
-def get_products(db: Session, skip: int = 0, limit: int = 100):
+PRODUCT_FIELDS = {"id": models.Product.id, "title": models.Product.title, "link": models.Product.link}
+
+def get_products(db: Session, skip: int = 0, limit: int = 100, fields: Optional[List[str]] = None):
+    if fields:
+        names, columns = sparse_columns(PRODUCT_FIELDS, fields)
+        return _sparse_rows(db.query(*columns).offset(skip).limit(limit), names)
     return db.query(models.Product).offset(skip).limit(limit).all()
 
+def get_products_by_ids(db: Session, product_ids: List[int]):
+    """Récupère plusieurs produits en une seule requête IN"""
+    if not product_ids:
+        return []
+    return db.query(models.Product).filter(models.Product.id.in_(set(product_ids))).all()
+
 def get_products_count(db: Session):
     return db.query(models.Product).count()
 
@@ -49,6 +155,8 @@ def update_product(db: Session, product_id: int, product: schemas.ProductUpdate)
     
     db.commit()
     db.refresh(db_product)
+    sharding.router.replicate_upsert(db_product)
+    dimension_cache.cache.put(db_product)
     return db_product
 
 def delete_product(db: Session, product_id: int):
@@ -56,11 +164,19 @@ def delete_product(db: Session, product_id: int):
     if db_product:
         db.delete(db_product)
         db.commit()
+        sharding.router.replicate_delete(models.Product, product_id)
+        dimension_cache.cache.remove("products", product_id)
         return True
     return False
 
-def get_product_prices(db: Session, product_id: int):
-    return db.query(models.Price).filter(models.Price.id_product == product_id).all()
+def get_product_prices(db: Session, product_id: int) -> List["PriceRow"]:
+    results = sharding.router.fan_out(
+        db,
+        lambda price_db: _price_rows(
+            _prices_query(price_db, product_id=product_id).with_entities(*PRICE_COLUMNS)
+        )
+    )
+    return [price for prices in results for price in prices]
 
 def search_products(
     db: Session, 
@@ -72,7 +188,22 @@ def search_products(
     if title:
         query = query.filter(models.Product.title.ilike(f"%{title}%"))
     
-    if min_prices:
+    if min_prices and sharding.router.enabled:
+        # Prix comptés sur chaque shard puis additionnés par produit
+        results = sharding.router.fan_out(
+            db,
+            lambda price_db: price_db.query(models.Price.id_product, func.count(models.Price.id_product))
+            .group_by(models.Price.id_product)
+            .all()
+        )
+        counts: Dict[int, int] = {}
+        for rows in results:
+            for product_id, price_count in rows:
+                counts[product_id] = counts.get(product_id, 0) + price_count
+        query = query.filter(models.Product.id.in_(
+            [product_id for product_id, price_count in counts.items() if price_count >= min_prices]
+        ))
+    elif min_prices:
         subquery = (
             db.query(
                 models.Price.id_product,
@@ -97,19 +228,32 @@ def search_products(
 def create_sale_point(db: Session, sale_point: schemas.SalePointCreate):
     db_sale_point = models.SalePoint(**sale_point.dict())
     db.add(db_sale_point)
+    db.flush()
+    sharding.router.assign(db, db_sale_point)
     db.commit()
     db.refresh(db_sale_point)
+    sharding.router.replicate_upsert(db_sale_point)
+    dimension_cache.cache.put(db_sale_point)
     return db_sale_point
 
 def get_sale_point(db: Session, sale_point_id: int):
     return db.query(models.SalePoint).filter(models.SalePoint.id == sale_point_id).first()
 
+SALE_POINT_FIELDS = {
+    "id": models.SalePoint.id,
+    "name": models.SalePoint.name,
+    "city": models.SalePoint.city,
+    "website": models.SalePoint.website,
+    "type": models.SalePoint.type,
+}
+
 def get_sale_points(
     db: Session, 
     skip: int = 0, 
     limit: int = 100,
     city: Optional[str] = None,
-    type: Optional[str] = None
+    type: Optional[str] = None,
+    fields: Optional[List[str]] = None
 ):
     query = db.query(models.SalePoint)
     
@@ -118,6 +262,9 @@ def get_sale_points(
     if type:
         query = query.filter(models.SalePoint.type == type)
     
+    if fields:
+        names, columns = sparse_columns(SALE_POINT_FIELDS, fields)
+        return _sparse_rows(query.with_entities(*columns).offset(skip).limit(limit), names)
     return query.offset(skip).limit(limit).all()
 
 def get_sale_points_count(
@@ -139,18 +286,26 @@ def update_sale_point(db: Session, sale_point_id: int, sale_point: schemas.SaleP
     if not db_sale_point:
         return None
     
+    # Les prix restent sur le shard de la ville d'origine
+    sharding.router.assign(db, db_sale_point)
     for key, value in sale_point.dict(exclude_unset=True).items():
         setattr(db_sale_point, key, value)
     
     db.commit()
     db.refresh(db_sale_point)
+    sharding.router.replicate_upsert(db_sale_point)
+    dimension_cache.cache.put(db_sale_point)
     return db_sale_point
 
 def delete_sale_point(db: Session, sale_point_id: int):
     db_sale_point = get_sale_point(db, sale_point_id)
     if db_sale_point:
+        db.query(models.SalePointShard).filter(models.SalePointShard.id_sale_point == sale_point_id).delete()
         db.delete(db_sale_point)
         db.commit()
+        sharding.router.unassign(sale_point_id)
+        sharding.router.replicate_delete(models.SalePoint, sale_point_id)
+        dimension_cache.cache.remove("sale_points", sale_point_id)
         return True
     return False
 
@@ -163,6 +318,8 @@ def create_date(db: Session, date_data: schemas.DateCreate):
     db.add(db_date)
     db.commit()
     db.refresh(db_date)
+    sharding.router.replicate_upsert(db_date)
+    dimension_cache.cache.put(db_date)
     return db_date
 
 def create_date_from_iso(db: Session, date_iso: str):
@@ -176,6 +333,8 @@ def create_date_from_iso(db: Session, date_iso: str):
         db.add(db_date)
         db.commit()
         db.refresh(db_date)
+        sharding.router.replicate_upsert(db_date)
+        dimension_cache.cache.put(db_date)
         return db_date
     except ValueError:
         raise ValueError("Invalid date format. Use YYYY-MM-DD")
@@ -204,6 +363,8 @@ def delete_date(db: Session, date_id: int):
     if db_date:
         db.delete(db_date)
         db.commit()
+        sharding.router.replicate_delete(models.Date, date_id)
+        dimension_cache.cache.remove("dates", date_id)
         return True
     return False
 
@@ -211,37 +372,178 @@ def delete_date(db: Session, date_id: int):
 # CRUD POUR LES PRIX
 # ============================================================================
 
-def create_price(db: Session, price: schemas.PriceCreate):
-    db_price = models.Price(
-        id_product=price.id_product,
-        id_sale_point=price.id_sale_point,
-        id_date=price.id_date,
-        price=price.price
+def _price_conflict_update(excluded) -> dict:
+    """Colonnes modifiées quand un prix existe déjà pour ce produit, point de vente et date"""
+    return {
+        "price": excluded.price,
+        # Une même observation renvoyée (nouvel essai) ne raccourcit pas la validité déjà prolongée
+        "id_date_last_seen": case(
+            (models.Price.price == excluded.price,
+             func.coalesce(models.Price.id_date_last_seen, excluded.id_date_last_seen)),
+            else_=excluded.id_date_last_seen
+        )
+    }
+
+def _last_seen_key():
+    """Clé YYYYMMDD de id_date_last_seen (sous-requête corrélée à la ligne de prix)"""
+    return (
+        select(date_key_column())
+        .where(models.Date.id == models.Price.id_date_last_seen)
+        .scalar_subquery()
     )
-    db.add(db_price)
-    db.commit()
-    db.refresh(db_price)
+
+def _validity_covers(db: Session, ext: price_dedup.ValidityExtension) -> bool:
+    """La ligne est déjà prolongée jusqu'à cette date (observation renvoyée)"""
+    return db.query(
+        exists().where(
+            models.Price.id_product == ext.id_product,
+            models.Price.id_sale_point == ext.id_sale_point,
+            models.Price.id_date == ext.id_date,
+            models.Price.price == ext.price,
+            _last_seen_key() >= ext.last_seen_key
+        )
+    ).scalar()
+
+def _date_keys(db: Session, date_ids) -> Dict[int, int]:
+    """Clé YYYYMMDD de chaque date connue (cache des dimensions)"""
+    keys = {}
+    for date_id in date_ids:
+        row = dimension_cache.cache.date(db, date_id)
+        if row is not None:
+            keys[date_id] = date_to_key(row)
+    return keys
+
+def _ingest_changes(db: Session, prices: List[schemas.PriceCreate]) -> List[dict]:
+    """Insère uniquement les prix qui changent et prolonge la validité des autres"""
+    price_dedup.cache.fill(db, {(p.id_product, p.id_sale_point) for p in prices})
+    plan = price_dedup.cache.plan(prices, _date_keys(db, {p.id_date for p in prices}))
+    changes = list(plan.changes)
+    try:
+        upsert(db, models.Price, changes, _price_conflict_update)
+        newer = aliased(models.Price)
+        newer_date = aliased(models.Date)
+        for ext in plan.extensions:
+            # Ne prolonger que si aucune observation (d'un autre worker ou de ce lot) ne tombe dans l'intervalle
+            result = db.execute(
+                update(models.Price)
+                .where(
+                    models.Price.id_product == ext.id_product,
+                    models.Price.id_sale_point == ext.id_sale_point,
+                    models.Price.id_date == ext.id_date,
+                    or_(
+                        models.Price.id_date_last_seen.is_(None),
+                        _last_seen_key() < ext.last_seen_key
+                    ),
+                    ~exists().where(
+                        newer.id_product == ext.id_product,
+                        newer.id_sale_point == ext.id_sale_point,
+                        newer.id_date == newer_date.id,
+                        date_key_column(newer_date) > ext.date_key,
+                        date_key_column(newer_date) <= ext.last_seen_key
+                    )
+                )
+                .values(id_date_last_seen=ext.id_date_last_seen)
+            )
+            if result.rowcount == 0 and not _validity_covers(db, ext) \
+                    and _get_price(db, ext.id_product, ext.id_sale_point, ext.id_date_last_seen) is None:
+                row = {
+                    "id_product": ext.id_product,
+                    "id_sale_point": ext.id_sale_point,
+                    "id_date": ext.id_date_last_seen,
+                    "price": ext.price,
+                    "id_date_last_seen": None
+                }
+                upsert(db, models.Price, [row], _price_conflict_update)
+                changes.append(row)
+                price_dedup.cache.forget([(ext.id_product, ext.id_sale_point)])
+        db.commit()
+    except Exception:
+        db.rollback()
+        price_dedup.cache.forget({(p.id_product, p.id_sale_point) for p in prices})
+        raise
+    return changes
+
+def create_price(db: Session, price: schemas.PriceCreate):
+    # Les prix sont écrits sur le shard de leur point de vente, les alertes sur la base principale
+    with sharding.router.session(db, sharding.router.shard_of(db, price.id_sale_point)) as price_db:
+        if price_dedup.cache.enabled:
+            for row in _ingest_changes(price_db, [price]):
+                events.broker.publish("price.created", row["id_product"], row["id_sale_point"], row["id_date"], row["price"])
+            alerts.engine.evaluate(db, [price])
+            # Ligne effective : la plus récente à cette date dans l'ordre du calendrier (éventuellement prolongée)
+            date_key = date_key_column()
+            return (
+                price_db.query(models.Price)
+                .join(models.Date, models.Price.id_date == models.Date.id)
+                .filter(
+                    models.Price.id_product == price.id_product,
+                    models.Price.id_sale_point == price.id_sale_point,
+                    date_key <= _date_keys(price_db, [price.id_date]).get(price.id_date, 0)
+                )
+                .order_by(date_key.desc())
+                .first()
+            )
+
+        # Un prix déjà présent à cette date est remplacé (nouvel essai du client)
+        upsert(price_db, models.Price, [price.dict()], _price_conflict_update)
+        price_db.commit()
+    db_price = PriceRow(**price.dict())
+    events.broker.publish("price.created", db_price.id_product, db_price.id_sale_point, db_price.id_date, db_price.price)
+    alerts.engine.evaluate(db, [db_price])
     return db_price
   
 
-def get_price(db: Session,product_id: int,sale_point_id: int,date_id: int):
-    return(
-        db.query(models.Price)
-        .filter(
+def create_prices(db: Session, prices: List[schemas.PriceCreate]):
+    """Insère plusieurs prix dans une seule transaction (commit groupé) par shard"""
+    if not prices:
+        return 0
+    rows = []
+    for shard, shard_prices in sharding.router.partition(db, prices).items():
+        with sharding.router.session(db, shard) as price_db:
+            if price_dedup.cache.enabled:
+                rows.extend(_ingest_changes(price_db, shard_prices))
+            else:
+                shard_rows = [price.dict() for price in shard_prices]
+                upsert(price_db, models.Price, shard_rows, _price_conflict_update)
+                price_db.commit()
+                rows.extend(shard_rows)
+    for row in rows:
+        events.broker.publish("price.created", row["id_product"], row["id_sale_point"], row["id_date"], row["price"])
+    alerts.engine.evaluate(db, prices)
+    return len(rows)
+
+class PriceRow(NamedTuple):
+    """Prix en lecture seule, chargé sans passer par l'identity map de la session"""
+    id_product: int
+    id_sale_point: int
+    id_date: int
+    price: float
+
+PRICE_COLUMNS = (models.Price.id_product, models.Price.id_sale_point, models.Price.id_date, models.Price.price)
+PRICE_FIELDS = dict(zip(PriceRow._fields, PRICE_COLUMNS))
+
+def _price_rows(query) -> List[PriceRow]:
+    return [PriceRow._make(r) for r in query.yield_per(10000)]
+
+def _get_price(db: Session, product_id: int, sale_point_id: int, date_id: int):
+    return db.execute(
+        lambda_stmt(lambda: select(models.Price).where(
             models.Price.id_product == product_id,
             models.Price.id_sale_point == sale_point_id,
-            models.Price.id_date == date_id)
-        ).first()
+            models.Price.id_date == date_id
+        ))
+    ).scalars().first()
+
+def get_price(db: Session,product_id: int,sale_point_id: int,date_id: int):
+    with sharding.router.session(db, sharding.router.shard_of(db, sale_point_id)) as price_db:
+        return _get_price(price_db, product_id, sale_point_id, date_id)
     
-	
-def get_prices(
+def _prices_query(
     db: Session,
-    skip: int = 0,
-    limit: int = 10,
     product_id: Optional[int] = None,
     sale_point_id: Optional[int] = None,
     date_id: Optional[int] = None
-) -> List[models.Price]:
+):
     query = db.query(models.Price)
     if product_id is not None:
         query = query.filter(models.Price.id_product == product_id)
@@ -249,67 +551,278 @@ def get_prices(
         query = query.filter(models.Price.id_sale_point == sale_point_id)
     if date_id is not None:
         query = query.filter(models.Price.id_date == date_id)
-    return query.offset(skip).limit(limit).all()
+    return query
+	
+def get_prices(
+    db: Session,
+    skip: int = 0,
+    limit: int = 10,
+    product_id: Optional[int] = None,
+    sale_point_id: Optional[int] = None,
+    date_id: Optional[int] = None,
+    fields: Optional[List[str]] = None
+) -> List[PriceRow]:
+    """Prix paginés ; avec `fields`, des dictionnaires limités aux colonnes demandées"""
+    names, columns = sparse_columns(PRICE_FIELDS, fields) if fields else (None, PRICE_COLUMNS)
+    if sale_point_id is not None or not sharding.router.enabled:
+        shard = sharding.router.shard_of(db, sale_point_id) if sale_point_id is not None else None
+        with sharding.router.session(db, shard) as price_db:
+            query = (
+                _prices_query(price_db, product_id, sale_point_id, date_id)
+                .with_entities(*columns)
+                .offset(skip)
+                .limit(limit)
+            )
+            return _price_rows(query) if names is None else _sparse_rows(query, names)
+
+    # Pagination répartie : les skip + limit premières lignes de chaque shard, fusionnées par clé
+    order = (models.Price.id_product, models.Price.id_sale_point, models.Price.id_date)
+    if names is not None:
+        # La clé de fusion est lue en plus des champs demandés
+        results = sharding.router.fan_out(
+            db,
+            lambda price_db: (
+                _prices_query(price_db, product_id, sale_point_id, date_id)
+                .with_entities(*order, *columns)
+                .order_by(*order)
+                .limit(skip + limit)
+                .all()
+            )
+        )
+        merged = heapq.merge(*results, key=lambda r: tuple(r[:3]))
+        return [dict(zip(names, r[3:])) for r in islice(merged, skip, skip + limit)]
+    results = sharding.router.fan_out(
+        db,
+        lambda price_db: _price_rows(
+            _prices_query(price_db, product_id, sale_point_id, date_id)
+            .with_entities(*PRICE_COLUMNS)
+            .order_by(*order)
+            .limit(skip + limit)
+        )
+    )
+    merged = heapq.merge(*results, key=lambda p: (p.id_product, p.id_sale_point, p.id_date))
+    return list(islice(merged, skip, skip + limit))
+
+def _price_shard_results(db: Session, sale_point_id: Optional[int], fn) -> list:
+    """fn sur le shard du point de vente s'il est connu, sinon sur chaque shard"""
+    if sale_point_id:
+        with sharding.router.session(db, sharding.router.shard_of(db, sale_point_id)) as price_db:
+            return [fn(price_db)]
+    return sharding.router.fan_out(db, fn)
+
+def count_prices(
+    db: Session,
+    product_id: Optional[int] = None,
+    sale_point_id: Optional[int] = None,
+    date_id: Optional[int] = None
+) -> int:
+    return sum(sharding.router.fan_out(
+        db, lambda price_db: _prices_query(price_db, product_id, sale_point_id, date_id).count()
+    ))
 
 def get_prices_count(db: Session):
-    return db.query(models.Price).count()
+    return count_prices(db)
 
 def delete_price(db: Session, product_id: int, sale_point_id: int, date_id: int):
-    db_price = get_price(db, product_id, sale_point_id, date_id)
-    if db_price:
-        db.delete(db_price)
-        db.commit()
-        return True
-    return False
+    with sharding.router.session(db, sharding.router.shard_of(db, sale_point_id)) as price_db:
+        db_price = _get_price(price_db, product_id, sale_point_id, date_id)
+        if not db_price:
+            return False
+        price_db.delete(db_price)
+        price_db.commit()
+    price_dedup.cache.forget([(product_id, sale_point_id)])
+    events.broker.publish("price.deleted", product_id, sale_point_id, date_id)
+    return True
 
-def get_price_history(
-    db: Session, 
-    product_id: int, 
-    sale_point_id: Optional[int] = None,
-    start_date: Optional[str] = None,
-    end_date: Optional[str] = None
-):
-    query = (
+def _daily_price_series(db: Session, product_id: int, sale_point_id: Optional[int] = None):
+    """Reconstitue une ligne par jour à partir des intervalles de validité des prix"""
+    first_day = aliased(models.Date)
+    last_day = aliased(models.Date)
+    day = aliased(models.Date)
+    start_key = date_key_column(first_day)
+    observations = (
         db.query(
-            models.Date.id.label("date_id"),
-            models.Date.day,
-            models.Date.month,
-            models.Date.year,
+            models.Price.id_sale_point,
             models.Price.price,
-            models.SalePoint.id.label("sale_point_id"),
-            models.SalePoint.name.label("sale_point_name")
+            start_key.label("start_key"),
+            func.coalesce(date_key_column(last_day), start_key).label("last_seen_key"),
+            func.lead(start_key).over(
+                partition_by=[models.Price.id_sale_point],
+                order_by=[start_key]
+            ).label("next_key")
         )
-        .join(models.Date, models.Price.id_date == models.Date.id)
-        .join(models.SalePoint, models.Price.id_sale_point == models.SalePoint.id)
+        .join(first_day, models.Price.id_date == first_day.id)
+        .outerjoin(last_day, models.Price.id_date_last_seen == last_day.id)
         .filter(models.Price.id_product == product_id)
-        .order_by(models.Date.year, models.Date.month, models.Date.day)
+        .filter(*([models.Price.id_sale_point == sale_point_id] if sale_point_id else []))
+        .subquery()
     )
-    
-    if sale_point_id:
-        query = query.filter(models.Price.id_sale_point == sale_point_id)
-    
-    if start_date:
-        start_date_obj = datetime.strptime(start_date, "%Y-%m-%d").date()
-        query = query.filter(
-            and_(
-                models.Date.year >= start_date_obj.year,
-                models.Date.month >= start_date_obj.month,
-                models.Date.day >= start_date_obj.day
-            )
+    day_key = date_key_column(day)
+    if price_dedup.cache.strategy == "skip":
+        # Sans intervalle stocké, un prix reste valable jusqu'à l'observation suivante
+        validity = or_(observations.c.next_key.is_(None), day_key < observations.c.next_key)
+    else:
+        validity = day_key <= observations.c.last_seen_key
+    return (
+        db.query(
+            day.id.label("date_id"),
+            day.day,
+            day.month,
+            day.year,
+            observations.c.price,
+            observations.c.id_sale_point.label("sale_point_id")
         )
-    
-    if end_date:
-        end_date_obj = datetime.strptime(end_date, "%Y-%m-%d").date()
-        query = query.filter(
-            and_(
-                models.Date.year <= end_date_obj.year,
-                models.Date.month <= end_date_obj.month,
-                models.Date.day <= end_date_obj.day
+        .select_from(observations)
+        .join(day, and_(day_key >= observations.c.start_key, validity))
+        .order_by(day.year, day.month, day.day, observations.c.id_sale_point)
+    ), day
+
+def _price_history_query(
+    db: Session, 
+    product_id: int, 
+    sale_point_id: Optional[int] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    fill_daily: Optional[bool] = None
+):
+    if fill_daily is None:
+        fill_daily = price_dedup.cache.enabled
+
+    # Les noms des points de vente sont ajoutés depuis le cache des dimensions
+    if fill_daily:
+        query, dates = _daily_price_series(db, product_id, sale_point_id)
+    else:
+        dates = models.Date
+        query = (
+            db.query(
+                models.Date.id.label("date_id"),
+                models.Date.day,
+                models.Date.month,
+                models.Date.year,
+                models.Price.price,
+                models.Price.id_sale_point.label("sale_point_id")
             )
+            .join(models.Date, models.Price.id_date == models.Date.id)
+            .filter(models.Price.id_product == product_id)
+            .order_by(models.Date.year, models.Date.month, models.Date.day, models.Price.id_sale_point)
         )
+        if sale_point_id:
+            query = query.filter(models.Price.id_sale_point == sale_point_id)
     
+    return query.filter(*date_range_filters(start_date, end_date, dates))
+
+class HistoryRow(NamedTuple):
+    """Ligne d'historique des prix (requête SQL, archives ou fusion des deux)"""
+    date_id: int
+    day: int
+    month: int
+    year: int
+    price: float
+    sale_point_id: int
+
+class HistoryColumns:
+    """Historique des prix stocké en colonnes typées (array) plutôt qu'en objets par ligne
+
+    Chaque ligne occupe 32 octets, contre plusieurs centaines pour un objet
+    Row ou des dictionnaires imbriqués : un historique d'un million de lignes
+    tient en une trentaine de Mo. Les lignes sont relues à la demande sous
+    forme de HistoryRow.
+    """
+
+    __slots__ = HistoryRow._fields
+    TYPECODES = ("q", "B", "B", "H", "d", "q")
+
+    def __init__(self, rows=(), chunk_size: int = 10000):
+        for name, typecode in zip(self.__slots__, self.TYPECODES):
+            setattr(self, name, array(typecode))
+        self.extend(rows, chunk_size)
+
+    def extend(self, rows, chunk_size: int = 10000):
+        """Ajoute des lignes (tuples dans l'ordre de HistoryRow) par tranches"""
+        rows = iter(rows)
+        columns = [getattr(self, name) for name in self.__slots__]
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            for values, column in zip(zip(*chunk), columns):
+                column.extend(values)
+
+    def __len__(self) -> int:
+        return len(self.date_id)
+
+    def __iter__(self):
+        return map(HistoryRow._make, zip(*(getattr(self, name) for name in self.__slots__)))
+
+    def columns(self) -> Dict[str, array]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+def _archived_history_rows(
+    db: Session,
+    product_id: int,
+    sale_point_id: Optional[int],
+    start_date: Optional[str],
+    end_date: Optional[str],
+    fill_daily: bool
+) -> HistoryColumns:
+    start_key = date_to_key(datetime.strptime(start_date, "%Y-%m-%d").date()) if start_date else None
+    end_key = date_to_key(datetime.strptime(end_date, "%Y-%m-%d").date()) if end_date else None
+    if fill_daily:
+        entries = archive.store.daily_prices(db, product_id, sale_point_id, start_key, end_key, price_dedup.cache.strategy)
+    else:
+        entries = (
+            (r.date_key, r.id_date, r.id_sale_point, r.price)
+            for r in archive.store.prices(product_id, sale_point_id, start_key, end_key)
+        )
+    return HistoryColumns(
+        (id_date, key % 100, key // 100 % 100, key // 10000, price, sp_id)
+        for key, id_date, sp_id, price in entries
+    )
+
+def _sale_point_names(db: Session, sale_point_ids) -> Dict[int, str]:
+    names = {}
+    for sale_point_id in sale_point_ids:
+        sale_point = dimension_cache.cache.sale_point(db, sale_point_id)
+        names[sale_point_id] = sale_point.name if sale_point else None
+    return names
+
+def _price_history_rows(
+    db: Session, 
+    product_id: int, 
+    sale_point_id: Optional[int] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    fill_daily: Optional[bool] = None
+) -> HistoryColumns:
+    """Lignes d'historique triées par date, fusionnées entre shards et archives si nécessaire"""
+    if fill_daily is None:
+        fill_daily = price_dedup.cache.enabled
+    # Lecture en flux (yield_per) directement vers les colonnes, sans liste d'objets Row
+    results = _price_shard_results(
+        db,
+        sale_point_id,
+        lambda price_db: HistoryColumns(
+            _price_history_query(price_db, product_id, sale_point_id, start_date, end_date, fill_daily).yield_per(10000)
+        )
+    )
+    archived = _archived_history_rows(db, product_id, sale_point_id, start_date, end_date, fill_daily)
+    if len(archived):
+        results.append(archived)
+    if len(results) == 1:
+        return results[0]
+    return HistoryColumns(heapq.merge(*results, key=lambda r: (r.year, r.month, r.day, r.sale_point_id)))
+
+def get_price_history(
+    db: Session, 
+    product_id: int, 
+    sale_point_id: Optional[int] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    fill_daily: Optional[bool] = None
+):
     # Transformer les résultats en structure appropriée
-    results = query.all()
+    results = _price_history_rows(db, product_id, sale_point_id, start_date, end_date, fill_daily)
+    names = _sale_point_names(db, set(results.sale_point_id))
     price_history = []
     
     for r in results:
@@ -323,68 +836,526 @@ def get_price_history(
             "price": r.price,
             "sale_point": {
                 "id": r.sale_point_id,
-                "name": r.sale_point_name
+                "name": names.get(r.sale_point_id)
             }
         })
     
     return price_history
 
+def get_price_history_columns(
+    db: Session, 
+    product_id: int, 
+    sale_point_id: Optional[int] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    fill_daily: Optional[bool] = None
+) -> tuple:
+    """Historique des prix en colonnes, avec les noms des points de vente concernés"""
+    results = _price_history_rows(db, product_id, sale_point_id, start_date, end_date, fill_daily)
+    return results.columns(), _sale_point_names(db, set(results.sale_point_id))
+
+def get_price_history_json(
+    db: Session, 
+    product_id: int, 
+    sale_point_id: Optional[int] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    fill_daily: Optional[bool] = None
+) -> bytes:
+    """Historique des prix déjà encodé en JSON, l'encodage des gros résultats étant
+    confié au pool de processus"""
+    columns, names = get_price_history_columns(db, product_id, sale_point_id, start_date, end_date, fill_daily)
+    return offload.pool.run("price_history_json", encode_price_history, columns, names)
+
+HISTORY_BUCKETS = ("day", "week", "month")
+
+def _history_bucket_column(bucket: str):
+    """Expression SQL identifiant le bucket temporel d'une observation"""
+    if bucket == "month":
+        return models.Date.year * 100 + models.Date.month
+    if bucket == "week":
+        # Semaines commençant le lundi (le 1970-01-01 est un jeudi)
+        return (epoch_days_column() + 3) // 7
+    return date_key_column()
+
+def _history_bucket_start(bucket: str, value: int):
+    """Date de début d'un bucket à partir de son identifiant"""
+    if bucket == "month":
+        return date(value // 100, value % 100, 1)
+    if bucket == "week":
+        return date(1970, 1, 1) + timedelta(days=value * 7 - 3)
+    return key_to_date(value)
+
+def _history_bucket_of(bucket: str, date_key: int) -> int:
+    """Identifiant du bucket d'une clé YYYYMMDD (même valeur que _history_bucket_column)"""
+    if bucket == "month":
+        return date_key // 100
+    if bucket == "week":
+        return ((key_to_date(date_key) - date(1970, 1, 1)).days + 3) // 7
+    return date_key
+
+def _choose_history_bucket(
+    db: Session,
+    filters: list,
+    max_points: int,
+    sale_point_id: Optional[int] = None,
+    archived: List[archive.ArchivedPrice] = ()
+) -> str:
+    """Choisit le bucket le plus fin dont le nombre de points reste sous max_points"""
+    date_key = date_key_column()
+    bounds = [
+        bound for bound in _price_shard_results(
+            db,
+            sale_point_id,
+            lambda price_db: price_db.query(func.min(date_key), func.max(date_key))
+            .select_from(models.Price)
+            .join(models.Date, models.Price.id_date == models.Date.id)
+            .filter(*filters)
+            .one()
+        )
+        if bound[0] is not None
+    ]
+    if archived:
+        bounds.append((archived[0].date_key, archived[-1].date_key))
+    if not bounds:
+        return "day"
+    first_key = min(bound[0] for bound in bounds)
+    last_key = max(bound[1] for bound in bounds)
+    span_days = (key_to_date(last_key) - key_to_date(first_key)).days + 1
+    if span_days <= max_points:
+        return "day"
+    if span_days // 7 + 2 <= max_points:
+        return "week"
+    return "month"
+
+def get_price_history_buckets(
+    db: Session,
+    product_id: int,
+    sale_point_id: Optional[int] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    bucket: Optional[str] = None,
+    max_points: Optional[int] = None
+):
+    """Historique agrégé par bucket (premier/dernier/min/max/moyenne), borné par max_points"""
+    filters = [models.Price.id_product == product_id]
+    if sale_point_id:
+        filters.append(models.Price.id_sale_point == sale_point_id)
+    filters.extend(date_range_filters(start_date, end_date))
+    # Les prix archivés sont agrégés en Python puis fusionnés avec ceux des shards
+    archived = archive.store.prices(
+        product_id,
+        sale_point_id,
+        date_to_key(datetime.strptime(start_date, "%Y-%m-%d").date()) if start_date else None,
+        date_to_key(datetime.strptime(end_date, "%Y-%m-%d").date()) if end_date else None
+    )
+
+    if bucket is None:
+        bucket = _choose_history_bucket(db, filters, max_points, sale_point_id, archived) if max_points else "day"
+
+    date_key = date_key_column()
+    bucket_column = _history_bucket_column(bucket)
+    window = {
+        "partition_by": [bucket_column],
+        "order_by": [date_key, models.Price.id_sale_point],
+        "rows": (None, None)
+    }
+
+    def shard_buckets(price_db: Session):
+        observations = (
+            price_db.query(
+                bucket_column.label("bucket"),
+                date_key.label("date_key"),
+                models.Price.id_sale_point,
+                models.Price.price,
+                func.first_value(models.Price.price).over(**window).label("first_price"),
+                func.last_value(models.Price.price).over(**window).label("last_price"),
+                func.first_value(models.Price.id_sale_point).over(**window).label("first_sale_point"),
+                func.last_value(models.Price.id_sale_point).over(**window).label("last_sale_point")
+            )
+            .join(models.Date, models.Price.id_date == models.Date.id)
+            .filter(*filters)
+            .subquery()
+        )
+        return (
+            price_db.query(
+                observations.c.bucket,
+                func.min(observations.c.date_key).label("first_key"),
+                func.max(observations.c.date_key).label("last_key"),
+                func.min(observations.c.first_sale_point).label("first_sale_point"),
+                func.min(observations.c.last_sale_point).label("last_sale_point"),
+                func.min(observations.c.first_price).label("first_price"),
+                func.min(observations.c.last_price).label("last_price"),
+                func.min(observations.c.price).label("min_price"),
+                func.max(observations.c.price).label("max_price"),
+                func.sum(observations.c.price).label("price_sum"),
+                func.count(observations.c.price).label("price_count"),
+                func.count(func.distinct(observations.c.id_sale_point)).label("sale_point_count")
+            )
+            .group_by(observations.c.bucket)
+            .all()
+        )
+
+    merged: Dict[int, dict] = {}
+
+    def fold(r: dict):
+        m = merged.get(r["bucket"])
+        if m is None:
+            merged[r["bucket"]] = r
+            return
+        if (r["first_key"], r["first_sale_point"]) < (m["first_key"], m["first_sale_point"]):
+            m.update(first_key=r["first_key"], first_sale_point=r["first_sale_point"], first_price=r["first_price"])
+        if (r["last_key"], r["last_sale_point"]) > (m["last_key"], m["last_sale_point"]):
+            m.update(last_key=r["last_key"], last_sale_point=r["last_sale_point"], last_price=r["last_price"])
+        m["min_price"] = min(m["min_price"], r["min_price"])
+        m["max_price"] = max(m["max_price"], r["max_price"])
+        m["price_sum"] += r["price_sum"]
+        m["price_count"] += r["price_count"]
+        m["sale_point_count"] += r["sale_point_count"]
+
+    # Fusion des buckets de chaque shard (les points de vente d'un shard lui sont propres)
+    for shard_rows in _price_shard_results(db, sale_point_id, shard_buckets):
+        for r in shard_rows:
+            fold(dict(r._mapping))
+
+    # Agrégats des prix archivés (triés par date puis point de vente)
+    archived_buckets: Dict[int, dict] = {}
+    for r in archived:
+        b = _history_bucket_of(bucket, r.date_key)
+        a = archived_buckets.get(b)
+        if a is None:
+            archived_buckets[b] = a = {
+                "bucket": b,
+                "first_key": r.date_key,
+                "first_sale_point": r.id_sale_point,
+                "first_price": r.price,
+                "min_price": r.price,
+                "max_price": r.price,
+                "price_sum": 0.0,
+                "price_count": 0,
+                "sale_points": set()
+            }
+        a.update(last_key=r.date_key, last_sale_point=r.id_sale_point, last_price=r.price)
+        a["min_price"] = min(a["min_price"], r.price)
+        a["max_price"] = max(a["max_price"], r.price)
+        a["price_sum"] += r.price
+        a["price_count"] += 1
+        a["sale_points"].add(r.id_sale_point)
+
+    # Un bucket à cheval sur la date d'archivage a des points de vente communs aux deux sources :
+    # leur nombre est recompté à partir des identifiants plutôt qu'additionné
+    overlap = [b for b in archived_buckets if b in merged]
+    if overlap:
+        for shard_rows in _price_shard_results(
+            db,
+            sale_point_id,
+            lambda price_db: price_db.query(bucket_column, models.Price.id_sale_point)
+            .join(models.Date, models.Price.id_date == models.Date.id)
+            .filter(*filters, bucket_column.in_(overlap))
+            .distinct()
+            .all()
+        ):
+            for b, sp_id in shard_rows:
+                archived_buckets[b]["sale_points"].add(sp_id)
+    for b, a in archived_buckets.items():
+        sale_point_count = len(a.pop("sale_points"))
+        if b in merged:
+            a["sale_point_count"] = 0
+            fold(a)
+            merged[b]["sale_point_count"] = sale_point_count
+        else:
+            fold({**a, "sale_point_count": sale_point_count})
+
+    rows = [merged[b] for b in sorted(merged)]
+    for r in rows:
+        r["avg_price"] = r.pop("price_sum") / r["price_count"]
+
+    if max_points and len(rows) > max_points:
+        # Réduction LTTB sur la moyenne pour garantir un nombre de points borné
+        kept = offload.pool.run(
+            "history_lttb",
+            lttb_indices,
+            {
+                "x": array("d", [_history_bucket_start(bucket, r["bucket"]).toordinal() for r in rows]),
+                "y": array("d", [r["avg_price"] for r in rows])
+            },
+            max_points
+        )
+        rows = [rows[i] for i in kept]
+
+    return [
+        {
+            "bucket": bucket,
+            "bucket_start": _history_bucket_start(bucket, r["bucket"]).isoformat(),
+            "first_price": r["first_price"],
+            "last_price": r["last_price"],
+            "min_price": r["min_price"],
+            "max_price": r["max_price"],
+            "avg_price": r["avg_price"],
+            "price_count": r["price_count"],
+            "sale_point_count": r["sale_point_count"]
+        }
+        for r in rows
+    ]
+
+COMPARISON_FIELDS = {
+    "sale_point_id": models.Price.id_sale_point,
+    "sale_point_name": models.SalePoint.name,
+    "price": models.Price.price,
+    "date_id": models.Price.id_date,
+}
+
+def _date_id(db: Session, day: date) -> Optional[int]:
+    """Identifiant de la date du calendrier, None si elle est inconnue"""
+    year, month, day_of_month = day.year, day.month, day.day
+    return db.execute(
+        lambda_stmt(lambda: select(models.Date.id).where(
+            models.Date.year == year,
+            models.Date.month == month,
+            models.Date.day == day_of_month
+        ))
+    ).scalars().first()
+
 def get_price_comparison(
     db: Session, 
     product_id: int, 
-    specific_date: Optional[str] = None
+    specific_date: Optional[str] = None,
+    fields: Optional[List[str]] = None,
+    as_of: bool = False
 ):
+    if specific_date and as_of:
+        # Dernier prix de chaque point de vente au plus tard à cette date, même sans observation ce jour-là
+        names = sparse_columns(COMPARISON_FIELDS, fields)[0]
+        snapshot = get_prices_as_of(db, product_id, [datetime.strptime(specific_date, "%Y-%m-%d").date()])[0]
+        return [{name: price[name] for name in names} for price in snapshot["prices"]]
     if specific_date:
-        date_obj = datetime.strptime(specific_date, "%Y-%m-%d").date()
-        date_record = (
-            db.query(models.Date)
-            .filter(
-                models.Date.year == date_obj.year,
-                models.Date.month == date_obj.month,
-                models.Date.day == date_obj.day
+        date_filter = _date_id(db, datetime.strptime(specific_date, "%Y-%m-%d").date())
+    else:
+        # Dernière date à laquelle ce produit a un prix, tous shards confondus
+        latest = sharding.router.fan_out(
+            db,
+            lambda price_db: price_db.execute(
+                lambda_stmt(lambda: select(func.max(models.Price.id_date)).where(models.Price.id_product == product_id))
+            ).scalar()
+        )
+        date_filter = max((date_id for date_id in latest if date_id is not None), default=None)
+    if not date_filter:
+        return []
+    
+    if fields:
+        # Jointure des points de vente seulement si leur nom est demandé
+        names, columns = sparse_columns(COMPARISON_FIELDS, fields)
+
+        def load(price_db: Session):
+            query = price_db.query(*columns).select_from(models.Price)
+            if "sale_point_name" in names:
+                query = query.join(models.SalePoint, models.Price.id_sale_point == models.SalePoint.id)
+            return _sparse_rows(
+                query.filter(models.Price.id_product == product_id, models.Price.id_date == date_filter),
+                names
+            )
+
+        return [row for rows in sharding.router.fan_out(db, load) for row in rows]
+
+    results = sharding.router.fan_out(
+        db,
+        lambda price_db: price_db.execute(
+            lambda_stmt(lambda: select(
+                models.Price.id_sale_point.label("sale_point_id"),
+                models.SalePoint.name.label("sale_point_name"),
+                models.Price.price,
+                models.Price.id_date.label("date_id")
+            )
+            .join(models.SalePoint, models.Price.id_sale_point == models.SalePoint.id)
+            .where(models.Price.id_product == product_id, models.Price.id_date == date_filter))
+        ).all()
+    )
+    return [row for rows in results for row in rows]
+
+def get_price_comparisons(
+    db: Session,
+    product_ids: List[int],
+    specific_date: Optional[date] = None
+) -> Dict[int, list]:
+    """Comparaison des prix pour plusieurs produits en une seule requête, groupée par produit"""
+    comparisons = {product_id: [] for product_id in product_ids}
+    if not product_ids:
+        return comparisons
+
+    def query(price_db: Session):
+        return (
+            price_db.query(
+                models.Price.id_product,
+                models.SalePoint.id.label("sale_point_id"),
+                models.SalePoint.name.label("sale_point_name"),
+                models.Price.price,
+                models.Price.id_date.label("date_id")
             )
-            .first()
+            .join(models.SalePoint, models.Price.id_sale_point == models.SalePoint.id)
+            .filter(models.Price.id_product.in_(set(product_ids)))
+        )
+
+    if specific_date:
+        date_id = _date_id(db, specific_date)
+        if not date_id:
+            return comparisons
+        results = sharding.router.fan_out(
+            db, lambda price_db: query(price_db).filter(models.Price.id_date == date_id).all()
         )
-        if not date_record:
-            return []
-        date_filter = date_record.id
     else:
-        latest_date = (
-            db.query(func.max(models.Date.id))
-            .select_from(models.Price)
-            .filter(models.Price.id_product == product_id)
-            .scalar()
+        # Dernière date connue pour chaque produit, comme get_price_comparison
+        def latest_rows(price_db: Session):
+            latest_dates = (
+                price_db.query(
+                    models.Price.id_product,
+                    func.max(models.Price.id_date).label("max_date_id")
+                )
+                .filter(models.Price.id_product.in_(set(product_ids)))
+                .group_by(models.Price.id_product)
+                .subquery()
+            )
+            return query(price_db).join(latest_dates, and_(
+                models.Price.id_product == latest_dates.c.id_product,
+                models.Price.id_date == latest_dates.c.max_date_id
+            )).all()
+
+        results = sharding.router.fan_out(db, latest_rows)
+        if len(results) > 1:
+            # Chaque shard répond pour sa propre dernière date : seule la plus récente est retenue
+            latest: Dict[int, int] = {}
+            for row in (row for rows in results for row in rows):
+                latest[row.id_product] = max(latest.get(row.id_product, row.date_id), row.date_id)
+            results = [[row for row in rows if row.date_id == latest[row.id_product]] for rows in results]
+
+    for rows in results:
+        for row in rows:
+            comparisons[row.id_product].append(row)
+    return comparisons
+
+class AsOfPrice(NamedTuple):
+    id_sale_point: int
+    id_date: int
+    price: float
+    date_key: int
+
+def _prices_as_of(price_db: Session, product_id: int, cutoff_key: int, sale_point_id: Optional[int] = None) -> List[AsOfPrice]:
+    """Dernière ligne de prix au plus tard à la date `cutoff_key` (YYYYMMDD), pour chaque point de vente du produit"""
+    date_key = date_key_column()
+    filters = [models.Price.id_product == product_id, date_key <= cutoff_key]
+    if sale_point_id is not None:
+        filters.append(models.Price.id_sale_point == sale_point_id)
+    # Ordre du calendrier et non des identifiants : une date ajoutée après coup a un identifiant plus grand
+    columns = (models.Price.id_sale_point, models.Price.id_date, models.Price.price, date_key.label("date_key"))
+    if is_postgresql(price_db):
+        # DISTINCT ON sur les index couvrants ix_prices_as_of (prix du produit) et ix_dates_key (clé de date)
+        query = (
+            price_db.query(*columns)
+            .join(models.Date, models.Price.id_date == models.Date.id)
+            .filter(*filters)
+            .distinct(models.Price.id_sale_point)
+            .order_by(models.Price.id_sale_point, date_key.desc())
         )
-        if not latest_date:
-            return []
-        date_filter = latest_date
-    
-    return (
-        db.query(
-            models.SalePoint.id.label("sale_point_id"),
-            models.SalePoint.name.label("sale_point_name"),
-            models.Price.price,
-            models.Date.id.label("date_id")
+        return [AsOfPrice._make(r) for r in query]
+    ranked = (
+        price_db.query(
+            *columns,
+            func.row_number().over(
+                partition_by=models.Price.id_sale_point,
+                order_by=date_key.desc()
+            ).label("rank")
         )
-        .join(models.SalePoint, models.Price.id_sale_point == models.SalePoint.id)
+        .join(models.Date, models.Price.id_date == models.Date.id)
+        .filter(*filters)
+        .subquery()
+    )
+    query = (
+        price_db.query(ranked.c.id_sale_point, ranked.c.id_date, ranked.c.price, ranked.c.date_key)
+        .filter(ranked.c.rank == 1)
+        .order_by(ranked.c.id_sale_point)
+    )
+    return [AsOfPrice._make(r) for r in query]
+
+def _prices_between(price_db: Session, product_id: int, after_key: int, until_key: int, sale_point_id: Optional[int] = None) -> List[AsOfPrice]:
+    """Lignes de prix du produit dont la date (YYYYMMDD) est dans ]after_key, until_key]"""
+    date_key = date_key_column()
+    query = (
+        price_db.query(models.Price.id_sale_point, models.Price.id_date, models.Price.price, date_key)
         .join(models.Date, models.Price.id_date == models.Date.id)
         .filter(
             models.Price.id_product == product_id,
-            models.Price.id_date == date_filter
+            date_key > after_key,
+            date_key <= until_key
         )
-        .all()
     )
+    if sale_point_id is not None:
+        query = query.filter(models.Price.id_sale_point == sale_point_id)
+    return [AsOfPrice._make(r) for r in query]
+
+def get_prices_as_of(
+    db: Session,
+    product_id: int,
+    days: List[date],
+    sale_point_id: Optional[int] = None
+) -> List[dict]:
+    """Prix de chaque point de vente au plus tard à chaque jour demandé (instantanés)
+
+    Un instantané retient, par point de vente, la dernière observation à
+    cette date ou avant, y compris dans les archives. Pour une série de
+    jours, seul l'instantané du premier jour est calculé en SQL ; les
+    suivants sont obtenus en rejouant les observations intermédiaires.
+    Les dates sont comparées par leur clé YYYYMMDD, quel que soit l'ordre
+    de leurs identifiants.
+    """
+    days = sorted(set(days))
+    if not days:
+        return []
+    day_keys = [date_to_key(day) for day in days]
+    first, last = day_keys[0], day_keys[-1]
+    results = sharding.router.fan_out(
+        db,
+        lambda price_db: _prices_as_of(price_db, product_id, first, sale_point_id)
+        + _prices_between(price_db, product_id, first, last, sale_point_id)
+    )
+    # Les prix archivés sont antérieurs aux lignes restées en base : placés avant, celles-ci l'emportent au rejeu
+    rows = [
+        AsOfPrice(r.id_sale_point, r.id_date, r.price, r.date_key)
+        for r in archive.store.prices(product_id, sale_point_id, end_key=last)
+    ]
+    rows.extend(row for shard_rows in results for row in shard_rows)
+    rows.sort(key=lambda r: r.date_key)
+
+    names = _sale_point_names(db, {row.id_sale_point for row in rows})
+    current: Dict[int, AsOfPrice] = {}
+    position = 0
+    snapshots = []
+    for day, day_key in zip(days, day_keys):
+        while position < len(rows) and rows[position].date_key <= day_key:
+            current[rows[position].id_sale_point] = rows[position]
+            position += 1
+        snapshots.append({
+            "date": day.isoformat(),
+            "prices": [
+                {
+                    "sale_point_id": sale_point_id,
+                    "sale_point_name": names[sale_point_id],
+                    "price": row.price,
+                    "date_id": row.id_date,
+                    "observed_on": key_to_date(row.date_key).isoformat()
+                }
+                for sale_point_id, row in sorted(current.items())
+            ]
+        })
+    return snapshots
 
 # ============================================================================
 # CRUD POUR LES ASSOCIATIONS PRODUIT-POINT DE VENTE
 # ============================================================================
 
 def create_product_sale_point(db: Session, psp: schemas.ProductSalePointCreate):
-    db_psp = models.ProductSalePoint(**psp.dict())
-    db.add(db_psp)
+    # Association déjà existante : rien à faire
+    upsert(db, models.ProductSalePoint, [psp.dict()])
     db.commit()
-    db.refresh(db_psp)
-    return db_psp
+    return models.ProductSalePoint(**psp.dict())
 
 def get_product_sale_point(db: Session, product_id: int, sale_point_id: int):
     return (
@@ -420,18 +1391,196 @@ def delete_product_sale_point(db: Session, product_id: int, sale_point_id: int):
         return True
     return False
 
+# ============================================================================
+# CRUD POUR LES ALERTES DE PRIX
+# ============================================================================
+
+def create_alert(db: Session, alert: schemas.PriceAlertCreate):
+    db_alert = models.PriceAlert(**alert.dict(), active=True)
+    db.add(db_alert)
+    db.commit()
+    db.refresh(db_alert)
+    alerts.engine.add(db_alert)
+    return db_alert
+
+def get_alert(db: Session, alert_id: int):
+    return db.query(models.PriceAlert).filter(models.PriceAlert.id == alert_id).first()
+
+def get_alerts(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    product_id: Optional[int] = None,
+    active: Optional[bool] = None
+):
+    query = db.query(models.PriceAlert)
+    
+    if product_id:
+        query = query.filter(models.PriceAlert.id_product == product_id)
+    if active is not None:
+        query = query.filter(models.PriceAlert.active.is_(active))
+    
+    return query.offset(skip).limit(limit).all()
+
+def delete_alert(db: Session, alert_id: int):
+    db_alert = get_alert(db, alert_id)
+    if db_alert:
+        db.query(models.AlertOutbox).filter(models.AlertOutbox.id_alert == alert_id).delete()
+        db.delete(db_alert)
+        db.commit()
+        alerts.engine.remove(alert_id, db_alert.id_product)
+        return True
+    return False
+
+def get_alert_outbox(db: Session, limit: int = 100, pending_only: bool = True):
+    query = db.query(models.AlertOutbox)
+    
+    if pending_only:
+        query = query.filter(models.AlertOutbox.delivered_at.is_(None))
+    
+    return query.order_by(models.AlertOutbox.id).limit(limit).all()
+
+def mark_alert_delivered(db: Session, outbox_id: int):
+    db_entry = db.query(models.AlertOutbox).filter(models.AlertOutbox.id == outbox_id).first()
+    if not db_entry:
+        return None
+    db_entry.delivered_at = datetime.now()
+    db.commit()
+    db.refresh(db_entry)
+    return db_entry
+
+# ============================================================================
+# CRUD POUR LES PANIERS
+# ============================================================================
+
+def _basket_query(
+    price_db: Session,
+    product_ids: List[int],
+    columns,
+    city: Optional[str] = None,
+    sale_point_ids: Optional[List[int]] = None,
+    with_sale_points: bool = False
+):
+    """Derniers prix des produits du panier, un par couple produit / point de vente"""
+    # Dernier dans l'ordre du calendrier (clé YYYYMMDD) : une date ajoutée après coup a un identifiant plus grand
+    latest = (
+        price_db.query(
+            models.Price.id_product,
+            models.Price.id_sale_point,
+            func.max(date_key_column()).label("max_date_key")
+        )
+        .join(models.Date, models.Price.id_date == models.Date.id)
+        .filter(models.Price.id_product.in_(product_ids))
+    )
+    if sale_point_ids is not None:
+        latest = latest.filter(models.Price.id_sale_point.in_(sale_point_ids))
+    latest = latest.group_by(models.Price.id_product, models.Price.id_sale_point).subquery()
+
+    latest_date = aliased(models.Date)
+    query = (
+        price_db.query(*columns)
+        .select_from(latest)
+        .join(latest_date, date_key_column(latest_date) == latest.c.max_date_key)
+        .join(models.Price, and_(
+            models.Price.id_product == latest.c.id_product,
+            models.Price.id_sale_point == latest.c.id_sale_point,
+            models.Price.id_date == latest_date.id
+        ))
+    )
+    if city is not None or with_sale_points:
+        query = query.join(models.SalePoint, models.Price.id_sale_point == models.SalePoint.id)
+    if city is not None:
+        query = query.filter(models.SalePoint.city == city)
+    return query
+
+def get_basket_totals(db: Session, quantities: Dict[int, float], city: Optional[str] = None) -> list:
+    """Total du panier (derniers prix × quantités) et nombre d'articles trouvés, par point de vente"""
+    quantity = case(quantities, value=models.Price.id_product)
+    results = sharding.router.fan_out(
+        db,
+        # Un point de vente n'est que sur un shard : ses totaux y sont complets
+        lambda price_db: _basket_query(price_db, list(quantities), (
+            models.Price.id_sale_point,
+            func.sum(models.Price.price * quantity).label("total"),
+            func.count(models.Price.id_product).label("items_found")
+        ), city=city)
+        .group_by(models.Price.id_sale_point)
+        .all()
+    )
+    return [row for rows in results for row in rows]
+
+def get_basket_prices(db: Session, product_ids: List[int], sale_point_ids: List[int]) -> Dict[int, Dict[int, float]]:
+    """Derniers prix unitaires des produits du panier : point de vente -> produit -> prix"""
+    if not sale_point_ids:
+        return {}
+    results = sharding.router.fan_out(
+        db,
+        lambda price_db: _basket_query(
+            price_db, product_ids,
+            (models.Price.id_sale_point, models.Price.id_product, models.Price.price),
+            sale_point_ids=sale_point_ids
+        ).all()
+    )
+    prices = {sale_point_id: {} for sale_point_id in sale_point_ids}
+    for rows in results:
+        for sale_point_id, product_id, price in rows:
+            prices[sale_point_id][product_id] = price
+    return prices
+
+def get_basket_city_prices(db: Session, product_ids: List[int], city: Optional[str] = None) -> Dict[str, Dict[int, float]]:
+    """Prix unitaire le plus bas de chaque produit du panier parmi les points de vente de chaque ville"""
+    results = sharding.router.fan_out(
+        db,
+        lambda price_db: _basket_query(price_db, product_ids, (
+            models.SalePoint.city,
+            models.Price.id_product,
+            func.min(models.Price.price).label("price")
+        ), city=city, with_sale_points=True)
+        .filter(models.SalePoint.city.isnot(None))
+        .group_by(models.SalePoint.city, models.Price.id_product)
+        .all()
+    )
+    # Les points de vente d'une ville peuvent être répartis sur plusieurs shards
+    prices: Dict[str, Dict[int, float]] = {}
+    for rows in results:
+        for city_name, product_id, price in rows:
+            city_prices = prices.setdefault(city_name, {})
+            if product_id not in city_prices or price < city_prices[product_id]:
+                city_prices[product_id] = price
+    return prices
+
 # ============================================================================
 # STATISTIQUES ET ANALYSE
 # ============================================================================
 
+def _merge_price_stats(results: List[list], keys: tuple) -> List[dict]:
+    """Fusionne des agrégats (nombre, somme, min, max) calculés sur chaque shard ou archive"""
+    merged: Dict[tuple, dict] = {}
+    for rows in results:
+        for r in rows:
+            r = r if isinstance(r, dict) else r._mapping
+            key = tuple(r[k] for k in keys)
+            m = merged.get(key)
+            if m is None:
+                merged[key] = dict(r)
+                continue
+            m["price_count"] += r["price_count"]
+            m["price_sum"] += r["price_sum"]
+            m["min_price"] = min(m["min_price"], r["min_price"])
+            m["max_price"] = max(m["max_price"], r["max_price"])
+    stats = [merged[key] for key in sorted(merged, key=lambda k: tuple((v is None, v) for v in k))]
+    for m in stats:
+        m["avg_price"] = m.pop("price_sum") / m["price_count"]
+    return stats
+
 def get_products_with_prices_count(db: Session):
-    return (
-        db.query(models.Price.id_product)
-        .distinct()
-        .count()
+    results = sharding.router.fan_out(
+        db, lambda price_db: [r.id_product for r in price_db.query(models.Price.id_product).distinct()]
     )
+    return len({product_id for product_ids in results for product_id in product_ids})
 
 def get_products_by_sale_point_count(db: Session):
+    # product_sale_points reste sur la base principale, même avec des shards de prix
     return (
         db.query(
             models.SalePoint.name,
@@ -462,83 +1611,103 @@ def get_sale_points_by_type(db: Session):
         .all()
     )
 
-def get_prices_by_month(db: Session):
+def _price_stats_columns():
     return (
-        db.query(
-            models.Date.year,
-            models.Date.month,
-            func.count(models.Price.id_product).label("price_count"),
-            func.avg(models.Price.price).label("avg_price")
-        )
+        func.count(models.Price.price).label("price_count"),
+        func.sum(models.Price.price).label("price_sum"),
+        func.min(models.Price.price).label("min_price"),
+        func.max(models.Price.price).label("max_price")
+    )
+
+def get_prices_by_month(db: Session):
+    results = sharding.router.fan_out(
+        db,
+        lambda price_db: price_db.query(models.Date.year, models.Date.month, *_price_stats_columns())
         .join(models.Date, models.Price.id_date == models.Date.id)
         .group_by(models.Date.year, models.Date.month)
-        .order_by(models.Date.year, models.Date.month)
         .all()
     )
+    return _merge_price_stats(results, ("year", "month"))
 
 def get_average_prices_by_product(db: Session):
-    return (
-        db.query(
-            models.Product.title,
-            func.avg(models.Price.price).label("avg_price"),
-            func.min(models.Price.price).label("min_price"),
-            func.max(models.Price.price).label("max_price")
-        )
+    results = sharding.router.fan_out(
+        db,
+        lambda price_db: price_db.query(models.Product.title, *_price_stats_columns())
         .join(models.Price, models.Product.id == models.Price.id_product)
         .group_by(models.Product.title)
         .all()
     )
+    return _merge_price_stats(results, ("title",))
 
 def get_price_evolution(db: Session, product_id: int):
     """Retourne l'évolution du prix d'un produit au fil du temps"""
-    return (
-        db.query(
+    results = sharding.router.fan_out(
+        db,
+        lambda price_db: price_db.query(
             models.Date.id.label("date_id"),
             models.Date.year,
             models.Date.month,
             models.Date.day,
-            func.avg(models.Price.price).label("avg_price"),
-            func.min(models.Price.price).label("min_price"),
-            func.max(models.Price.price).label("max_price")
+            *_price_stats_columns()
         )
         .join(models.Price, models.Price.id_date == models.Date.id)
         .filter(models.Price.id_product == product_id)
         .group_by(models.Date.id, models.Date.year, models.Date.month, models.Date.day)
-        .order_by(models.Date.year, models.Date.month, models.Date.day)
         .all()
     )
+    archived: Dict[int, dict] = {}
+    for r in archive.store.prices(product_id):
+        stats = archived.get(r.id_date)
+        if stats is None:
+            archived[r.id_date] = {
+                "date_id": r.id_date,
+                "year": r.date_key // 10000,
+                "month": r.date_key // 100 % 100,
+                "day": r.date_key % 100,
+                "price_count": 1,
+                "price_sum": r.price,
+                "min_price": r.price,
+                "max_price": r.price
+            }
+            continue
+        stats["price_count"] += 1
+        stats["price_sum"] += r.price
+        stats["min_price"] = min(stats["min_price"], r.price)
+        stats["max_price"] = max(stats["max_price"], r.price)
+    results.append(list(archived.values()))
+    return sorted(
+        _merge_price_stats(results, ("date_id",)),
+        key=lambda r: (r["year"], r["month"], r["day"])
+    )
 
 def get_city_price_comparison(db: Session, product_id: int):
     """Compare les prix d'un produit par ville"""
-    # Créer une sous-requête pour les dernières dates
-    subquery = (
-        db.query(
-            models.Price.id_sale_point,
-            func.max(models.Date.id).label("max_date_id")
+    def city_stats(price_db: Session):
+        # Dernière date de chaque point de vente : un point de vente n'est que sur un shard
+        subquery = (
+            price_db.query(
+                models.Price.id_sale_point,
+                func.max(models.Price.id_date).label("max_date_id")
+            )
+            .filter(models.Price.id_product == product_id)
+            .group_by(models.Price.id_sale_point)
+            .subquery()
         )
-        .join(models.Date, models.Price.id_date == models.Date.id)  # Jointure explicite ici
-        .filter(models.Price.id_product == product_id)
-        .group_by(models.Price.id_sale_point)
-        .subquery()
-    )
-    
-    # Requête principale avec jointures explicites
-    return (
-        db.query(
-            models.SalePoint.city,
-            func.avg(models.Price.price).label("avg_price"),
-            func.min(models.Price.price).label("min_price"),
-            func.max(models.Price.price).label("max_price")
+        return (
+            price_db.query(models.SalePoint.city, *_price_stats_columns())
+            .select_from(models.Price)
+            .join(subquery, and_(
+                models.Price.id_sale_point == subquery.c.id_sale_point,
+                models.Price.id_date == subquery.c.max_date_id
+            ))
+            .join(models.SalePoint, models.Price.id_sale_point == models.SalePoint.id)
+            .filter(models.Price.id_product == product_id)
+            .group_by(models.SalePoint.city)
+            .all()
         )
-        .join(subquery, and_(
-            models.Price.id_sale_point == subquery.c.id_sale_point,
-            models.Price.id_date == subquery.c.max_date_id
-        ))
-        .join(models.SalePoint, models.Price.id_sale_point == models.SalePoint.id)  # Jointure explicite
-        .filter(models.Price.id_product == product_id)
-        .group_by(models.SalePoint.city)
-        .all()
-    )
+
+    # Les points de vente d'une ville peuvent être répartis sur plusieurs shards
+    return _merge_price_stats(sharding.router.fan_out(db, city_stats), ("city",))
 # Ajoutez cette fonction dans crud.py
 
 def get_price_details(
@@ -546,55 +1715,49 @@ def get_price_details(
     sale_point_id: Optional[int] = None,
     limit: int = 100
 ):
-    """Récupère les prix avec les détails complets (produit + date)"""
-    query = (
-        db.query(
-            models.Price,
-            models.Product,
-            models.Date
+    """Récupère les prix avec les détails complets (produit, point de vente, date)"""
+    # Seules les colonnes de prices sont lues ; les dimensions viennent du cache mémoire
+    results = _price_shard_results(
+        db,
+        sale_point_id,
+        lambda price_db: _price_rows(
+            _prices_query(price_db, sale_point_id=sale_point_id)
+            .with_entities(*PRICE_COLUMNS)
+            .order_by(*PRICE_COLUMNS[:3])
+            .limit(limit)
         )
-        .join(models.Product, models.Price.id_product == models.Product.id)
-        .join(models.Date, models.Price.id_date == models.Date.id)
     )
-    
-    if sale_point_id:
-        query = query.filter(models.Price.id_sale_point == sale_point_id)
-        
-    results = query.limit(limit).all()
+    rows = list(islice(heapq.merge(*results, key=lambda r: r[:3]), limit))
     
     # Transformer les résultats en format détaillé
     price_details = []
-    for price, product, date in results:
+    for r in rows:
+        product = dimension_cache.cache.product(db, r.id_product)
+        sale_point = dimension_cache.cache.sale_point(db, r.id_sale_point)
+        date_row = dimension_cache.cache.date(db, r.id_date)
+        if not (product and sale_point and date_row):
+            continue
         price_details.append({
-            "id": price.id,
-            "price": price.price,
-            "date": {
-                "id": date.id,
-                "day": date.day,
-                "month": date.month,
-                "year": date.year
-            },
-            "product": {
-                "id": product.id,
-                "title": product.title,
-                "link": product.link
-            }
+            "id_product": r.id_product,
+            "id_sale_point": r.id_sale_point,
+            "id_date": r.id_date,
+            "price": r.price,
+            "product": product._asdict(),
+            "sale_point": sale_point._asdict(),
+            "date": date_row._asdict()
         })
     
     return price_details
+
 def get_price_trends(db: Session, days: int = 30):
     """Analyse les tendances de prix sur une période donnée"""
     end_date = datetime.now().date()
     start_date = end_date - timedelta(days=days)
     
-    return (
-        db.query(
-            models.Product.title,
-            func.avg(models.Price.price).label("avg_price"),
-            (func.max(models.Price.price) - func.min(models.Price.price)).label("price_variation"),
-            func.max(models.Price.price).label("max_price"),
-            func.min(models.Price.price).label("min_price")
-        )
+    results = sharding.router.fan_out(
+        db,
+        lambda price_db: price_db.query(models.Product.title, *_price_stats_columns())
+        .select_from(models.Price)
         .join(models.Date, models.Price.id_date == models.Date.id)
         .join(models.Product, models.Price.id_product == models.Product.id)
         .filter(
@@ -608,9 +1771,150 @@ def get_price_trends(db: Session, days: int = 30):
             )
         )
         .group_by(models.Product.title)
-        .order_by(func.avg(models.Price.price).desc())
         .all()
     )
+    trends = _merge_price_stats(results, ("title",))
+    for trend in trends:
+        trend["price_variation"] = trend["max_price"] - trend["min_price"]
+    trends.sort(key=lambda trend: trend["avg_price"], reverse=True)
+    return trends
+
+def _volatility_group_columns(group_by: str):
+    """Colonnes de regroupement pour les statistiques de volatilité"""
+    if group_by == "city":
+        return [models.SalePoint.city.label("group")]
+    if group_by == "type":
+        return [models.SalePoint.type.label("group")]
+    return [models.SalePoint.id.label("sale_point_id"), models.SalePoint.name.label("group")]
+
+def _volatility_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Complète une ligne de statistiques avec le coefficient de variation"""
+    avg_price = row["avg_price"]
+    stddev_price = row["stddev_price"]
+    row["coefficient_of_variation"] = (
+        stddev_price / avg_price if stddev_price is not None and avg_price else None
+    )
+    row.setdefault("sale_point_id", None)
+    return row
+
+def get_price_volatility(
+    db: Session,
+    days: int = 30,
+    group_by: str = "sale_point",
+    product_id: Optional[int] = None,
+    sale_point_type: Optional[str] = None
+):
+    """Médiane, percentiles, écart-type et variation jour à jour par produit et groupe"""
+    end_date = datetime.now().date()
+    start_date = end_date - timedelta(days=days)
+    date_key = date_key_column()
+    group_columns = _volatility_group_columns(group_by)
+
+    filters = [date_key.between(date_to_key(start_date), date_to_key(end_date))]
+    if product_id is not None:
+        filters.append(models.Price.id_product == product_id)
+    if sale_point_type:
+        filters.append(models.SalePoint.type == sale_point_type)
+
+    if is_postgresql(db) and not sharding.router.enabled:
+        # Le moteur calcule tout : lag() pour la variation, percentile_cont pour les quantiles
+        previous_price = func.lag(models.Price.price).over(
+            partition_by=(models.Price.id_product, models.Price.id_sale_point),
+            order_by=[date_key]
+        )
+        series = (
+            db.query(
+                models.Price.id_product.label("id_product"),
+                *group_columns,
+                models.Price.price.label("price"),
+                previous_price.label("previous_price")
+            )
+            .join(models.Date, models.Price.id_date == models.Date.id)
+            .join(models.SalePoint, models.Price.id_sale_point == models.SalePoint.id)
+            .filter(*filters)
+            .subquery()
+        )
+        series_groups = [series.c[c.name] for c in group_columns]
+        change_pct = (
+            (series.c.price - series.c.previous_price)
+            / func.nullif(series.c.previous_price, 0, type_=Float) * 100
+        )
+        rows = (
+            db.query(
+                series.c.id_product,
+                models.Product.title,
+                *series_groups,
+                func.count(series.c.price).label("price_count"),
+                func.avg(series.c.price).label("avg_price"),
+                func.min(series.c.price).label("min_price"),
+                func.max(series.c.price).label("max_price"),
+                func.percentile_cont(0.5).within_group(series.c.price).label("median_price"),
+                func.percentile_cont(0.1).within_group(series.c.price).label("p10_price"),
+                func.percentile_cont(0.9).within_group(series.c.price).label("p90_price"),
+                func.stddev_samp(series.c.price).label("stddev_price"),
+                func.avg(change_pct).label("avg_daily_change_pct")
+            )
+            .join(models.Product, models.Product.id == series.c.id_product)
+            .group_by(series.c.id_product, models.Product.title, *series_groups)
+            .order_by(models.Product.title, series.c.group)
+            .all()
+        )
+        return [_volatility_row(dict(r._mapping)) for r in rows]
+
+    # Repli pour SQLite et pour les shards (quantiles d'un groupe réparti sur plusieurs bases) :
+    # une lecture ordonnée par shard, agrégats calculés en mémoire
+    results = sharding.router.fan_out(
+        db,
+        lambda price_db: price_db.query(
+            models.Price.id_product,
+            models.Product.title,
+            models.Price.id_sale_point,
+            *group_columns,
+            models.Price.price
+        )
+        .join(models.Date, models.Price.id_date == models.Date.id)
+        .join(models.SalePoint, models.Price.id_sale_point == models.SalePoint.id)
+        .join(models.Product, models.Price.id_product == models.Product.id)
+        .filter(*filters)
+        .order_by(models.Price.id_product, models.Price.id_sale_point, date_key)
+        .all()
+    )
+    # Une série (produit, point de vente) est entière sur un shard et y reste ordonnée par date
+    rows = [row for shard_rows in results for row in shard_rows]
+
+    groups: Dict[tuple, Dict[str, list]] = {}
+    previous: Dict[tuple, float] = {}
+    for r in rows:
+        key = (r.id_product, r.title, getattr(r, "sale_point_id", None), r.group)
+        bucket = groups.setdefault(key, {"prices": [], "changes": []})
+        bucket["prices"].append(r.price)
+        series_key = (r.id_product, r.id_sale_point)
+        last_price = previous.get(series_key)
+        if last_price:
+            bucket["changes"].append((r.price - last_price) / last_price * 100)
+        previous[series_key] = r.price
+
+    volatility = []
+    for (id_product, title, sale_point_id, group), values in groups.items():
+        prices = sorted(values["prices"])
+        changes = values["changes"]
+        volatility.append(_volatility_row({
+            "id_product": id_product,
+            "title": title,
+            "sale_point_id": sale_point_id,
+            "group": group,
+            "price_count": len(prices),
+            "avg_price": statistics.fmean(prices),
+            "min_price": prices[0],
+            "max_price": prices[-1],
+            "median_price": percentile_cont(prices, 0.5),
+            "p10_price": percentile_cont(prices, 0.1),
+            "p90_price": percentile_cont(prices, 0.9),
+            "stddev_price": statistics.stdev(prices) if len(prices) > 1 else None,
+            "avg_daily_change_pct": statistics.fmean(changes) if changes else None
+        }))
+    volatility.sort(key=lambda v: (v["title"], v["group"] or ""))
+    return volatility
 
 # ============================================================================
 # FONCTIONS POUR L'ENDPOINT DE SANTÉ
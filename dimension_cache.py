@@ -0,0 +1,204 @@
+# dimension_cache.py
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, NamedTuple, Optional
+
+from sqlalchemy.orm import Session
+
+import models
+import tracing
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+class ProductRow(NamedTuple):
+    id: int
+    title: str
+    link: Optional[str]
+
+class SalePointRow(NamedTuple):
+    id: int
+    name: str
+    city: Optional[str]
+    website: Optional[str]
+    type: Optional[str]
+
+class DateRow(NamedTuple):
+    id: int
+    day: int
+    month: int
+    year: int
+
+# Table -> (modèle SQLAlchemy, ligne mémorisée)
+DIMENSIONS = {
+    "products": (models.Product, ProductRow),
+    "sale_points": (models.SalePoint, SalePointRow),
+    "dates": (models.Date, DateRow),
+}
+
+class DimensionCache:
+    """Copie en mémoire des tables de dimensions (produits, points de vente, dates)
+
+    Chargée au démarrage, elle est tenue à jour par les fonctions d'écriture
+    de crud. Une ligne absente est relue en base (créée par un autre worker)
+    puis mémorisée. Les modifications faites par les autres workers sont
+    propagées par Redis si une URL est configurée ; sinon le cache est
+    rechargé entièrement après `refresh_seconds`. `version` augmente à chaque
+    changement.
+    """
+
+    def __init__(self, enabled: bool = True, refresh_seconds: int = 300, redis_url: Optional[str] = None, channel: str = "dimension-invalidations"):
+        self.enabled = enabled
+        self.version = 0
+        self._tables: Dict[str, Dict[int, Any]] = {name: {} for name in DIMENSIONS}
+        self._lock = threading.Lock()
+        self._refresh_seconds = refresh_seconds
+        self._loaded_at: Optional[float] = None
+        self._origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._channel = channel
+        self._redis = None
+        self._pubsub = None
+        self._listener: Optional[threading.Thread] = None
+        self.hits = 0
+        self.misses = 0
+        if enabled and redis_url:
+            import redis  # dépendance optionnelle
+            self._redis = redis.Redis.from_url(redis_url)
+
+    def warm(self, db: Session):
+        """Charge les trois tables de dimensions"""
+        if not self.enabled:
+            return
+        tables = {
+            name: {r.id: row_type(*(getattr(r, f) for f in row_type._fields)) for r in db.query(model)}
+            for name, (model, row_type) in DIMENSIONS.items()
+        }
+        with self._lock:
+            self._tables = tables
+            self._loaded_at = time.monotonic()
+            self.version += 1
+        logger.info(
+            "Cache des dimensions chargé : "
+            + ", ".join(f"{len(rows)} {name}" for name, rows in tables.items())
+        )
+
+    def start(self):
+        """Démarre l'écoute des invalidations des autres workers (si Redis est configuré)"""
+        if self._redis is None or self._listener is not None:
+            return
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(self._channel)
+        self._listener = threading.Thread(target=self._listen, name="dimension-cache", daemon=True)
+        self._listener.start()
+
+    def stop(self):
+        if self._pubsub is not None:
+            self._pubsub.close()
+            self._pubsub = None
+        self._listener = None
+
+    def _listen(self):
+        try:
+            for message in self._pubsub.listen():
+                change = json.loads(message["data"])
+                if change["origin"] != self._origin:
+                    self._drop(change["table"], change["id"])
+        except Exception as e:
+            if self._pubsub is not None:
+                logger.error(f"Écoute des invalidations de dimensions interrompue : {e}")
+
+    # ------------------------------------------------------------------
+    # Lecture
+    # ------------------------------------------------------------------
+
+    def _get(self, db: Session, table: str, row_id: int):
+        if not self.enabled:
+            return self._load(db, table, row_id)
+        if self._loaded_at is None or (
+            # Sans Redis, un rechargement périodique récupère les modifications des autres workers
+            self._redis is None and time.monotonic() - self._loaded_at > self._refresh_seconds
+        ):
+            self.warm(db)
+        row = self._tables[table].get(row_id)
+        if row is not None:
+            self.hits += 1
+            tracing.count("cache.dimension.hits")
+            return row
+        self.misses += 1
+        tracing.count("cache.dimension.misses")
+        row = self._load(db, table, row_id)
+        if row is not None:
+            with self._lock:
+                self._tables[table][row_id] = row
+        return row
+
+    @staticmethod
+    def _load(db: Session, table: str, row_id: int):
+        model, row_type = DIMENSIONS[table]
+        instance = db.get(model, row_id)
+        if instance is None:
+            return None
+        return row_type(*(getattr(instance, f) for f in row_type._fields))
+
+    def product(self, db: Session, product_id: int) -> Optional[ProductRow]:
+        return self._get(db, "products", product_id)
+
+    def sale_point(self, db: Session, sale_point_id: int) -> Optional[SalePointRow]:
+        return self._get(db, "sale_points", sale_point_id)
+
+    def date(self, db: Session, date_id: int) -> Optional[DateRow]:
+        return self._get(db, "dates", date_id)
+
+    # ------------------------------------------------------------------
+    # Invalidation (appelée par les fonctions d'écriture de crud)
+    # ------------------------------------------------------------------
+
+    def _drop(self, table: str, row_id: int):
+        with self._lock:
+            self._tables[table].pop(row_id, None)
+            self.version += 1
+
+    def _publish(self, table: str, row_id: int):
+        if self._redis is None:
+            return
+        try:
+            self._redis.publish(self._channel, json.dumps({"table": table, "id": row_id, "origin": self._origin}))
+        except Exception as e:
+            logger.warning(f"Invalidation de dimension non publiée : {e}")
+
+    def put(self, instance):
+        """Mémorise une ligne créée ou modifiée"""
+        if not self.enabled:
+            return
+        table = instance.__tablename__
+        row_type = DIMENSIONS[table][1]
+        with self._lock:
+            self._tables[table][instance.id] = row_type(*(getattr(instance, f) for f in row_type._fields))
+            self.version += 1
+        self._publish(table, instance.id)
+
+    def remove(self, table: str, row_id: int):
+        """Oublie une ligne supprimée"""
+        if not self.enabled:
+            return
+        self._drop(table, row_id)
+        self._publish(table, row_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "version": self.version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "rows": {name: len(rows) for name, rows in self._tables.items()},
+        }
+
+cache = DimensionCache(
+    enabled=settings.dimension_cache_enabled,
+    refresh_seconds=settings.dimension_cache_refresh_seconds,
+    redis_url=settings.dimension_cache_redis_url
+)
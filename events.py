@@ -0,0 +1,133 @@
+# events.py
+import asyncio
+import json
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, Optional, Set
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+class Subscription:
+    """Abonnement filtré d'un client au flux de prix"""
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        product_id: Optional[int] = None,
+        sale_point_id: Optional[int] = None,
+        queue_size: int = 1000
+    ):
+        self.loop = loop
+        self.product_id = product_id
+        self.sale_point_id = sale_point_id
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def matches(self, event: Dict[str, Any]) -> bool:
+        if self.product_id is not None and event["id_product"] != self.product_id:
+            return False
+        if self.sale_point_id is not None and event["id_sale_point"] != self.sale_point_id:
+            return False
+        return True
+
+    def _push(self, event: Dict[str, Any]):
+        # Un client trop lent perd les événements les plus anciens plutôt que de bloquer les écritures
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self) -> Dict[str, Any]:
+        return await self.queue.get()
+
+class PriceEventBroker:
+    """Diffuse les créations et suppressions de prix aux abonnés
+
+    Par défaut les événements sont distribués en mémoire aux abonnés du
+    processus. Avec une URL Redis, ils sont publiés sur un canal pub/sub et
+    chaque worker relaie les messages reçus à ses propres abonnés.
+    """
+
+    def __init__(self, redis_url: Optional[str] = None, channel: str = "price-events", queue_size: int = 1000):
+        self._subscribers: Set[Subscription] = set()
+        self._lock = threading.Lock()
+        self._channel = channel
+        self._queue_size = queue_size
+        self._redis = None
+        self._listener: Optional[threading.Thread] = None
+        self._pubsub = None
+        if redis_url:
+            import redis  # dépendance optionnelle
+            self._redis = redis.Redis.from_url(redis_url)
+
+    def start(self):
+        """Démarre l'écoute du canal Redis (sans effet en mode mémoire)"""
+        if self._redis is None or self._listener is not None:
+            return
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(self._channel)
+        self._listener = threading.Thread(target=self._listen, name="price-events", daemon=True)
+        self._listener.start()
+
+    def stop(self):
+        if self._pubsub is not None:
+            self._pubsub.close()
+            self._pubsub = None
+        self._listener = None
+
+    def _listen(self):
+        try:
+            for message in self._pubsub.listen():
+                self._dispatch(json.loads(message["data"]))
+        except Exception as e:
+            if self._pubsub is not None:
+                logger.error(f"Écoute du flux de prix interrompue : {e}")
+
+    def publish(self, event_type: str, id_product: int, id_sale_point: int, id_date: int, price: Optional[float] = None):
+        """Publie un événement de prix ; ne lève jamais d'exception vers l'appelant"""
+        event = {
+            "type": event_type,
+            "id_product": id_product,
+            "id_sale_point": id_sale_point,
+            "id_date": id_date,
+            "price": price,
+            "timestamp": datetime.now().isoformat()
+        }
+        try:
+            if self._redis is not None:
+                self._redis.publish(self._channel, json.dumps(event))
+            else:
+                self._dispatch(event)
+        except Exception as e:
+            logger.warning(f"Événement de prix non publié : {e}")
+
+    def _dispatch(self, event: Dict[str, Any]):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            if subscription.matches(event):
+                subscription.loop.call_soon_threadsafe(subscription._push, event)
+
+    def subscribe(self, product_id: Optional[int] = None, sale_point_id: Optional[int] = None) -> Subscription:
+        """Crée un abonnement ; doit être appelé depuis la boucle asyncio du client"""
+        subscription = Subscription(asyncio.get_running_loop(), product_id, sale_point_id, self._queue_size)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+broker = PriceEventBroker(
+    redis_url=settings.events_redis_url,
+    channel=settings.events_channel,
+    queue_size=settings.events_queue_size
+)
@@ -42,3 +42,28 @@ class DatabaseError(HTTPException):
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=message
         )
+
+class WriteQueueFull(HTTPException):
+    def __init__(self, retry_after: int = 1):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Write queue is full, retry later",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+class WriterUnavailable(HTTPException):
+    def __init__(self, message: str = "Price writer is not running", retry_after: int = 1):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=message,
+            headers={"Retry-After": str(retry_after)}
+        )
+
+class QueryTimeout(HTTPException):
+    def __init__(self, budget_ms: int, route: str = "", cancelled: bool = False):
+        super().__init__(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail=(f"Query cancelled for '{route}': client disconnected" if cancelled
+                    else f"Query budget of {budget_ms} ms exceeded for '{route}'")
+        )
+        self.cancelled = cancelled
@@ -0,0 +1,44 @@
+# gunicorn_conf.py
+"""Configuration gunicorn du service en production, lue depuis config.Settings
+
+    gunicorn -c gunicorn_conf.py main:app    (ou : python serve.py)
+"""
+import gc
+import multiprocessing
+
+from config import settings
+
+bind = f"{settings.serve_host}:{settings.serve_port}"
+workers = settings.serve_workers or multiprocessing.cpu_count()
+worker_class = "serve.Worker"
+
+# L'application est importée une fois par le maître puis partagée (copy-on-write) avec les workers.
+# Cet import ne touche pas à la base : connexions, caches et pools démarrent dans le lifespan de chaque worker.
+preload_app = settings.serve_preload
+
+backlog = settings.serve_backlog
+keepalive = settings.serve_keepalive_seconds
+timeout = settings.serve_timeout_seconds
+graceful_timeout = settings.serve_graceful_timeout_seconds
+max_requests = settings.serve_max_requests
+max_requests_jitter = settings.serve_max_requests_jitter
+
+accesslog = None
+errorlog = "-"
+
+def when_ready(server):
+    if preload_app:
+        # Les objets importés par le maître sont exclus du ramasse-miettes : sans cela, chaque
+        # collecte dans un worker réécrit leurs en-têtes et recopie les pages partagées
+        gc.freeze()
+    server.log.info(f"{workers} workers, boucle {settings.serve_loop}, HTTP {settings.serve_http}")
+
+def post_fork(server, worker):
+    # Un moteur ou un pool créé par le maître ne doit pas être partagé entre processus
+    import databases
+    import sharding
+    databases.reset_engine()
+    sharding.router.after_fork()
+
+def worker_exit(server, worker):
+    server.log.info(f"Worker {worker.pid} arrêté")
@@ -0,0 +1,233 @@
+# idempotency.py
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+
+import admission
+import databases
+import models
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+HEADER = b"idempotency-key"
+METHODS = ("POST", "PUT", "PATCH", "DELETE")
+MAX_KEY_LENGTH = 255
+
+# États retournés par IdempotencyStore.begin
+NEW = "new"
+REPLAY = "replay"
+IN_PROGRESS = "in_progress"
+MISMATCH = "mismatch"
+
+class IdempotencyStore:
+    """Réponses des requêtes d'écriture, indexées par clé d'idempotence
+
+    La première requête d'une clé réserve la ligne (status_code NULL) puis y
+    enregistre sa réponse ; un nouvel essai avec la même clé reçoit cette
+    réponse sans réexécuter l'écriture. La table étant partagée, la garantie
+    vaut pour tous les workers. Une réservation restée sans réponse au-delà
+    de `pending_timeout_seconds` (worker arrêté) peut être reprise.
+    """
+
+    def __init__(self, enabled: bool = True, ttl_seconds: int = 86400, pending_timeout_seconds: int = 60):
+        self.enabled = enabled
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.pending_timeout = timedelta(seconds=pending_timeout_seconds)
+        self.replayed = 0
+
+    def begin(self, key: str, request_hash: str) -> Tuple[str, Optional[models.IdempotencyKey]]:
+        """Réserve la clé ou retourne la réponse déjà enregistrée"""
+        db = databases.SessionLocal()
+        try:
+            now = datetime.now()
+            db.execute(
+                delete(models.IdempotencyKey)
+                .where(models.IdempotencyKey.key == key, models.IdempotencyKey.created_at < now - self.ttl)
+            )
+            db.add(models.IdempotencyKey(key=key, request_hash=request_hash, created_at=now))
+            try:
+                db.commit()
+                return NEW, None
+            except IntegrityError:
+                db.rollback()
+
+            record = db.get(models.IdempotencyKey, key)
+            if record is None:
+                # Clé libérée entre-temps (requête d'origine en échec) : nouvel essai du client
+                return IN_PROGRESS, None
+            if record.request_hash != request_hash:
+                return MISMATCH, record
+            if record.status_code is not None:
+                self.replayed += 1
+                return REPLAY, record
+            # Reprise d'une réservation abandonnée, si aucun autre worker ne l'a reprise avant
+            taken = db.execute(
+                update(models.IdempotencyKey)
+                .where(
+                    models.IdempotencyKey.key == key,
+                    models.IdempotencyKey.status_code.is_(None),
+                    models.IdempotencyKey.created_at < now - self.pending_timeout
+                )
+                .values(created_at=now)
+            ).rowcount
+            db.commit()
+            return (NEW, None) if taken else (IN_PROGRESS, record)
+        finally:
+            db.close()
+
+    def complete(self, key: str, status_code: int, headers: List[Tuple[bytes, bytes]], body: bytes):
+        # La longueur est recalculée au rejeu
+        stored = [
+            [name.decode("latin-1"), value.decode("latin-1")]
+            for name, value in headers if name.lower() != b"content-length"
+        ]
+        content_type = dict(headers).get(b"content-type", b"").decode("latin-1") or None
+        db = databases.SessionLocal()
+        try:
+            db.execute(
+                update(models.IdempotencyKey)
+                .where(models.IdempotencyKey.key == key)
+                .values(status_code=status_code, content_type=content_type, headers=json.dumps(stored), body=body)
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def release(self, key: str):
+        """Libère la clé d'une requête en échec : le client peut la réessayer"""
+        db = databases.SessionLocal()
+        try:
+            db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.key == key))
+            db.commit()
+        finally:
+            db.close()
+
+    def purge(self) -> int:
+        """Supprime les réponses expirées"""
+        db = databases.SessionLocal()
+        try:
+            deleted = db.execute(
+                delete(models.IdempotencyKey)
+                .where(models.IdempotencyKey.created_at < datetime.now() - self.ttl)
+            ).rowcount
+            db.commit()
+            return deleted
+        finally:
+            db.close()
+
+def _scoped_key(scope, key: str) -> str:
+    """Clé propre au client (même identité que le contrôle d'admission : clé d'API ou adresse IP)
+
+    Deux clients qui choisissent la même clé ne partagent ni réservation
+    ni réponse ; seule l'empreinte est stockée, pas la clé d'API.
+    """
+    client = admission.controller.client_key(scope)
+    return hashlib.sha256(f"{client}\0{key}".encode("utf-8")).hexdigest()
+
+def _replay_headers(record: models.IdempotencyKey) -> List[Tuple[bytes, bytes]]:
+    headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in json.loads(record.headers or "[]")]
+    return headers + [(b"content-length", str(len(record.body or b"")).encode()), (b"idempotent-replayed", b"true")]
+
+def _request_hash(scope, body: bytes) -> str:
+    digest = hashlib.sha256()
+    for part in (scope["method"].encode(), scope["path"].encode(), scope.get("query_string", b""), body):
+        digest.update(part)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+async def _send_json(send, status_code: int, detail: str, headers: Optional[list] = None):
+    body = json.dumps({"detail": detail}).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status_code,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())] + (headers or []),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+class IdempotencyMiddleware:
+    """Middleware ASGI : rejoue la réponse enregistrée des écritures réessayées avec la même
+    clé Idempotency-Key
+
+    Les clés sont propres à chaque client et la réponse rejouée reprend les
+    en-têtes d'origine (Location, X-Total-Count...). Les réponses 5xx ne
+    sont pas enregistrées : la clé est libérée et le client peut réessayer.
+    Une clé réutilisée avec une autre requête reçoit 422, une clé dont la
+    requête d'origine est en cours reçoit 409.
+    """
+
+    def __init__(self, app, store: IdempotencyStore):
+        self.app = app
+        self.store = store
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in METHODS or not self.store.enabled:
+            return await self.app(scope, receive, send)
+        key = dict(scope["headers"]).get(HEADER)
+        if not key:
+            return await self.app(scope, receive, send)
+        key = key.decode("latin-1")
+        if len(key) > MAX_KEY_LENGTH:
+            return await _send_json(send, 400, f"Idempotency-Key must not exceed {MAX_KEY_LENGTH} characters")
+        key = _scoped_key(scope, key)
+
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        request_body = b"".join(chunks)
+
+        state, record = await run_in_threadpool(self.store.begin, key, _request_hash(scope, request_body))
+        if state == MISMATCH:
+            return await _send_json(send, 422, "Idempotency-Key was already used with a different request")
+        if state == IN_PROGRESS:
+            return await _send_json(send, 409, "A request with this Idempotency-Key is in progress", [(b"retry-after", b"1")])
+        if state == REPLAY:
+            await send({"type": "http.response.start", "status": record.status_code, "headers": _replay_headers(record)})
+            await send({"type": "http.response.body", "body": record.body or b""})
+            return
+
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": request_body, "more_body": False}
+            return await receive()
+
+        response = {"status": 500, "headers": [], "body": []}
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        except BaseException:
+            await run_in_threadpool(self.store.release, key)
+            raise
+        if response["status"] >= 500:
+            await run_in_threadpool(self.store.release, key)
+        else:
+            await run_in_threadpool(
+                self.store.complete, key, response["status"], response["headers"], b"".join(response["body"])
+            )
+
+store = IdempotencyStore(
+    enabled=settings.idempotency_enabled,
+    ttl_seconds=settings.idempotency_ttl_seconds,
+    pending_timeout_seconds=settings.idempotency_pending_timeout_seconds
+)
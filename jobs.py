@@ -0,0 +1,334 @@
+# jobs.py
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+# Intervalle de vérification des annulations demandées par un autre worker
+CANCEL_POLL_SECONDS = 1.0
+
+def _process_identity(pid: Optional[int]) -> Optional[str]:
+    """Identité d'un processus vivant (pid et instant de démarrage), None s'il n'existe plus
+
+    L'instant de démarrage (/proc sous Linux) distingue un pid réutilisé par
+    un autre processus ; ailleurs seule l'existence du pid est vérifiée.
+    """
+    if not pid:
+        return None
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f"{pid}:{f.read().rsplit(')', 1)[1].split()[19]}"
+    except FileNotFoundError:
+        if os.path.isdir("/proc"):
+            return None
+    except OSError:
+        pass
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return None
+    except PermissionError:
+        pass
+    return f"{pid}:"
+
+# ============================================================================
+# TRAVAUX EXÉCUTÉS DANS LE PROCESSUS ENFANT
+# ============================================================================
+
+def _rows(result):
+    return [r if isinstance(r, dict) else dict(r._mapping) for r in result]
+
+def _price_trends(db, out, days: int = 30):
+    import crud
+    json.dump(_rows(crud.get_price_trends(db, days)), out, default=str)
+
+def _price_volatility(db, out, **params):
+    import crud
+    json.dump(crud.get_price_volatility(db, **params), out, default=str)
+
+def _price_history(db, out, product_id: int, **params):
+    import crud
+    from utils import encode_price_history
+    columns, names = crud.get_price_history_columns(db, product_id, **params)
+    out.write(encode_price_history(columns, names).decode("utf-8"))
+
+def _export_prices(db, out, product_id: Optional[int] = None, sale_point_id: Optional[int] = None):
+    import models
+    import sharding
+
+    writer = csv.writer(out)
+    writer.writerow(["date", "id_product", "title", "id_sale_point", "sale_point", "city", "price"])
+    # Shard après shard (ou la seule base) : l'export reste en flux
+    if sale_point_id is not None:
+        shards = [sharding.router.shard_of(db, sale_point_id)]
+    else:
+        shards = sharding.router.names or [None]
+    for shard in shards:
+        with sharding.router.session(db, shard) as price_db:
+            query = (
+                price_db.query(
+                    models.Date.year, models.Date.month, models.Date.day,
+                    models.Price.id_product, models.Product.title,
+                    models.Price.id_sale_point, models.SalePoint.name, models.SalePoint.city,
+                    models.Price.price
+                )
+                .join(models.Date, models.Price.id_date == models.Date.id)
+                .join(models.Product, models.Price.id_product == models.Product.id)
+                .join(models.SalePoint, models.Price.id_sale_point == models.SalePoint.id)
+            )
+            if product_id is not None:
+                query = query.filter(models.Price.id_product == product_id)
+            if sale_point_id is not None:
+                query = query.filter(models.Price.id_sale_point == sale_point_id)
+
+            for r in query.yield_per(10000):
+                writer.writerow([
+                    f"{r.year:04d}-{r.month:02d}-{r.day:02d}",
+                    r.id_product, r.title, r.id_sale_point, r.name, r.city, r.price
+                ])
+
+# Type de travail -> (fonction, type MIME du résultat)
+JOB_KINDS: Dict[str, tuple] = {
+    "price_trends": (_price_trends, "application/json"),
+    "price_volatility": (_price_volatility, "application/json"),
+    "price_history": (_price_history, "application/json"),
+    "export_prices": (_export_prices, "text/csv"),
+}
+
+def _run_job(kind: str, params: Dict[str, Any], result_path: str, error_path: str):
+    """Point d'entrée du processus enfant : exécute le travail et écrit son résultat"""
+    import databases
+    # Après un fork, les connexions héritées du parent ne doivent pas être réutilisées
+    databases.reset_engine()
+    db = databases.SessionLocal()
+    tmp_path = result_path + ".tmp"
+    try:
+        fn, _ = JOB_KINDS[kind]
+        with open(tmp_path, "w", newline="") as out:
+            fn(db, out, **params)
+        os.replace(tmp_path, result_path)
+    except BaseException as e:
+        with open(error_path, "w") as err:
+            err.write(f"{type(e).__name__}: {e}")
+        raise SystemExit(1)
+    finally:
+        db.close()
+
+# ============================================================================
+# GESTIONNAIRE DE TRAVAUX
+# ============================================================================
+
+class JobManager:
+    """Exécute les analyses longues et exports hors des requêtes HTTP
+
+    Chaque travail tourne dans un processus dédié (annulable), au plus
+    `max_concurrency` à la fois par worker ; les suivants attendent leur
+    tour dans l'état `pending`. L'état
+    et le résultat sont stockés dans `jobs_dir`, ce qui permet à n'importe
+    quel worker de la même machine de répondre au suivi d'un travail.
+
+    Seul le worker qui a lancé un travail arrête son processus : une
+    annulation reçue par un autre worker est inscrite dans l'état du travail
+    et relue par son propriétaire. Au démarrage, les travaux dont le worker
+    propriétaire n'existe plus passent en échec ; les fichiers des travaux
+    terminés sont supprimés après `retention_seconds`.
+    """
+
+    def __init__(self, jobs_dir: str = "jobs", max_concurrency: int = 2, start_method: str = "spawn", retention_seconds: int = 86400):
+        self.jobs_dir = jobs_dir
+        self.retention_seconds = retention_seconds
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._context = multiprocessing.get_context(start_method)
+        self._processes: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        self._recover()
+        self._expire()
+
+    def _jobs(self):
+        for name in os.listdir(self.jobs_dir):
+            if name.endswith(".json"):
+                job = self.get(name[:-len(".json")])
+                if job is not None:
+                    yield job
+
+    def _recover(self):
+        """Passe en échec les travaux inachevés dont le worker propriétaire s'est arrêté"""
+        for job in self._jobs():
+            if job["status"] in FINISHED:
+                continue
+            owner = job.get("worker")
+            if owner and _process_identity(int(owner.split(":")[0])) == owner:
+                continue
+            # Processus enfant encore en vie (worker tué brutalement) : il a bien été lancé pour ce travail
+            if job.get("process") and _process_identity(job["pid"]) == job["process"]:
+                try:
+                    os.kill(job["pid"], signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            job.update(status=FAILED, error="Worker stopped before the job finished", finished_at=datetime.now().isoformat())
+            self._save(job)
+            logger.warning(f"Travail {job['id']} ({job['kind']}) abandonné par son worker : passé en échec")
+
+    def _expire(self):
+        """Supprime les fichiers des travaux terminés depuis plus de retention_seconds"""
+        cutoff = datetime.now() - timedelta(seconds=self.retention_seconds)
+        for job in self._jobs():
+            if job["status"] not in FINISHED or datetime.fromisoformat(job["finished_at"]) >= cutoff:
+                continue
+            # Fichier d'état en dernier : un travail encore listé a toujours ses autres fichiers
+            for suffix in ("result", "result.tmp", "error", "json"):
+                try:
+                    os.remove(self._path(job["id"], suffix))
+                except FileNotFoundError:
+                    pass
+
+    def stop(self):
+        """Annule les travaux en cours à l'arrêt du worker"""
+        with self._lock:
+            running = list(self._processes)
+        for job_id in running:
+            self.cancel(job_id)
+
+    def _path(self, job_id: str, suffix: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.{suffix}")
+
+    def _save(self, job: Dict[str, Any]):
+        tmp_path = self._path(job["id"], "json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(job, f)
+        os.replace(tmp_path, self._path(job["id"], "json"))
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(job_id, "json")) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def submit(self, kind: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind '{kind}'")
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        self._expire()
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "params": params or {},
+            "status": PENDING,
+            "created_at": datetime.now().isoformat(),
+            "started_at": None,
+            "finished_at": None,
+            "error": None,
+            # Worker propriétaire et processus du travail (identités vérifiées avant tout signal)
+            "worker": _process_identity(os.getpid()),
+            "pid": None,
+            "process": None,
+        }
+        self._save(job)
+        # Thread simple plutôt qu'un ThreadPoolExecutor : son hook atexit
+        # ferait échouer la sortie des processus enfants créés par fork
+        threading.Thread(target=self._execute, args=(job["id"],), name=f"job-{job['id']}", daemon=True).start()
+        return job
+
+    def _execute(self, job_id: str):
+        with self._slots:
+            self._run(job_id)
+
+    def _run(self, job_id: str):
+        job = self.get(job_id)
+        if job is None or job["status"] != PENDING:
+            return
+        result_path = self._path(job_id, "result")
+        error_path = self._path(job_id, "error")
+        process = self._context.Process(
+            target=_run_job,
+            args=(job["kind"], job["params"], result_path, error_path),
+            daemon=True
+        )
+        process.start()
+        with self._lock:
+            # Relire l'état : une annulation a pu arriver pendant le démarrage du processus
+            current = self.get(job_id)
+            if current is None or current["status"] != PENDING:
+                process.terminate()
+                process.join()
+                return
+            self._processes[job_id] = process
+            job.update(
+                status=RUNNING, started_at=datetime.now().isoformat(),
+                pid=process.pid, process=_process_identity(process.pid)
+            )
+            self._save(job)
+
+        while process.is_alive():
+            process.join(CANCEL_POLL_SECONDS)
+            current = self.get(job_id)
+            if process.is_alive() and current is not None and current["status"] == CANCELLED:
+                # Annulation reçue par un autre worker
+                process.terminate()
+        with self._lock:
+            self._processes.pop(job_id, None)
+
+        job = self.get(job_id) or job
+        if job["status"] == CANCELLED:
+            return
+        if process.exitcode == 0:
+            job["status"] = SUCCEEDED
+        else:
+            job["status"] = FAILED
+            try:
+                with open(error_path) as f:
+                    job["error"] = f.read()
+            except FileNotFoundError:
+                job["error"] = f"Process exited with code {process.exitcode}"
+        job["finished_at"] = datetime.now().isoformat()
+        self._save(job)
+        logger.info(f"Travail {job_id} ({job['kind']}) terminé : {job['status']}")
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        # Sous le verrou : le passage pending -> running de _run ne peut pas écraser l'annulation
+        with self._lock:
+            job = self.get(job_id)
+            if job is None or job["status"] in FINISHED:
+                return job
+            job.update(status=CANCELLED, finished_at=datetime.now().isoformat())
+            self._save(job)
+            process = self._processes.get(job_id)
+        # Travail d'un autre worker : son propriétaire relit l'état et arrête lui-même le processus
+        if process is not None:
+            process.terminate()
+        return job
+
+    def result(self, job_id: str) -> Optional[tuple]:
+        """Chemin et type MIME du résultat d'un travail terminé avec succès"""
+        job = self.get(job_id)
+        if job is None or job["status"] != SUCCEEDED:
+            return None
+        return self._path(job_id, "result"), JOB_KINDS[job["kind"]][1]
+
+manager = JobManager(
+    jobs_dir=settings.jobs_dir,
+    max_concurrency=settings.jobs_max_concurrency,
+    start_method=settings.jobs_start_method,
+    retention_seconds=settings.jobs_retention_seconds
+)
@@ -1,52 +1,109 @@
 # main.py
 # Ajouter en haut du fichier
+import asyncio
+import json
 import logging
+import os
+import time
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse  
+from fastapi.responses import RedirectResponse, StreamingResponse, FileResponse, JSONResponse, PlainTextResponse
 from datetime import datetime
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 import crud
 import models
 import schemas
-from databases import SessionLocal, engine
-from fastapi import FastAPI, Depends, HTTPException, Query, status, Response
+import singleflight
+import price_writer
+import events
+import admission
+import alerts
+import baskets
+import compression
+import price_dedup
+import jobs
+import offload
+import sharding
+import dimension_cache
+import idempotency
+import profiling
+import query_budget
+import tracing
+from config import settings
+from databases import SessionLocal, get_engine
+from fastapi import APIRouter, FastAPI, Depends, Header, HTTPException, Query, status, Response, Request, WebSocket
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Union
 
-models.Base.metadata.create_all(bind=engine)
+# Le schéma est géré uniquement par Alembic (alembic upgrade head) :
+# importer ce module ne crée pas de moteur et ne touche pas à la base.
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-handler = logging.StreamHandler()
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
-logger.addHandler(handler)
-# Créer les tables
-# ... (imports restent les mêmes)
-
-# Créer les tables
-models.Base.metadata.create_all(bind=engine)
-
-app = FastAPI(
-    title="Product Price Comparison API",
-    description="API REST pour comparer les prix de produits entre différents points de vente",
-    version="1.0.0",
-    openapi_url="/openapi.json",
-    docs_url="/docs",
-    redoc_url="/redoc"
-)
-app.add_middleware(
-        CORSMiddleware,
-        allow_origins=["*"],  # En production, spécifier les domaines autorisés
-        allow_credentials=True,
-        allow_methods=["*"],
-        allow_headers=["*"],
-    )
-# Dépendance pour obtenir la session de base de données
-# main.py
 
+router = APIRouter()
+
+def configure_logging():
+    """Ajoute le handler console une seule fois (rechargements et fabriques successives)"""
+    logger.setLevel(logging.INFO)
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        logger.addHandler(handler)
 
+def start_background_services():
+    # Ouvre une première connexion du pool pendant le démarrage plutôt qu'à la première requête
+    with get_engine().connect():
+        pass
+    db = SessionLocal()
+    try:
+        dimension_cache.cache.warm(db)
+        alerts.engine.warm(db)
+        price_dedup.cache.warm(db)
+    finally:
+        db.close()
+    idempotency.store.purge()
+    price_writer.writer.start()
+    events.broker.start()
+    jobs.manager.start()
+    offload.pool.start()
+    dimension_cache.cache.start()
+    tracing.tracer.start()
+
+def stop_background_services():
+    # Vider la file d'écriture différée avant l'arrêt du worker
+    price_writer.writer.close()
+    events.broker.stop()
+    jobs.manager.stop()
+    offload.pool.stop()
+    dimension_cache.cache.stop()
+    tracing.tracer.stop()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Démarrage et arrêt du worker : préchauffage des caches et des pools, puis arrêt propre"""
+    started = time.perf_counter()
+    await run_in_threadpool(start_background_services)
+    logger.info(f"Worker prêt en {(time.perf_counter() - started) * 1000:.0f} ms")
+    try:
+        yield
+    finally:
+        await run_in_threadpool(stop_background_services)
 
+def sparse_fields(
+    fields: Optional[str] = Query(None, description="Champs à retourner, séparés par des virgules (ex. price,id_date)")
+) -> Optional[List[str]]:
+    """Paramètre fields= des listes : seules ces colonnes sont lues en base"""
+    if not fields:
+        return None
+    return [name.strip() for name in fields.split(",") if name.strip()]
+
+def sparse_response(load) -> JSONResponse:
+    """Réponse d'une liste limitée à certains champs (hors response_model)"""
+    try:
+        return JSONResponse(content=load())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 # Dependency
 def get_db():
@@ -60,7 +117,7 @@ def get_db():
 # ENDPOINTS DE SANTÉ
 # ============================================================================
 
-@app.get("/health", tags=["Health"], summary="Vérifie l'état de santé de l'API")
+@router.get("/health", tags=["Health"], summary="Vérifie l'état de santé de l'API")
 def health_check(db: Session = Depends(get_db)):
     """Vérifie la connexion à la base de données et l'état général de l'API"""
     db_status = crud.check_db_connection(db)
@@ -70,11 +127,41 @@ def health_check(db: Session = Depends(get_db)):
         "timestamp": datetime.now().isoformat()
     }
 
+@router.get("/health/singleflight", tags=["Health"], summary="Statistiques de mutualisation des requêtes")
+def singleflight_stats():
+    """Nombre d'exécutions réelles en base et d'appels servis par une exécution partagée"""
+    return singleflight.group.stats()
+
+@router.get("/health/offload", tags=["Health"], summary="Statistiques du pool de post-traitement")
+def offload_stats():
+    """Appels traités sur place ou dans le pool de processus, avec leurs durées"""
+    return offload.pool.stats()
+
+@router.get("/health/dimensions", tags=["Health"], summary="État du cache des dimensions")
+def dimension_cache_stats():
+    """Version, taille et taux de succès du cache des produits, points de vente et dates"""
+    return dimension_cache.cache.stats()
+
+@router.get("/health/tracing", tags=["Health"], summary="État de l'export des traces")
+def tracing_stats():
+    """Taux d'échantillonnage, spans exportés, en attente et abandonnés"""
+    return tracing.tracer.stats()
+
+@router.get("/health/admission", tags=["Health"], summary="État du contrôle d'admission")
+def admission_stats():
+    """Requêtes en cours, en attente, admises et refusées par classe de routes"""
+    return admission.controller.stats()
+
+@router.get("/health/queries", tags=["Health"], summary="Budgets et dépassements des requêtes SQL")
+def query_budget_stats():
+    """Budget par route, requêtes interrompues par dépassement ou par déconnexion du client"""
+    return query_budget.budgets.stats()
+
 # ============================================================================
 # ENDPOINTS POUR LES PRODUITS
 # ============================================================================
 
-@app.post("/products/", 
+@router.post("/products/", 
           response_model=schemas.Product,
           status_code=status.HTTP_201_CREATED,
           tags=["Products"],
@@ -83,19 +170,31 @@ def create_product(product: schemas.ProductCreate, db: Session = Depends(get_db)
     """Crée un nouveau produit dans la base de données"""
     return crud.create_product(db, product)
 
-@app.get("/products/", 
+@router.get("/products/", 
          response_model=List[schemas.Product],
          tags=["Products"],
          summary="Lister tous les produits")
 def read_products(
     skip: int = Query(0, description="Nombre d'éléments à sauter"),
     limit: int = Query(100, description="Nombre maximum d'éléments à retourner"),
+    fields: Optional[List[str]] = Depends(sparse_fields),
     db: Session = Depends(get_db)
 ):
     """Retourne une liste paginée de tous les produits"""
+    if fields:
+        return sparse_response(lambda: crud.get_products(db, skip=skip, limit=limit, fields=fields))
     return crud.get_products(db, skip=skip, limit=limit)
 
-@app.get("/products/{product_id}", 
+@router.post("/products/batch-get", 
+          response_model=List[schemas.Product],
+          tags=["Products"],
+          summary="Obtenir plusieurs produits en un seul appel")
+def read_products_batch(batch: schemas.ProductBatchRequest, db: Session = Depends(get_db)):
+    """Retourne les produits demandés dans l'ordre des IDs, les IDs inconnus sont ignorés"""
+    products = {p.id: p for p in crud.get_products_by_ids(db, batch.ids)}
+    return [products[pid] for pid in dict.fromkeys(batch.ids) if pid in products]
+
+@router.get("/products/{product_id}", 
          response_model=schemas.Product,
          tags=["Products"],
          summary="Obtenir les détails d'un produit")
@@ -106,7 +205,7 @@ def read_product(product_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Produit non trouvé")
     return db_product
 
-@app.put("/products/{product_id}", 
+@router.put("/products/{product_id}", 
          response_model=schemas.Product,
          tags=["Products"],
          summary="Mettre à jour un produit")
@@ -121,7 +220,7 @@ def update_product(
         raise HTTPException(status_code=404, detail="Produit non trouvé")
     return updated_product
 
-@app.delete("/products/{product_id}", 
+@router.delete("/products/{product_id}", 
             status_code=status.HTTP_204_NO_CONTENT,
             tags=["Products"],
             summary="Supprimer un produit")
@@ -130,7 +229,7 @@ def delete_product(product_id: int, db: Session = Depends(get_db)):
     if not crud.delete_product(db, product_id):
         raise HTTPException(status_code=404, detail="Produit non trouvé")
 
-@app.get("/products/search/", 
+@router.get("/products/search/", 
          response_model=List[schemas.Product],
          tags=["Products"],
          summary="Recherche avancée de produits")
@@ -146,7 +245,7 @@ def search_products(
 # ENDPOINTS POUR LES POINTS DE VENTE
 # ============================================================================
 
-@app.post("/sale-points/", 
+@router.post("/sale-points/", 
           response_model=schemas.SalePoint,
           status_code=status.HTTP_201_CREATED,
           tags=["Sale Points"],
@@ -155,7 +254,7 @@ def create_sale_point(sale_point: schemas.SalePointCreate, db: Session = Depends
     """Crée un nouveau point de vente dans la base de données"""
     return crud.create_sale_point(db, sale_point)
 
-@app.get("/sale-points/", 
+@router.get("/sale-points/", 
          response_model=List[schemas.SalePoint],
          tags=["Sale Points"],
          summary="Lister tous les points de vente")
@@ -164,12 +263,15 @@ def read_sale_points(
     limit: int = Query(100, description="Nombre maximum d'éléments à retourner"),
     city: Optional[str] = Query(None, description="Filtrer par ville"),
     type: Optional[str] = Query(None, description="Filtrer par type de point de vente"),
+    fields: Optional[List[str]] = Depends(sparse_fields),
     db: Session = Depends(get_db)
 ):
     """Retourne une liste paginée de points de vente avec filtres optionnels"""
+    if fields:
+        return sparse_response(lambda: crud.get_sale_points(db, skip=skip, limit=limit, city=city, type=type, fields=fields))
     return crud.get_sale_points(db, skip=skip, limit=limit, city=city, type=type)
 
-@app.get("/sale-points/{sale_point_id}", 
+@router.get("/sale-points/{sale_point_id}", 
          response_model=schemas.SalePoint,
          tags=["Sale Points"],
          summary="Obtenir les détails d'un point de vente")
@@ -180,7 +282,7 @@ def read_sale_point(sale_point_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Point de vente non trouvé")
     return db_sale_point
 
-@app.put("/sale-points/{sale_point_id}", 
+@router.put("/sale-points/{sale_point_id}", 
          response_model=schemas.SalePoint,
          tags=["Sale Points"],
          summary="Mettre à jour un point de vente")
@@ -195,7 +297,7 @@ def update_sale_point(
         raise HTTPException(status_code=404, detail="Point de vente non trouvé")
     return updated_sale_point
 
-@app.delete("/sale-points/{sale_point_id}", 
+@router.delete("/sale-points/{sale_point_id}", 
             status_code=status.HTTP_204_NO_CONTENT,
             tags=["Sale Points"],
             summary="Supprimer un point de vente")
@@ -208,7 +310,7 @@ def delete_sale_point(sale_point_id: int, db: Session = Depends(get_db)):
 # ENDPOINTS POUR LES POINTS DE VENTE (AJOUTS)
 # ============================================================================
 
-@app.get("/sale-points/{sale_point_id}/products", 
+@router.get("/sale-points/{sale_point_id}/products", 
          response_model=List[schemas.Product],
          tags=["Sale Points"],
          summary="Obtenir les produits d'un point de vente")
@@ -222,11 +324,11 @@ def read_sale_point_products(sale_point_id: int, db: Session = Depends(get_db)):
     
     # Récupérer les produits correspondants
     product_ids = [assoc.id_product for assoc in associations]
-    products = [crud.get_product(db, pid) for pid in product_ids]
+    products = [dimension_cache.cache.product(db, pid) for pid in product_ids]
     
-    return [p for p in products if p is not None]
+    return [p._asdict() for p in products if p is not None]
 
-@app.get("/sale-points/{sale_point_id}/prices", 
+@router.get("/sale-points/{sale_point_id}/prices", 
          response_model=List[schemas.PriceDetail],
          tags=["Sale Points"],
          summary="Obtenir l'historique des prix d'un point de vente")
@@ -237,7 +339,7 @@ def read_sale_point_prices(sale_point_id: int, db: Session = Depends(get_db)):
 # ENDPOINTS POUR LES DATES
 # ============================================================================
 
-@app.post("/dates/", 
+@router.post("/dates/", 
           response_model=schemas.Date,
           status_code=status.HTTP_201_CREATED,
           tags=["Dates"],
@@ -246,7 +348,7 @@ def create_date(date_data: schemas.DateCreate, db: Session = Depends(get_db)):
     """Crée une nouvelle date dans la base de données"""
     return crud.create_date(db, date_data)
 
-@app.post("/dates/from-iso/", 
+@router.post("/dates/from-iso/", 
           response_model=schemas.Date,
           status_code=status.HTTP_201_CREATED,
           tags=["Dates"],
@@ -261,7 +363,7 @@ def create_date_from_iso(
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@app.get("/dates/", 
+@router.get("/dates/", 
          response_model=List[schemas.Date],
          tags=["Dates"],
          summary="Lister toutes les dates")
@@ -275,7 +377,7 @@ def read_dates(
     """Retourne une liste paginée de dates avec filtres optionnels"""
     return crud.get_dates(db, skip=skip, limit=limit, year=year, month=month)
 
-@app.get("/dates/{date_id}", 
+@router.get("/dates/{date_id}", 
          response_model=schemas.Date,
          tags=["Dates"],
          summary="Obtenir les détails d'une date")
@@ -286,7 +388,7 @@ def read_date(date_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Date non trouvée")
     return db_date
 
-@app.delete("/dates/{date_id}", 
+@router.delete("/dates/{date_id}", 
             status_code=status.HTTP_204_NO_CONTENT,
             tags=["Dates"],
             summary="Supprimer une date")
@@ -299,46 +401,52 @@ def delete_date(date_id: int, db: Session = Depends(get_db)):
 # ENDPOINTS POUR LES PRIX
 # ============================================================================
 
-@app.post("/prices/", 
+@router.post("/prices/", 
           response_model=schemas.Price,
           status_code=status.HTTP_201_CREATED,
           tags=["Prices"],
           summary="Créer un nouveau prix")
-def create_price(price: schemas.PriceCreate, db: Session = Depends(get_db)):
+def create_price(price: schemas.PriceCreate, response: Response, db: Session = Depends(get_db)):
     """Crée une nouvelle entrée de prix dans la base de données"""
-    # Vérifier que les entités associées existent
-    if not crud.get_product(db, price.id_product):
+    # Vérifier que les entités associées existent (cache des dimensions)
+    if not dimension_cache.cache.product(db, price.id_product):
         raise HTTPException(status_code=404, detail="Produit non trouvé")
-    if not crud.get_sale_point(db, price.id_sale_point):
+    if not dimension_cache.cache.sale_point(db, price.id_sale_point):
         raise HTTPException(status_code=404, detail="Point de vente non trouvé")
-    if not crud.get_date(db, price.id_date):
+    if not dimension_cache.cache.date(db, price.id_date):
         raise HTTPException(status_code=404, detail="Date non trouvée")
     
+    if price_writer.writer.enabled:
+        # Écriture différée : 202 si l'accusé de réception précède le commit
+        price_writer.writer.submit(price)
+        if price_writer.writer.durability == "enqueue":
+            response.status_code = status.HTTP_202_ACCEPTED
+        return price
     return crud.create_price(db, price)
 
-@app.get("/prices/", response_model=List[schemas.Price])
-async def read_prices(
+@router.get("/prices/", response_model=List[schemas.Price])
+def read_prices(
     response: Response,
     skip: int = 0,
     limit: int = 10,
     product_id: Optional[int] = None,
     sale_point_id: Optional[int] = None,
     date_id: Optional[int] = None,
+    fields: Optional[List[str]] = Depends(sparse_fields),
     db: Session = Depends(get_db)
 ):
-    count_query = db.query(models.Price)
-    if product_id is not None:
-        count_query = count_query.filter(models.Price.id_product == product_id)
-    if sale_point_id is not None:
-        count_query = count_query.filter(models.Price.id_sale_point == sale_point_id)
-    if date_id is not None:
-        count_query = count_query.filter(models.Price.id_date == date_id)
-    total_count = count_query.count()
+    total_count = crud.count_prices(db, product_id=product_id, sale_point_id=sale_point_id, date_id=date_id)
+    if fields:
+        sparse = sparse_response(lambda: crud.get_prices(
+            db, skip=skip, limit=limit, product_id=product_id, sale_point_id=sale_point_id, date_id=date_id, fields=fields
+        ))
+        sparse.headers["X-Total-Count"] = str(total_count)
+        return sparse
     prices = crud.get_prices(db, skip=skip, limit=limit, product_id=product_id, sale_point_id=sale_point_id, date_id=date_id)
     response.headers["X-Total-Count"] = str(total_count)
     return prices
 
-@app.get("/prices/{product_id}/{sale_point_id}/{date_id}", 
+@router.get("/prices/{product_id}/{sale_point_id}/{date_id}", 
          response_model=schemas.Price,
          tags=["Prices"],
          summary="Obtenir un prix spécifique")
@@ -354,7 +462,7 @@ def read_price(
         raise HTTPException(status_code=404, detail="Prix non trouvé")
     return db_price
 
-@app.delete("/prices/{product_id}/{sale_point_id}/{date_id}", 
+@router.delete("/prices/{product_id}/{sale_point_id}/{date_id}", 
             status_code=status.HTTP_204_NO_CONTENT,
             tags=["Prices"],
             summary="Supprimer un prix")
@@ -368,8 +476,8 @@ def delete_price(
     if not crud.delete_price(db, product_id, sale_point_id, date_id):
         raise HTTPException(status_code=404, detail="Prix non trouvé")
 
-@app.get("/products/{product_id}/prices", 
-         response_model=List[schemas.PriceHistoryEntry],
+@router.get("/products/{product_id}/prices", 
+         response_model=Union[List[schemas.PriceHistoryEntry], List[schemas.PriceHistoryBucket]],
          tags=["Prices"],
          summary="Historique des prix d'un produit")
 def get_price_history(
@@ -377,28 +485,103 @@ def get_price_history(
     sale_point_id: Optional[int] = Query(None, description="Filtrer par point de vente"),
     start_date: Optional[str] = Query(None, description="Date de début (YYYY-MM-DD)"),
     end_date: Optional[str] = Query(None, description="Date de fin (YYYY-MM-DD)"),
+    bucket: Optional[schemas.HistoryBucket] = Query(None, description="Agrégation par jour, semaine ou mois"),
+    max_points: Optional[int] = Query(None, ge=3, description="Nombre maximum de points retournés"),
+    fill_daily: Optional[bool] = Query(None, description="Reconstituer une ligne par jour (par défaut en ingestion par changements)"),
     db: Session = Depends(get_db)
 ):
-    """Retourne l'historique des prix pour un produit spécifique"""
-    return crud.get_price_history(db, product_id, sale_point_id, start_date, end_date)
+    """Retourne l'historique des prix pour un produit spécifique, éventuellement sous-échantillonné"""
+    if bucket or max_points:
+        return crud.get_price_history_buckets(
+            db, product_id, sale_point_id, start_date, end_date,
+            bucket=bucket.value if bucket else None,
+            max_points=max_points
+        )
+    return Response(
+        content=crud.get_price_history_json(db, product_id, sale_point_id, start_date, end_date, fill_daily),
+        media_type="application/json"
+    )
 
-@app.get("/products/{product_id}/price-comparison", 
+@router.get("/products/{product_id}/price-comparison", 
          response_model=List[schemas.PriceComparison],
          tags=["Prices"],
          summary="Comparaison des prix pour un produit")
 def get_price_comparison(
     product_id: int,
     specific_date: Optional[str] = Query(None, description="Date spécifique (YYYY-MM-DD)"),
+    as_of: bool = Query(False, description="Dernier prix au plus tard à la date spécifique, et non observé ce jour-là"),
+    fields: Optional[List[str]] = Depends(sparse_fields),
     db: Session = Depends(get_db)
 ):
     """Compare les prix d'un produit entre différents points de vente"""
-    return crud.get_price_comparison(db, product_id, specific_date)
+    if as_of and specific_date:
+        return sparse_response(lambda: singleflight.group.do(
+            f"price-comparison-as-of:{product_id}:{specific_date}:{','.join(fields or [])}",
+            lambda: crud.get_price_comparison(db, product_id, specific_date, fields=fields, as_of=True)
+        ))
+    if fields:
+        return sparse_response(lambda: singleflight.group.do(
+            f"price-comparison:{product_id}:{specific_date}:{','.join(fields)}",
+            lambda: crud.get_price_comparison(db, product_id, specific_date, fields=fields)
+        ))
+    return singleflight.group.do(
+        f"price-comparison:{product_id}:{specific_date}",
+        lambda: [dict(r._mapping) for r in crud.get_price_comparison(db, product_id, specific_date)]
+    )
+
+@router.get("/products/{product_id}/prices/as-of", 
+         response_model=List[schemas.PriceSnapshot],
+         tags=["Prices"],
+         summary="Prix d'un produit à une ou plusieurs dates (as-of)")
+def get_prices_as_of(
+    product_id: int,
+    dates: Optional[List[str]] = Query(None, alias="date", description="Dates des instantanés (YYYY-MM-DD), répétables"),
+    start_date: Optional[str] = Query(None, description="Début d'une série d'instantanés (YYYY-MM-DD)"),
+    end_date: Optional[str] = Query(None, description="Fin de la série (YYYY-MM-DD), aujourd'hui par défaut"),
+    bucket: schemas.HistoryBucket = Query(schemas.HistoryBucket.day, description="Pas de la série : jour, semaine ou mois (le 1er de chaque mois)"),
+    sale_point_id: Optional[int] = Query(None, description="Filtrer par point de vente"),
+    db: Session = Depends(get_db)
+):
+    """Pour chaque date, dernier prix connu à cette date ou avant dans chaque point de vente"""
+    try:
+        days = [datetime.strptime(d, "%Y-%m-%d").date() for d in dates or []]
+        if start_date:
+            day = datetime.strptime(start_date, "%Y-%m-%d").date()
+            end = datetime.strptime(end_date, "%Y-%m-%d").date() if end_date else datetime.now().date()
+            while day <= end and len(days) <= settings.as_of_max_snapshots:
+                days.append(day)
+                if bucket == schemas.HistoryBucket.month:
+                    day = (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+                else:
+                    day += timedelta(days=7 if bucket == schemas.HistoryBucket.week else 1)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates attendues au format YYYY-MM-DD")
+    if not days:
+        raise HTTPException(status_code=400, detail="Indiquer au moins une date ou une date de début")
+    if len(set(days)) > settings.as_of_max_snapshots:
+        raise HTTPException(status_code=400, detail=f"Au plus {settings.as_of_max_snapshots} instantanés par requête")
+    return crud.get_prices_as_of(db, product_id, days, sale_point_id)
+
+@router.post("/prices/comparison/batch", 
+          response_model=List[schemas.ProductPriceComparison],
+          tags=["Prices"],
+          summary="Comparaison des prix pour plusieurs produits")
+def get_price_comparisons(
+    batch: schemas.PriceComparisonBatchRequest,
+    db: Session = Depends(get_db)
+):
+    """Compare les prix de plusieurs produits entre points de vente en une seule requête"""
+    comparisons = crud.get_price_comparisons(db, list(dict.fromkeys(batch.product_ids)), batch.specific_date)
+    return [
+        {"product_id": product_id, "prices": prices}
+        for product_id, prices in comparisons.items()
+    ]
 
 # ============================================================================
 # ENDPOINTS POUR LES ASSOCIATIONS PRODUIT-POINT DE VENTE
 # ============================================================================
 
-@app.post("/product-sale-points/", 
+@router.post("/product-sale-points/", 
           response_model=schemas.ProductSalePoint,
           status_code=status.HTTP_201_CREATED,
           tags=["Product-SalePoint Associations"],
@@ -408,15 +591,15 @@ def create_product_sale_point(
     db: Session = Depends(get_db)
 ):
     """Crée une nouvelle association entre un produit et un point de vente"""
-    # Vérifier que les entités existent
-    if not crud.get_product(db, psp.id_product):
+    # Vérifier que les entités existent (cache des dimensions)
+    if not dimension_cache.cache.product(db, psp.id_product):
         raise HTTPException(status_code=404, detail="Produit non trouvé")
-    if not crud.get_sale_point(db, psp.id_sale_point):
+    if not dimension_cache.cache.sale_point(db, psp.id_sale_point):
         raise HTTPException(status_code=404, detail="Point de vente non trouvé")
     
     return crud.create_product_sale_point(db, psp)
 
-@app.get("/product-sale-points/", 
+@router.get("/product-sale-points/", 
          response_model=List[schemas.ProductSalePoint],
          tags=["Product-SalePoint Associations"],
          summary="Lister toutes les associations")
@@ -432,7 +615,7 @@ def read_product_sale_points(
                                       product_id=product_id, 
                                       sale_point_id=sale_point_id)
 
-@app.get("/product-sale-points/{product_id}/{sale_point_id}", 
+@router.get("/product-sale-points/{product_id}/{sale_point_id}", 
          response_model=schemas.ProductSalePoint,
          tags=["Product-SalePoint Associations"],
          summary="Obtenir une association spécifique")
@@ -447,7 +630,7 @@ def read_product_sale_point(
         raise HTTPException(status_code=404, detail="Association non trouvée")
     return db_psp
 
-@app.delete("/product-sale-points/{product_id}/{sale_point_id}", 
+@router.delete("/product-sale-points/{product_id}/{sale_point_id}", 
             status_code=status.HTTP_204_NO_CONTENT,
             tags=["Product-SalePoint Associations"],
             summary="Supprimer une association")
@@ -460,11 +643,99 @@ def delete_product_sale_point(
     if not crud.delete_product_sale_point(db, product_id, sale_point_id):
         raise HTTPException(status_code=404, detail="Association non trouvée")
 
+# ============================================================================
+# ENDPOINTS POUR LES ALERTES DE PRIX
+# ============================================================================
+
+@router.post("/alerts/", 
+          response_model=schemas.PriceAlert,
+          status_code=status.HTTP_201_CREATED,
+          tags=["Alerts"],
+          summary="Créer une alerte de baisse de prix")
+def create_alert(alert: schemas.PriceAlertCreate, db: Session = Depends(get_db)):
+    """Enregistre une alerte déclenchée dès qu'un prix passe sous le seuil"""
+    if not crud.get_product(db, alert.id_product):
+        raise HTTPException(status_code=404, detail="Produit non trouvé")
+    if alert.id_sale_point is not None and not crud.get_sale_point(db, alert.id_sale_point):
+        raise HTTPException(status_code=404, detail="Point de vente non trouvé")
+    return crud.create_alert(db, alert)
+
+@router.get("/alerts/", 
+         response_model=List[schemas.PriceAlert],
+         tags=["Alerts"],
+         summary="Lister les alertes")
+def read_alerts(
+    skip: int = Query(0, description="Nombre d'éléments à sauter"),
+    limit: int = Query(100, description="Nombre maximum d'éléments à retourner"),
+    product_id: Optional[int] = Query(None, description="Filtrer par ID de produit"),
+    active: Optional[bool] = Query(None, description="Filtrer par état actif"),
+    db: Session = Depends(get_db)
+):
+    """Retourne une liste paginée d'alertes"""
+    return crud.get_alerts(db, skip=skip, limit=limit, product_id=product_id, active=active)
+
+@router.delete("/alerts/{alert_id}", 
+            status_code=status.HTTP_204_NO_CONTENT,
+            tags=["Alerts"],
+            summary="Supprimer une alerte")
+def delete_alert(alert_id: int, db: Session = Depends(get_db)):
+    """Supprime une alerte et ses notifications"""
+    if not crud.delete_alert(db, alert_id):
+        raise HTTPException(status_code=404, detail="Alerte non trouvée")
+
+@router.get("/alerts/outbox", 
+         response_model=List[schemas.AlertNotification],
+         tags=["Alerts"],
+         summary="Notifications d'alertes à livrer")
+def read_alert_outbox(
+    limit: int = Query(100, description="Nombre maximum d'éléments à retourner"),
+    pending_only: bool = Query(True, description="Uniquement les notifications non livrées"),
+    db: Session = Depends(get_db)
+):
+    """Retourne les alertes déclenchées en attente de livraison"""
+    return crud.get_alert_outbox(db, limit=limit, pending_only=pending_only)
+
+@router.post("/alerts/outbox/{outbox_id}/delivered", 
+          response_model=schemas.AlertNotification,
+          tags=["Alerts"],
+          summary="Marquer une notification comme livrée")
+def mark_alert_delivered(outbox_id: int, db: Session = Depends(get_db)):
+    """Marque une notification comme livrée"""
+    db_entry = crud.mark_alert_delivered(db, outbox_id)
+    if not db_entry:
+        raise HTTPException(status_code=404, detail="Notification non trouvée")
+    return db_entry
+
+# ============================================================================
+# ENDPOINTS POUR LES PANIERS
+# ============================================================================
+
+@router.post("/baskets/compare",
+          response_model=schemas.BasketComparison,
+          tags=["Baskets"],
+          summary="Points de vente les moins chers pour une liste de courses")
+def compare_basket(basket: schemas.BasketCompareRequest, db: Session = Depends(get_db)):
+    """Classe les points de vente (ou les villes) selon le total du panier aux derniers prix connus"""
+    started = time.monotonic()
+    quantities: Dict[int, float] = {}
+    for item in basket.items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+    return baskets.compare(
+        db,
+        quantities,
+        group_by=basket.group_by.value,
+        city=basket.city,
+        min_coverage=basket.min_coverage,
+        split=basket.split,
+        limit=basket.limit,
+        started=started
+    )
+
 # ============================================================================
 # ENDPOINTS POUR LES STATISTIQUES
 # ============================================================================
 
-@app.get("/stats/products-with-prices-count", 
+@router.get("/stats/products-with-prices-count", 
          response_model=int,
          tags=["Statistics"],
          summary="Nombre de produits avec des prix")
@@ -472,7 +743,7 @@ def get_products_with_prices_count(db: Session = Depends(get_db)):
     """Retourne le nombre de produits ayant au moins un prix associé"""
     return crud.get_products_with_prices_count(db)
 
-@app.get("/stats/products-by-sale-point", 
+@router.get("/stats/products-by-sale-point", 
          response_model=List[schemas.ProductsBySalePoint],
          tags=["Statistics"],
          summary="Nombre de produits par point de vente")
@@ -480,7 +751,7 @@ def get_products_by_sale_point_count(db: Session = Depends(get_db)):
     """Retourne le nombre de produits par point de vente"""
     return crud.get_products_by_sale_point_count(db)
 
-@app.get("/stats/sale-points-by-city", 
+@router.get("/stats/sale-points-by-city", 
          response_model=List[schemas.SalePointsByCity],
          tags=["Statistics"],
          summary="Nombre de points de vente par ville")
@@ -488,7 +759,7 @@ def get_sale_points_by_city(db: Session = Depends(get_db)):
     """Retourne le nombre de points de vente par ville"""
     return crud.get_sale_points_by_city(db)
 
-@app.get("/stats/sale-points-by-type", 
+@router.get("/stats/sale-points-by-type", 
          response_model=List[schemas.SalePointsByType],
          tags=["Statistics"],
          summary="Nombre de points de vente par type")
@@ -496,7 +767,7 @@ def get_sale_points_by_type(db: Session = Depends(get_db)):
     """Retourne le nombre de points de vente par type"""
     return crud.get_sale_points_by_type(db)
 
-@app.get("/stats/prices-by-month", 
+@router.get("/stats/prices-by-month", 
          response_model=List[schemas.PricesByMonth],
          tags=["Statistics"],
          summary="Statistiques de prix par mois")
@@ -504,7 +775,7 @@ def get_prices_by_month(db: Session = Depends(get_db)):
     """Retourne des statistiques sur les prix par mois"""
     return crud.get_prices_by_month(db)
 
-@app.get("/stats/average-prices-by-product", 
+@router.get("/stats/average-prices-by-product", 
          response_model=List[schemas.AveragePricesByProduct],
          tags=["Statistics"],
          summary="Prix moyens par produit")
@@ -512,7 +783,7 @@ def get_average_prices_by_product(db: Session = Depends(get_db)):
     """Retourne les prix moyens, min et max par produit"""
     return crud.get_average_prices_by_product(db)
 
-@app.get("/stats/products/{product_id}/price-evolution", 
+@router.get("/stats/products/{product_id}/price-evolution", 
          response_model=List[schemas.PriceEvolution],
          tags=["Statistics"],
          summary="Évolution du prix d'un produit")
@@ -520,31 +791,276 @@ def get_price_evolution(product_id: int, db: Session = Depends(get_db)):
     """Retourne l'évolution historique du prix d'un produit"""
     return crud.get_price_evolution(db, product_id)
 
-@app.get("/stats/products/{product_id}/city-comparison", 
+@router.get("/stats/products/{product_id}/city-comparison", 
          response_model=List[schemas.CityPriceComparison],
          tags=["Statistics"],
          summary="Comparaison des prix par ville")
 def get_city_price_comparison(product_id: int, db: Session = Depends(get_db)):
     """Compare les prix d'un produit entre différentes villes"""
-    return crud.get_city_price_comparison(db, product_id)
+    return singleflight.group.do(
+        f"city-comparison:{product_id}",
+        lambda: crud.get_city_price_comparison(db, product_id)
+    )
 
-@app.get("/stats/price-trends", 
+@router.get("/stats/price-trends", 
          response_model=List[schemas.PriceTrend],
          tags=["Statistics"],
          summary="Tendances de prix récentes")
 def get_price_trends(
     days: int = Query(30, description="Nombre de jours à analyser"),
+    background: bool = Query(False, description="Exécuter en travail d'arrière-plan (réponse 202)"),
     db: Session = Depends(get_db)
 ):
     """Analyse les tendances de prix sur une période donnée"""
-    return crud.get_price_trends(db, days)
+    if background:
+        return submit_job_response("price_trends", {"days": days})
+    return singleflight.group.do(
+        f"price-trends:{days}",
+        lambda: crud.get_price_trends(db, days)
+    )
+
+@router.get("/stats/price-volatility", 
+         response_model=List[schemas.PriceVolatility],
+         tags=["Statistics"],
+         summary="Volatilité et percentiles des prix")
+def get_price_volatility(
+    days: int = Query(30, description="Nombre de jours à analyser"),
+    group_by: schemas.PriceGroupBy = Query(schemas.PriceGroupBy.sale_point, description="Regroupement : point de vente, ville ou type"),
+    product_id: Optional[int] = Query(None, description="Filtrer par ID de produit"),
+    type: Optional[schemas.SalePointType] = Query(None, description="Filtrer par type de point de vente"),
+    background: bool = Query(False, description="Exécuter en travail d'arrière-plan (réponse 202)"),
+    db: Session = Depends(get_db)
+):
+    """Médiane, p10/p90, écart-type, coefficient de variation et variation jour à jour"""
+    if background:
+        return submit_job_response("price_volatility", {
+            "days": days,
+            "group_by": group_by.value,
+            "product_id": product_id,
+            "sale_point_type": type.value if type else None
+        })
+    return singleflight.group.do(
+        f"price-volatility:{days}:{group_by.value}:{product_id}:{type.value if type else None}",
+        lambda: crud.get_price_volatility(
+            db,
+            days=days,
+            group_by=group_by.value,
+            product_id=product_id,
+            sale_point_type=type.value if type else None
+        )
+    )
+
+# ============================================================================
+# ENDPOINTS POUR LES TRAVAUX D'ARRIÈRE-PLAN
+# ============================================================================
+
+def submit_job_response(kind: str, params: Dict[str, Any]) -> JSONResponse:
+    job = jobs.manager.submit(kind, params)
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content=schemas.Job(**job).model_dump(mode="json"),
+        headers={"Location": f"/jobs/{job['id']}"}
+    )
+
+@router.post("/jobs", 
+          response_model=schemas.Job,
+          status_code=status.HTTP_202_ACCEPTED,
+          tags=["Jobs"],
+          summary="Soumettre une analyse longue ou un export")
+def create_job(job: schemas.JobCreate):
+    """Lance le travail dans un processus séparé ; suivre son état via GET /jobs/{id}"""
+    return submit_job_response(job.kind.value, job.params)
+
+@router.get("/jobs/{job_id}", 
+         response_model=schemas.Job,
+         tags=["Jobs"],
+         summary="État d'un travail")
+def read_job(job_id: str):
+    db_job = jobs.manager.get(job_id)
+    if db_job is None:
+        raise HTTPException(status_code=404, detail="Travail non trouvé")
+    return db_job
+
+@router.get("/jobs/{job_id}/result", 
+         tags=["Jobs"],
+         summary="Résultat d'un travail terminé")
+def read_job_result(job_id: str):
+    """Renvoie le fichier résultat (JSON ou CSV) en flux"""
+    db_job = jobs.manager.get(job_id)
+    if db_job is None:
+        raise HTTPException(status_code=404, detail="Travail non trouvé")
+    result = jobs.manager.result(job_id)
+    if result is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Travail dans l'état '{db_job['status']}', aucun résultat disponible"
+        )
+    path, media_type = result
+    extension = "csv" if media_type == "text/csv" else "json"
+    return FileResponse(path, media_type=media_type, filename=f"{db_job['kind']}-{job_id}.{extension}")
+
+@router.delete("/jobs/{job_id}", 
+            response_model=schemas.Job,
+            tags=["Jobs"],
+            summary="Annuler un travail")
+def cancel_job(job_id: str):
+    db_job = jobs.manager.cancel(job_id)
+    if db_job is None:
+        raise HTTPException(status_code=404, detail="Travail non trouvé")
+    return db_job
+
+# ============================================================================
+# FLUX DES CHANGEMENTS DE PRIX
+# ============================================================================
+
+@router.get("/stream/prices", 
+         tags=["Stream"],
+         summary="Flux des changements de prix (Server-Sent Events)")
+async def stream_prices(
+    request: Request,
+    product_id: Optional[int] = Query(None, description="Filtrer par ID de produit"),
+    sale_point_id: Optional[int] = Query(None, description="Filtrer par point de vente"),
+):
+    """Pousse chaque création ou suppression de prix au lieu d'un polling de /prices/"""
+    subscription = events.broker.subscribe(product_id, sale_point_id)
+
+    async def event_source():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(subscription.get(), timeout=settings.events_keepalive_seconds)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            events.broker.unsubscribe(subscription)
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.websocket("/stream/prices/ws")
+async def stream_prices_ws(
+    websocket: WebSocket,
+    product_id: Optional[int] = None,
+    sale_point_id: Optional[int] = None
+):
+    """Même flux que /stream/prices, via WebSocket"""
+    await websocket.accept()
+    subscription = events.broker.subscribe(product_id, sale_point_id)
+
+    async def forward_events():
+        while True:
+            await websocket.send_json(await subscription.get())
+
+    async def wait_for_disconnect():
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    tasks = [asyncio.create_task(forward_events()), asyncio.create_task(wait_for_disconnect())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.exception()  # la déconnexion du client termine normalement le flux
+    finally:
+        for task in tasks:
+            task.cancel()
+        events.broker.unsubscribe(subscription)
+
+# ============================================================================
+# PROFILAGE
+# ============================================================================
+
+def require_profiling_token(x_profile_token: Optional[str] = Header(None)):
+    """Surface invisible (404) si le profilage est désactivé ou le jeton invalide"""
+    if not profiling.profiler.check(x_profile_token):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+@router.get("/debug/profile", tags=["Debug"], response_class=PlainTextResponse,
+            dependencies=[Depends(require_profiling_token)],
+            summary="Échantillonne le worker et retourne des piles au format collapsed")
+def profile_worker(
+    response: Response,
+    seconds: float = Query(5, gt=0, le=settings.profiling_max_seconds),
+    interval_ms: Optional[int] = Query(None, ge=1, le=1000)
+):
+    """Piles de tous les threads du worker qui répond, une ligne « pile nombre » par pile
+    (flamegraph.pl, speedscope) ; les requêtes SQL en cours apparaissent en feuille `[sql]`"""
+    sampler = profiling.profiler.profile_worker(seconds, interval_ms / 1000 if interval_ms else None)
+    if sampler is None:
+        raise HTTPException(status_code=409, detail="Une mesure est déjà en cours sur ce worker")
+    return PlainTextResponse(
+        profiling.collapsed(sampler.counts),
+        headers={"X-Profile-Worker": str(os.getpid()), "X-Profile-Samples": str(sampler.samples)}
+    )
+
+@router.get("/debug/profile/requests", tags=["Debug"], dependencies=[Depends(require_profiling_token)],
+            summary="Derniers profils de requête de ce worker")
+def list_request_profiles():
+    return profiling.profiler.recent()
+
+@router.get("/debug/profile/requests/{profile_id}", tags=["Debug"], response_class=PlainTextResponse,
+            dependencies=[Depends(require_profiling_token)],
+            summary="Piles d'une requête profilée (en-tête X-Profile)")
+def read_request_profile(profile_id: str):
+    profile = profiling.profiler.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profil non trouvé sur ce worker")
+    return PlainTextResponse(
+        profiling.collapsed(profile.counts),
+        headers={"X-Profile-Samples": str(profile.samples), "X-Profile-Duration-Ms": f"{profile.duration_ms:.1f}"}
+    )
 
 # ============================================================================
 # DOCUMENTATION ALTERNATIVE
 # ============================================================================
 
-@app.get("/", include_in_schema=False)
+@router.get("/", include_in_schema=False)
 async def redirect_to_docs():
     return RedirectResponse(url="/docs")
 
+# ============================================================================
+# FABRIQUE DE L'APPLICATION
+# ============================================================================
+
+def create_app() -> FastAPI:
+    """Construit l'application ; les services (base, caches, pools) démarrent dans le lifespan"""
+    configure_logging()
+    app = FastAPI(
+        title="Product Price Comparison API",
+        description="API REST pour comparer les prix de produits entre différents points de vente",
+        version="1.0.0",
+        openapi_url="/openapi.json",
+        docs_url="/docs",
+        redoc_url="/redoc",
+        lifespan=lifespan
+    )
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # En production, spécifier les domaines autorisés
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.add_middleware(idempotency.IdempotencyMiddleware, store=idempotency.store)
+    # Après l'idempotence : les réponses enregistrées restent non compressées
+    app.add_middleware(compression.CompressionMiddleware, **compression.middleware_options())
+    if profiling.profiler.enabled:
+        # Désactivé : ni middleware ni écouteurs SQL, aucun coût par requête
+        profiling.profiler.install()
+        app.add_middleware(profiling.ProfilingMiddleware, profiler=profiling.profiler)
+    query_budget.budgets.install()
+    app.add_middleware(query_budget.QueryBudgetMiddleware, budgets=query_budget.budgets)
+    # Refus avant toute réservation (idempotence) ou accès à la base
+    app.add_middleware(admission.AdmissionMiddleware, controller=admission.controller)
+    if tracing.tracer.enabled:
+        # En dernier : le span de la requête englobe tous les autres middlewares
+        tracing.tracer.install(crud)
+        app.add_middleware(tracing.TracingMiddleware, tracer=tracing.tracer)
+    app.include_router(router)
+    return app
 
+app = create_app()
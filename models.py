@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey,Float
+from sqlalchemy import Column, Integer, String, ForeignKey, Float, Boolean, DateTime, LargeBinary, Index, Text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -32,9 +32,19 @@ class Price(Base):
     id_sale_point = Column(Integer, ForeignKey("sale_points.id"), primary_key=True)
     id_date = Column(Integer, ForeignKey("dates.id"), primary_key=True)
     price = Column(Float, nullable=False)
+    # Dernière date où le même prix a été observé (ingestion par changements uniquement)
+    id_date_last_seen = Column(Integer, ForeignKey("dates.id"), nullable=True)
     product = relationship("Product", back_populates="prices")
     sale_point = relationship("SalePoint", back_populates="prices")
-    date = relationship("Date", back_populates="prices")
+    date = relationship("Date", back_populates="prices", foreign_keys=[id_date])
+
+    __table_args__ = (
+        # Prix au plus tard à une date : lignes du produit par point de vente sans lecture de la table
+        Index(
+            "ix_prices_as_of", id_product, id_sale_point, id_date.desc(),
+            postgresql_include=["price"]
+        ),
+    )
 
 class ProductSalePoint(Base):
     __tablename__ = "product_sale_points"
@@ -52,4 +62,60 @@ class Date(Base):
     day = Column(Integer, nullable=False)
     month = Column(Integer, nullable=False)
     year = Column(Integer, nullable=False)    
-    prices = relationship("Price", back_populates="date")
+    prices = relationship("Price", back_populates="date", foreign_keys="Price.id_date")
+
+    __table_args__ = (
+        # Clé YYYYMMDD : filtres et tris dans l'ordre du calendrier, identifiant inclus (index couvrant)
+        Index("ix_dates_key", year * 10000 + month * 100 + day, postgresql_include=["id"]),
+    )
+
+class PriceAlert(Base):
+    __tablename__ = "price_alerts"
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    id_product = Column(Integer, ForeignKey("products.id"), nullable=False, index=True)
+    threshold = Column(Float, nullable=False)
+    city = Column(String, nullable=True)
+    id_sale_point = Column(Integer, ForeignKey("sale_points.id"), nullable=True)
+    contact = Column(String, nullable=True)
+    active = Column(Boolean, nullable=False, default=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.now)
+
+    notifications = relationship("AlertOutbox", back_populates="alert")
+
+class AlertOutbox(Base):
+    __tablename__ = "alert_outbox"
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    id_alert = Column(Integer, ForeignKey("price_alerts.id"), nullable=False)
+    id_product = Column(Integer, nullable=False)
+    id_sale_point = Column(Integer, nullable=False)
+    id_date = Column(Integer, nullable=False)
+    price = Column(Float, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.now)
+    delivered_at = Column(DateTime, nullable=True, index=True)
+
+    alert = relationship("PriceAlert", back_populates="notifications")
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    # Empreinte du client (clé d'API ou adresse IP) et de la clé d'idempotence qu'il a choisie
+    key = Column(String(255), primary_key=True)
+    # Empreinte de la méthode, du chemin et du corps de la requête d'origine
+    request_hash = Column(String(64), nullable=False)
+    # NULL tant que la requête d'origine est en cours
+    status_code = Column(Integer, nullable=True)
+    content_type = Column(String, nullable=True)
+    # En-têtes de la réponse d'origine (liste JSON de paires nom/valeur), rejoués tels quels
+    headers = Column(Text, nullable=True)
+    body = Column(LargeBinary, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.now, index=True)
+
+class SalePointShard(Base):
+    __tablename__ = "sale_point_shards"
+
+    # Shard des prix d'un point de vente (shard_key="city"), fixé à sa création :
+    # changer de ville ne déplace pas ses prix
+    id_sale_point = Column(Integer, ForeignKey("sale_points.id", ondelete="CASCADE"), primary_key=True)
+    shard = Column(String, nullable=False)
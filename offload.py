@@ -0,0 +1,194 @@
+# offload.py
+import logging
+import multiprocessing
+import threading
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# COLONNES EN MÉMOIRE PARTAGÉE
+# ============================================================================
+
+class SharedColumns:
+    """Colonnes numériques (array) copiées une fois dans un segment de mémoire partagée
+
+    Le descripteur (nom du segment, type, décalage et longueur de chaque
+    colonne) est seul transmis au processus de calcul, qui relit les colonnes
+    sans copie via des memoryview.
+    """
+
+    def __init__(self, columns: Dict[str, array]):
+        self.layout = []
+        offset = 0
+        for name, values in columns.items():
+            nbytes = len(values) * values.itemsize
+            self.layout.append((name, values.typecode, offset, nbytes))
+            # Alignement sur 8 octets pour les lectures de doubles
+            offset += (nbytes + 7) & ~7
+        self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        for (name, _, start, nbytes), values in zip(self.layout, columns.values()):
+            self.shm.buf[start:start + nbytes] = memoryview(values).cast("B")
+
+    @property
+    def descriptor(self) -> tuple:
+        return self.shm.name, self.layout
+
+    def release(self):
+        self.shm.close()
+        self.shm.unlink()
+
+def _attach(descriptor: tuple):
+    name, layout = descriptor
+    shm = shared_memory.SharedMemory(name=name)
+    columns = {
+        column: shm.buf[start:start + nbytes].cast(typecode)
+        for column, typecode, start, nbytes in layout
+    }
+    return shm, columns
+
+def _call_with_columns(fn: Callable, descriptor: tuple, args: tuple):
+    """Exécuté dans le processus de calcul : attache le segment et appelle fn"""
+    started = time.perf_counter()
+    shm, columns = _attach(descriptor)
+    try:
+        result = fn(columns, *args)
+    finally:
+        # Les memoryview doivent être libérées avant de fermer le segment
+        for view in columns.values():
+            view.release()
+        shm.close()
+    return result, (time.perf_counter() - started) * 1000
+
+def _warm_up():
+    return None
+
+# ============================================================================
+# POOL DE PROCESSUS PARTAGÉ
+# ============================================================================
+
+class _TaskStats:
+    __slots__ = ("inline", "offloaded", "rows", "total_ms", "worker_ms", "max_ms")
+
+    def __init__(self):
+        self.inline = 0
+        self.offloaded = 0
+        self.rows = 0
+        self.total_ms = 0.0
+        self.worker_ms = 0.0
+        self.max_ms = 0.0
+
+class ProcessOffloader:
+    """Exécute le post-traitement CPU (agrégation, sous-échantillonnage, encodage)
+    dans un pool de processus partagé pour ne pas bloquer le GIL du worker
+
+    Les résultats de moins de `min_rows` lignes sont traités sur place :
+    l'aller-retour vers le pool coûte plus cher que le calcul. Avec
+    `pool_size=0`, tout est traité sur place.
+    """
+
+    def __init__(self, pool_size: int = 2, min_rows: int = 5000, timeout_s: float = 30.0, start_method: str = "spawn"):
+        self.pool_size = pool_size
+        self.min_rows = min_rows
+        self.timeout_s = timeout_s
+        self._start_method = start_method
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._stats: Dict[str, _TaskStats] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.pool_size > 0
+
+    def start(self):
+        """Crée le pool et démarre ses processus pour éviter la latence au premier appel"""
+        if not self.enabled:
+            return
+        pool = self._get_pool()
+        for future in [pool.submit(_warm_up) for _ in range(self.pool_size)]:
+            future.result()
+
+    def stop(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.pool_size,
+                    mp_context=multiprocessing.get_context(self._start_method)
+                )
+            return self._pool
+
+    def run(self, name: str, fn: Callable, columns: Dict[str, array], *args) -> Any:
+        """Appelle fn(columns, *args), dans le pool si le volume le justifie
+
+        fn doit être une fonction de module (sérialisable) ; elle reçoit les
+        colonnes sous forme de séquences indexables (array ou memoryview).
+        """
+        rows = len(next(iter(columns.values()))) if columns else 0
+        started = time.perf_counter()
+        if not self.enabled or rows < self.min_rows:
+            result = fn(columns, *args)
+            self._record(name, rows, (time.perf_counter() - started) * 1000, None)
+            return result
+
+        block = SharedColumns(columns)
+        try:
+            future = self._get_pool().submit(_call_with_columns, fn, block.descriptor, args)
+            result, worker_ms = future.result(timeout=self.timeout_s)
+        finally:
+            block.release()
+        self._record(name, rows, (time.perf_counter() - started) * 1000, worker_ms)
+        return result
+
+    def _record(self, name: str, rows: int, total_ms: float, worker_ms: Optional[float]):
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = _TaskStats()
+            if worker_ms is None:
+                stats.inline += 1
+            else:
+                stats.offloaded += 1
+                stats.worker_ms += worker_ms
+            stats.rows += rows
+            stats.total_ms += total_ms
+            stats.max_ms = max(stats.max_ms, total_ms)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            tasks = {}
+            for name, s in self._stats.items():
+                calls = s.inline + s.offloaded
+                tasks[name] = {
+                    "inline": s.inline,
+                    "offloaded": s.offloaded,
+                    "rows": s.rows,
+                    "avg_ms": round(s.total_ms / calls, 3) if calls else 0.0,
+                    "max_ms": round(s.max_ms, 3),
+                    # Temps passé dans le pool, hors transfert et attente
+                    "avg_worker_ms": round(s.worker_ms / s.offloaded, 3) if s.offloaded else None,
+                }
+        return {
+            "pool_size": self.pool_size,
+            "min_rows": self.min_rows,
+            "running": self._pool is not None,
+            "tasks": tasks,
+        }
+
+pool = ProcessOffloader(
+    pool_size=settings.offload_pool_size,
+    min_rows=settings.offload_min_rows,
+    timeout_s=settings.offload_timeout_s,
+    start_method=settings.offload_start_method
+)
@@ -0,0 +1,148 @@
+# price_dedup.py
+import logging
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import func, and_, tuple_
+from sqlalchemy.orm import Session, aliased
+
+import models
+import schemas
+import sharding
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Les dates sont comparées par leur clé YYYYMMDD : une date ajoutée après coup a un identifiant plus grand
+class LastPrice(NamedTuple):
+    id_date: int
+    date_key: int
+    price: float
+    last_seen_key: Optional[int] = None
+
+class ValidityExtension(NamedTuple):
+    id_product: int
+    id_sale_point: int
+    id_date: int
+    id_date_last_seen: int
+    price: float
+    date_key: int
+    last_seen_key: int
+
+class IngestPlan(NamedTuple):
+    changes: List[dict]
+    extensions: List[ValidityExtension]
+
+class LastPriceCache:
+    """Dernier prix connu par couple (produit, point de vente)
+
+    En mode d'ingestion "changes_only", une observation identique au dernier
+    prix connu n'ajoute pas de ligne : selon la stratégie, l'intervalle de
+    validité de la ligne existante est prolongé (id_date_last_seen) ou
+    l'observation est simplement ignorée.
+    """
+
+    def __init__(self, enabled: bool = False, strategy: str = "interval"):
+        self.enabled = enabled
+        self.strategy = strategy
+        self._last: Dict[Tuple[int, int], LastPrice] = {}
+        self._lock = threading.Lock()
+        self.unchanged = 0
+
+    def warm(self, db: Session):
+        """Charge le dernier prix de chaque couple depuis la base"""
+        if not self.enabled:
+            return
+        rows = [row for shard_rows in sharding.router.fan_out(db, self._latest) for row in shard_rows]
+        with self._lock:
+            self._last = {
+                (r.id_product, r.id_sale_point): LastPrice(r.id_date, r.date_key, r.price, r.last_seen_key) for r in rows
+            }
+        logger.info(f"Cache des derniers prix chargé : {len(rows)} couples produit/point de vente")
+
+    def fill(self, db: Session, pairs: Iterable[Tuple[int, int]]):
+        """Charge depuis la base les couples absents du cache (jamais vus ou oubliés après une erreur)"""
+        with self._lock:
+            missing = {pair for pair in pairs if pair not in self._last}
+        if not missing:
+            return
+        rows = self._latest(db, missing)
+        with self._lock:
+            for r in rows:
+                self._last.setdefault(
+                    (r.id_product, r.id_sale_point), LastPrice(r.id_date, r.date_key, r.price, r.last_seen_key)
+                )
+
+    @staticmethod
+    def _latest(db: Session, pairs: Optional[set] = None):
+        from crud import date_key_column
+        latest = (
+            db.query(
+                models.Price.id_product,
+                models.Price.id_sale_point,
+                func.max(date_key_column()).label("date_key")
+            )
+            .join(models.Date, models.Price.id_date == models.Date.id)
+        )
+        if pairs is not None:
+            latest = latest.filter(tuple_(models.Price.id_product, models.Price.id_sale_point).in_(pairs))
+        latest = latest.group_by(models.Price.id_product, models.Price.id_sale_point).subquery()
+        last_seen = aliased(models.Date)
+        return (
+            db.query(
+                models.Price.id_product, models.Price.id_sale_point, models.Price.id_date,
+                latest.c.date_key, models.Price.price, date_key_column(last_seen).label("last_seen_key")
+            )
+            .join(models.Date, models.Price.id_date == models.Date.id)
+            .join(latest, and_(
+                models.Price.id_product == latest.c.id_product,
+                models.Price.id_sale_point == latest.c.id_sale_point,
+                date_key_column() == latest.c.date_key
+            ))
+            .outerjoin(last_seen, models.Price.id_date_last_seen == last_seen.id)
+            .all()
+        )
+
+    def forget(self, pairs: Iterable[Tuple[int, int]]):
+        with self._lock:
+            for pair in pairs:
+                self._last.pop(pair, None)
+
+    def plan(self, prices: Iterable[schemas.PriceCreate], date_keys: Dict[int, int]) -> IngestPlan:
+        """Sépare les vrais changements (à insérer) des observations inchangées
+
+        `date_keys` donne la clé YYYYMMDD de chaque date des observations ;
+        une date inconnue est traitée comme un changement (l'insertion
+        échouera sur la clé étrangère, comme sans déduplication).
+        """
+        changes: List[dict] = []
+        new_rows: Dict[Tuple[int, int, int], dict] = {}
+        extensions: Dict[Tuple[int, int, int], ValidityExtension] = {}
+        with self._lock:
+            for price in sorted(prices, key=lambda p: date_keys.get(p.id_date, 0)):
+                pair = (price.id_product, price.id_sale_point)
+                last = self._last.get(pair)
+                date_key = date_keys.get(price.id_date)
+                if date_key is not None and last is not None and last.price == price.price and date_key > last.date_key:
+                    self.unchanged += 1
+                    if self.strategy == "interval" and (last.last_seen_key or 0) < date_key:
+                        key = (*pair, last.id_date)
+                        if key in new_rows:
+                            # Ligne insérée dans ce même lot : l'intervalle est fixé avant l'insertion
+                            new_rows[key]["id_date_last_seen"] = price.id_date
+                        else:
+                            extensions[key] = ValidityExtension(*key, price.id_date, price.price, last.date_key, date_key)
+                        self._last[pair] = last._replace(last_seen_key=date_key)
+                    # Sinon l'observation est déjà couverte par l'intervalle (nouvel essai)
+                    continue
+                row = {**price.dict(), "id_date_last_seen": None}
+                changes.append(row)
+                new_rows[(*pair, price.id_date)] = row
+                if date_key is not None and (last is None or date_key >= last.date_key):
+                    self._last[pair] = LastPrice(price.id_date, date_key, price.price)
+        return IngestPlan(changes, list(extensions.values()))
+
+cache = LastPriceCache(
+    enabled=settings.price_ingest_mode == "changes_only",
+    strategy=settings.price_dedup_strategy
+)
@@ -0,0 +1,190 @@
+# price_writer.py
+import logging
+import queue
+import threading
+import time
+from typing import List, Optional
+
+from sqlalchemy.exc import IntegrityError
+
+import crud
+import schemas
+from config import settings
+from databases import SessionLocal
+from exceptions import DuplicateEntry, WriteQueueFull, WriterUnavailable
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+class PendingPrice:
+    """Observation de prix en attente d'écriture"""
+    __slots__ = ("price", "done", "error")
+
+    def __init__(self, price: schemas.PriceCreate):
+        self.price = price
+        self.done = threading.Event()
+        self.error: Optional[Exception] = None
+
+class BufferedPriceWriter:
+    """Écriture différée (write-behind) des prix avec commits groupés
+
+    Les observations sont placées dans une file bornée ; un thread de fond la
+    vide par lots de `batch_size` lignes ou toutes les `flush_interval_ms`
+    millisecondes, en un seul commit par lot. Quand la file est pleine,
+    `submit` échoue après `enqueue_timeout_ms` (contre-pression) ; en
+    durabilité 'flush', il échoue aussi si le commit n'est pas confirmé
+    dans les `flush_timeout_ms` (l'écriture peut encore aboutir ensuite).
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        enabled: bool = False,
+        durability: str = "flush",
+        batch_size: int = 500,
+        flush_interval_ms: int = 50,
+        queue_size: int = 10000,
+        enqueue_timeout_ms: int = 100,
+        flush_timeout_ms: int = 5000
+    ):
+        self.enabled = enabled
+        self.durability = durability
+        self._session_factory = session_factory
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval_ms / 1000
+        self._enqueue_timeout = enqueue_timeout_ms / 1000
+        self._flush_timeout = flush_timeout_ms / 1000
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self.flushed_rows = 0
+        self.failed_rows = 0
+
+    def start(self):
+        """Démarre le thread d'écriture en arrière-plan"""
+        if not self.enabled or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="price-writer", daemon=True)
+        self._thread.start()
+        logger.info("Écriture différée des prix démarrée (durabilité : %s)", self.durability)
+
+    def submit(self, price: schemas.PriceCreate) -> PendingPrice:
+        """Place un prix dans la file ; attend le commit si la durabilité est 'flush'"""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            # Sans thread d'écriture (non démarré, arrêté ou mort), rien ne viderait la file
+            raise WriterUnavailable()
+        pending = PendingPrice(price)
+        try:
+            self._queue.put(pending, timeout=self._enqueue_timeout)
+        except queue.Full:
+            raise WriteQueueFull()
+        if self.durability == "flush":
+            if not pending.done.wait(self._flush_timeout):
+                raise WriterUnavailable("Price write not confirmed in time, retry later")
+            if pending.error is not None:
+                raise pending.error
+        return pending
+
+    def close(self, timeout: float = 30.0):
+        """Vide la file puis arrête le thread (à appeler à l'arrêt de l'application)"""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+        logger.info(
+            "Écriture différée arrêtée : %s lignes écrites, %s rejetées",
+            self.flushed_rows, self.failed_rows
+        )
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch: List[PendingPrice] = []
+            item = self._queue.get()
+            deadline = time.monotonic() + self._flush_interval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+                if stopping or len(batch) >= self._batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if stopping:
+                # Vider ce qui reste dans la file avant de s'arrêter
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        batch.append(item)
+            if batch:
+                try:
+                    self._flush(batch)
+                except Exception as e:
+                    # Une erreur inattendue ne doit ni tuer le thread ni laisser d'appelant en attente
+                    logger.exception(f"Échec de l'écriture de {len(batch)} prix")
+                    for pending in batch:
+                        if not pending.done.is_set():
+                            pending.error = pending.error or e
+                            pending.done.set()
+
+    def _flush(self, batch: List[PendingPrice]):
+        db = self._session_factory()
+        try:
+            try:
+                crud.create_prices(db, [p.price for p in batch])
+                self.flushed_rows += len(batch)
+            except IntegrityError:
+                # Un doublon fait échouer tout le lot : on isole les lignes fautives
+                db.rollback()
+                self._flush_one_by_one(db, batch)
+        except Exception as e:
+            # Y compris une erreur de connexion pendant la reprise ligne par ligne
+            db.rollback()
+            failed = [pending for pending in batch if pending.error is None and not pending.done.is_set()]
+            logger.error(f"Échec de l'écriture groupée de {len(failed)} prix : {e}")
+            self.failed_rows += len(failed)
+            for pending in failed:
+                pending.error = e
+        finally:
+            db.close()
+            for pending in batch:
+                pending.done.set()
+
+    def _flush_one_by_one(self, db, batch: List[PendingPrice]):
+        # Même chemin d'écriture que le lot (shard, remplacement, déduplication, alertes),
+        # une transaction par ligne : crud valide lui-même sur le shard du point de vente
+        for pending in batch:
+            price = pending.price
+            try:
+                crud.create_prices(db, [price])
+            except IntegrityError:
+                db.rollback()
+                self.failed_rows += 1
+                pending.error = DuplicateEntry(
+                    "Price", f"{price.id_product}/{price.id_sale_point}/{price.id_date}"
+                )
+                logger.warning(f"Prix ignoré (doublon ou référence invalide) : {price.dict()}")
+                continue
+            self.flushed_rows += 1
+            pending.done.set()
+
+writer = BufferedPriceWriter(
+    enabled=settings.price_write_mode == "write_behind",
+    durability=settings.price_write_durability,
+    batch_size=settings.price_write_batch_size,
+    flush_interval_ms=settings.price_write_flush_interval_ms,
+    queue_size=settings.price_write_queue_size,
+    enqueue_timeout_ms=settings.price_write_enqueue_timeout_ms,
+    flush_timeout_ms=settings.price_write_flush_timeout_ms
+)
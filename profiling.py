@@ -0,0 +1,258 @@
+# profiling.py
+import contextvars
+import hmac
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from typing import Dict, Optional, Set
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# INSTRUMENTATION SQL
+# ============================================================================
+#
+# Tant que le profilage est activé, chaque thread publie la requête SQL qu'il
+# exécute : un échantillon pris pendant cette requête reçoit une feuille
+# supplémentaire "[sql] SELECT ...", visible comme telle dans le flamegraph.
+
+_statements: Dict[int, str] = {}
+# Profil de la requête HTTP en cours (copié dans les threads qui exécutent l'endpoint)
+_current_profile: contextvars.ContextVar = contextvars.ContextVar("current_profile", default=None)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    ident = threading.get_ident()
+    _statements[ident] = statement
+    profile = _current_profile.get()
+    if profile is not None:
+        # Le thread qui interroge la base travaille pour la requête profilée
+        profile.threads.add(ident)
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _statements.pop(threading.get_ident(), None)
+
+def _handle_error(exception_context):
+    _statements.pop(threading.get_ident(), None)
+
+def _sql_label(statement: str) -> str:
+    # Les ';' séparent les frames dans le format collapsed
+    label = re.sub(r"\s+", " ", statement).strip().replace(";", ",")
+    return "[sql] " + (label[:120] + "..." if len(label) > 120 else label)
+
+# ============================================================================
+# ÉCHANTILLONNAGE
+# ============================================================================
+
+# Feuilles de pile d'un thread inactif (attente de travail ou d'événements)
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("connection.py", "wait"),
+}
+
+def _collapse(frame) -> Optional[str]:
+    """Pile d'un thread au format collapsed (racine;...;feuille), None si le thread est inactif"""
+    code = frame.f_code
+    if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+        return None
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+class Sampler:
+    """Échantillonneur statistique : relève les piles Python des threads du worker
+    toutes les `interval_s` secondes depuis un thread dédié
+
+    `threads` limite l'échantillonnage à certains threads (ensemble complété
+    pendant la mesure), None les échantillonne tous sauf `exclude`.
+    """
+
+    def __init__(self, interval_s: float, threads: Optional[Set[int]] = None, exclude: Optional[int] = None):
+        self.interval_s = interval_s
+        self.threads = threads
+        self.exclude = exclude
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.counts
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            self.samples += 1
+            for ident, frame in sys._current_frames().items():
+                if ident in (own, self.exclude) or (self.threads is not None and ident not in self.threads):
+                    continue
+                stack = _collapse(frame)
+                if stack is None:
+                    continue
+                statement = _statements.get(ident)
+                if statement is not None:
+                    stack += ";" + _sql_label(statement)
+                self.counts[stack] += 1
+
+def collapsed(counts: Counter) -> str:
+    """Format collapsed (flamegraph.pl, speedscope, inferno) : une pile et son nombre d'échantillons par ligne"""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+
+# ============================================================================
+# PROFILEUR DU WORKER
+# ============================================================================
+
+class RequestProfile:
+    __slots__ = ("id", "method", "path", "threads", "counts", "samples", "duration_ms")
+
+    def __init__(self, method: str, path: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.threads: Set[int] = set()
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self.duration_ms = 0.0
+
+class Profiler:
+    """Surface de profilage à la demande, authentifiée par jeton
+
+    Désactivé par défaut : ni middleware ni écouteurs SQL ne sont alors
+    installés et le coût est nul. Activé, une requête portant l'en-tête
+    `X-Profile: <jeton>` est échantillonnée pendant son exécution (threads
+    de la boucle et de l'endpoint) ; `profile_worker` échantillonne tous les
+    threads du worker pendant une durée donnée. Les derniers profils de
+    requête sont conservés en mémoire.
+    """
+
+    def __init__(self, enabled: bool = False, token: Optional[str] = None, interval_ms: int = 10, max_seconds: int = 60, keep: int = 50):
+        # Sans jeton, la surface reste fermée
+        if enabled and not token:
+            logger.warning("Profilage activé sans PROFILING_TOKEN : désactivé")
+        self.enabled = enabled and bool(token)
+        self._token = token
+        self.interval_s = interval_ms / 1000
+        self.max_seconds = max_seconds
+        self._keep = keep
+        self._profiles: "OrderedDict[str, RequestProfile]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._worker_busy = threading.Lock()
+        self._installed = False
+
+    def install(self):
+        """Branche l'instrumentation SQL sur tous les moteurs (base principale et shards)"""
+        if not self.enabled or self._installed:
+            return
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Engine, "handle_error", _handle_error)
+        self._installed = True
+
+    def check(self, token) -> bool:
+        if not self.enabled or not token:
+            return False
+        if isinstance(token, bytes):
+            token = token.decode("latin-1")
+        return hmac.compare_digest(token, self._token)
+
+    def profile_worker(self, seconds: float, interval_s: Optional[float] = None) -> Optional[Sampler]:
+        """Échantillonne tous les threads du worker pendant `seconds` secondes (bloquant)
+
+        Une seule mesure à la fois par worker : retourne None si une autre est en cours.
+        """
+        if not self._worker_busy.acquire(blocking=False):
+            return None
+        try:
+            sampler = Sampler(interval_s or self.interval_s, exclude=threading.get_ident())
+            sampler.start()
+            time.sleep(min(seconds, self.max_seconds))
+            sampler.stop()
+            return sampler
+        finally:
+            self._worker_busy.release()
+
+    def remember(self, profile: RequestProfile):
+        with self._lock:
+            self._profiles[profile.id] = profile
+            while len(self._profiles) > self._keep:
+                self._profiles.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[RequestProfile]:
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def recent(self):
+        with self._lock:
+            return [
+                {"id": p.id, "method": p.method, "path": p.path, "samples": p.samples, "duration_ms": round(p.duration_ms, 1)}
+                for p in reversed(self._profiles.values())
+            ]
+
+class ProfilingMiddleware:
+    """Middleware ASGI : échantillonne les requêtes portant `X-Profile: <jeton>`
+
+    L'identifiant du profil est renvoyé dans l'en-tête `X-Profile-Id` ; les
+    piles sont lues ensuite via /debug/profile/requests/{id}.
+    """
+
+    def __init__(self, app, profiler: Profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = dict(scope["headers"]).get(b"x-profile")
+        if token is None or not self.profiler.check(token):
+            return await self.app(scope, receive, send)
+
+        profile = RequestProfile(scope["method"], scope["path"])
+        profile.threads.add(threading.get_ident())  # thread de la boucle d'événements
+        sampler = Sampler(self.profiler.interval_s, profile.threads)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile.id.encode())]
+            await send(message)
+
+        context_token = _current_profile.set(profile)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profile.counts = sampler.stop()
+            profile.samples = sampler.samples
+            profile.duration_ms = (time.perf_counter() - started) * 1000
+            _current_profile.reset(context_token)
+            self.profiler.remember(profile)
+
+profiler = Profiler(
+    enabled=settings.profiling_enabled,
+    token=settings.profiling_token,
+    interval_ms=settings.profiling_interval_ms,
+    max_seconds=settings.profiling_max_seconds,
+    keep=settings.profiling_keep
+)
@@ -1,10 +1,29 @@
 # test_main.py
+import os
+
 import pytest
+from alembic import command
+from alembic.config import Config
 from fastapi.testclient import TestClient
+
+import databases
 from main import app
 
 client = TestClient(app)
 
+@pytest.fixture(scope="module", autouse=True)
+def database(tmp_path_factory):
+    """Base SQLite temporaire, migrée jusqu'à la dernière révision (alembic upgrade head)"""
+    previous_url = databases.SQLALCHEMY_DATABASE_URL
+    databases.configure(f"sqlite:///{tmp_path_factory.mktemp('db') / 'test.db'}")
+    root = os.path.dirname(os.path.abspath(__file__))
+    alembic_config = Config(os.path.join(root, "alembic.ini"))
+    alembic_config.set_main_option("script_location", os.path.join(root, "alembic"))
+    alembic_config.attributes["configure_logger"] = False
+    command.upgrade(alembic_config, "head")
+    yield
+    databases.configure(previous_url)
+
 def test_health_check():
     """Test du point de contrôle de santé"""
     response = client.get("/health")
@@ -71,6 +90,170 @@ def test_stats_endpoints():
     response = client.get("/stats/prices")
     assert response.status_code == 200
 
+def test_price_volatility():
+    """Test des statistiques de volatilité par ville"""
+    response = client.get("/stats/price-volatility", params={"group_by": "city", "days": 90})
+    assert response.status_code == 200
+    for row in response.json():
+        assert row["p10_price"] <= row["median_price"] <= row["p90_price"]
+
+def test_price_history_max_points():
+    """Test du sous-échantillonnage de l'historique des prix"""
+    response = client.get("/products/1/prices", params={"max_points": 10})
+    assert response.status_code == 200
+    assert len(response.json()) <= 10
+
+def test_products_batch_get():
+    """Test de la récupération groupée de produits"""
+    response = client.post("/products/batch-get", json={"ids": [1, 2, 3]})
+    assert response.status_code == 200
+    assert len(response.json()) <= 3
+
+def test_price_comparisons_batch_date():
+    """Test de la validation de la date de la comparaison groupée"""
+    response = client.post("/prices/comparison/batch", json={"product_ids": [1], "specific_date": "bad"})
+    assert response.status_code == 422
+    response = client.post("/prices/comparison/batch", json={"product_ids": [1], "specific_date": "1900-01-01"})
+    assert response.status_code == 200
+
+def test_create_alert():
+    """Test de création d'une alerte de baisse de prix"""
+    response = client.post("/alerts/", json={"id_product": 1, "threshold": 10.5, "city": "Paris"})
+    assert response.status_code in (201, 404)
+    response = client.get("/alerts/outbox")
+    assert response.status_code == 200
+
+def test_job_lifecycle():
+    """Test de soumission et de suivi d'un travail d'arrière-plan"""
+    response = client.post("/jobs", json={"kind": "price_trends", "params": {"days": 30}})
+    assert response.status_code == 202
+    job_id = response.json()["id"]
+    response = client.get(f"/jobs/{job_id}")
+    assert response.status_code == 200
+    assert response.json()["kind"] == "price_trends"
+    assert client.get("/jobs/unknown").status_code == 404
+
+def test_offload_stats():
+    """Test des statistiques du pool de post-traitement"""
+    response = client.get("/health/offload")
+    assert response.status_code == 200
+    assert "tasks" in response.json()
+
+def test_prices_total_count():
+    """Test du nombre total de prix renvoyé en en-tête"""
+    response = client.get("/prices/", params={"limit": 5})
+    assert response.status_code == 200
+    assert len(response.json()) <= 5
+    assert int(response.headers["X-Total-Count"]) >= len(response.json())
+
+def test_dimension_cache_stats():
+    """Test de l'état du cache des dimensions"""
+    response = client.get("/health/dimensions")
+    assert response.status_code == 200
+    assert set(response.json()["rows"]) == {"products", "sale_points", "dates"}
+
+def test_idempotency_key_replay():
+    """Test du rejeu d'une écriture réessayée avec la même clé d'idempotence"""
+    headers = {"Idempotency-Key": "test-product-idempotent"}
+    first = client.post("/products/", json={"title": "Idempotent Product"}, headers=headers)
+    retry = client.post("/products/", json={"title": "Idempotent Product"}, headers=headers)
+    assert retry.status_code == first.status_code
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    response = client.post("/products/", json={"title": "Other Product"}, headers=headers)
+    assert response.status_code == 422
+    # Même clé choisie par un autre client : ni rejeu ni conflit
+    other = client.post("/products/", json={"title": "Idempotent Product"}, headers={**headers, "X-API-Key": "other-client"})
+    assert other.status_code == first.status_code
+    assert other.json()["id"] != first.json()["id"]
+    assert "Idempotent-Replayed" not in other.headers
+
+def test_profiling_disabled_by_default():
+    """Test de l'absence de la surface de profilage sans configuration"""
+    response = client.get("/debug/profile?seconds=1", headers={"X-Profile-Token": "anything"})
+    assert response.status_code == 404
+    response = client.get("/health", headers={"X-Profile": "anything"})
+    assert "X-Profile-Id" not in response.headers
+
+def test_tracing_stats():
+    """Test de l'état de l'export des traces"""
+    response = client.get("/health/tracing")
+    assert response.status_code == 200
+    assert {"enabled", "sample_ratio", "exported", "dropped"} <= set(response.json())
+
+def test_admission_stats():
+    """Test de l'état du contrôle d'admission"""
+    response = client.get("/health/admission")
+    assert response.status_code == 200
+    assert set(response.json()["classes"]) == {"read", "write", "analytics"}
+
+def test_query_budget_stats():
+    """Test des budgets et dépassements des requêtes SQL"""
+    response = client.get("/health/queries")
+    assert response.status_code == 200
+    assert response.json()["routes_ms"]["/stats/price-trends"] > 0
+
+def test_sparse_fields_and_compression():
+    """Test des champs demandés (fields=) et de la compression négociée"""
+    response = client.get("/prices/", params={"limit": 50, "fields": "price,id_date"}, headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    for row in response.json():
+        assert set(row) == {"price", "id_date"}
+    assert client.get("/prices/", params={"fields": "unknown"}).status_code == 400
+
+def test_price_comparison_unknown_date():
+    """Test de la comparaison de prix à une date absente du calendrier"""
+    response = client.get("/products/1/price-comparison", params={"specific_date": "1900-01-01"})
+    assert response.status_code == 200
+    assert response.json() == []
+
+def test_basket_compare():
+    """Test de la comparaison d'un panier entre points de vente"""
+    response = client.post("/baskets/compare", json={"items": [{"product_id": 1, "quantity": 2}], "split": True, "limit": 3})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["items"] == 1
+    assert len(data["results"]) <= 3
+    for result in data["results"]:
+        assert 0 <= result["coverage"] <= 1
+
+def test_prices_as_of():
+    """Test des instantanés de prix à une date (as-of)"""
+    response = client.get("/products/1/prices/as-of", params=[("date", "2024-01-31"), ("date", "2024-02-29")])
+    assert response.status_code == 200
+    assert [snapshot["date"] for snapshot in response.json()] == ["2024-01-31", "2024-02-29"]
+    assert client.get("/products/1/prices/as-of").status_code == 400
+
+def test_unchanged_price_retry(monkeypatch):
+    """Test d'une observation inchangée renvoyée deux fois (ingestion par changements)"""
+    import price_dedup
+    monkeypatch.setattr(price_dedup.cache, "enabled", True)
+    monkeypatch.setattr(price_dedup.cache, "strategy", "interval")
+    product_id = client.post("/products/", json={"title": "Prix inchangé"}).json()["id"]
+    sale_point_id = client.post("/sale-points/", json={"name": "Prix inchangé", "city": "Test City", "type": "online"}).json()["id"]
+    first = client.post("/dates/from-iso/", params={"date_iso": "2032-03-01"}).json()["id"]
+    second = client.post("/dates/from-iso/", params={"date_iso": "2032-03-02"}).json()["id"]
+    for date_id in (first, second, second):
+        response = client.post("/prices/", json={"id_product": product_id, "id_sale_point": sale_point_id, "id_date": date_id, "price": 4.2})
+        assert response.status_code == 201
+    response = client.get("/prices/", params={"product_id": product_id, "sale_point_id": sale_point_id})
+    assert response.headers["X-Total-Count"] == "1"
+    assert response.json()[0]["id_date"] == first
+
+def test_prices_as_of_backfilled_date():
+    """Test des instantanés quand une date antérieure est ajoutée après coup (identifiant plus grand)"""
+    later = client.post("/dates/from-iso/", params={"date_iso": "2031-01-10"}).json()["id"]
+    backfilled = client.post("/dates/from-iso/", params={"date_iso": "2031-01-05"}).json()["id"]
+    assert backfilled > later
+    product_id = client.post("/products/", json={"title": "Prix à une date rétroactive"}).json()["id"]
+    sale_point_id = client.post("/sale-points/", json={"name": "Date rétroactive", "city": "Test City", "type": "online"}).json()["id"]
+    for date_id, price in ((later, 2.0), (backfilled, 1.0)):
+        client.post("/prices/", json={"id_product": product_id, "id_sale_point": sale_point_id, "id_date": date_id, "price": price})
+    response = client.get(f"/products/{product_id}/prices/as-of", params=[("date", "2031-01-07"), ("date", "2031-01-12")])
+    assert response.status_code == 200
+    assert [[p["price"] for p in snapshot["prices"]] for snapshot in response.json()] == [[1.0], [2.0]]
+    assert response.json()[0]["prices"][0]["observed_on"] == "2031-01-05"
+
 # Pour lancer les tests : pytest test_main.py
 
 
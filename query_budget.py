@@ -0,0 +1,239 @@
+# query_budget.py
+import asyncio
+import contextvars
+import threading
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+
+from config import settings
+from exceptions import QueryTimeout
+
+# Budget de la requête HTTP en cours (copié dans les threads qui exécutent l'endpoint)
+_current_budget: contextvars.ContextVar = contextvars.ContextVar("query_budget", default=None)
+
+# SQLSTATE PostgreSQL d'une requête annulée (statement_timeout ou pg_cancel_backend)
+QUERY_CANCELED = "57014"
+# Instructions de la machine virtuelle SQLite entre deux vérifications de l'échéance
+SQLITE_PROGRESS_STEPS = 1000
+
+class QueryBudget:
+    """Temps accordé aux requêtes SQL d'une requête HTTP
+
+    Le budget est celui de la route (gabarit FastAPI, ex. "/stats/price-trends"),
+    résolu à la première requête SQL après le routage, et court depuis
+    l'entrée de la requête HTTP. Sous PostgreSQL il devient le
+    `statement_timeout` de la transaction, sous SQLite un gestionnaire de
+    progression interrompt la requête ; dans tous les cas une requête n'est
+    plus lancée une fois le budget épuisé. Les requêtes SQL exécutées avant
+    le routage (réservation d'une clé d'idempotence) ne sont limitées que
+    par l'annulation.
+    """
+
+    __slots__ = ("scope", "started", "route", "budget_ms", "deadline", "cancelled", "responded", "connections", "reported", "_lock")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.started = time.monotonic()
+        self.route = None
+        self.budget_ms = None
+        self.deadline = None
+        self.cancelled = False
+        self.responded = False  # réponse envoyée : le travail restant (idempotence, tâches de fond) n'est plus limité
+        self.connections = set()
+        self.reported = False
+        self._lock = threading.Lock()
+
+    def resolve(self, budgets: "QueryBudgets"):
+        if self.route is not None:
+            return
+        route = self.scope.get("route")
+        if route is None:
+            # Pas encore routée : le chemin brut (/products/5) ne doit pas fixer le budget
+            return
+        self.route = getattr(route, "path", None) or self.scope["path"]
+        self.budget_ms = budgets.budget_for(self.route)
+        if self.budget_ms:
+            self.deadline = self.started + self.budget_ms / 1000
+
+    def remaining_ms(self) -> Optional[int]:
+        if self.deadline is None:
+            return None
+        return int((self.deadline - time.monotonic()) * 1000)
+
+    def exhausted(self) -> bool:
+        return self.cancelled or (self.deadline is not None and time.monotonic() >= self.deadline)
+
+    def progress(self) -> int:
+        # Gestionnaire de progression SQLite : une valeur non nulle interrompt la requête
+        return 1 if self.exhausted() else 0
+
+    def cancel(self):
+        """Client déconnecté : annule les requêtes en cours et refuse les suivantes"""
+        self.cancelled = True
+        with self._lock:
+            connections = list(self.connections)
+        for dbapi_connection in connections:
+            try:
+                if hasattr(dbapi_connection, "interrupt"):
+                    dbapi_connection.interrupt()  # sqlite3
+                else:
+                    dbapi_connection.cancel()  # psycopg
+            except Exception:
+                pass
+
+class QueryBudgets:
+    """Budgets par route et compteurs de dépassements et d'annulations par route"""
+
+    def __init__(self, default_ms: int, routes_ms: Dict[str, int], cancel_on_disconnect: bool = True):
+        self.default_ms = default_ms
+        self.routes_ms = routes_ms
+        self.cancel_on_disconnect = cancel_on_disconnect
+        self.timeouts: Dict[str, int] = {}
+        self.cancellations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._installed = False
+
+    def budget_for(self, route: str) -> int:
+        return self.routes_ms.get(route, self.default_ms)
+
+    def error(self, budget: QueryBudget) -> QueryTimeout:
+        """Erreur 504 du budget épuisé, comptée une seule fois par requête HTTP"""
+        route = budget.route or budget.scope["path"]
+        with self._lock:
+            if not budget.reported:
+                budget.reported = True
+                counters = self.cancellations if budget.cancelled else self.timeouts
+                counters[route] = counters.get(route, 0) + 1
+        return QueryTimeout(budget.budget_ms, route, cancelled=budget.cancelled)
+
+    def install(self):
+        """Branche l'application des budgets sur tous les moteurs (base principale et shards)"""
+        if self._installed:
+            return
+        event.listen(Engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", self._after_cursor_execute)
+        event.listen(Engine, "handle_error", self._handle_error)
+        event.listen(Engine, "commit", _end_transaction)
+        event.listen(Engine, "rollback", _end_transaction)
+        event.listen(Pool, "checkin", _checkin)
+        self._installed = True
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        budget = _current_budget.get()
+        if budget is None or budget.responded:
+            return
+        budget.resolve(self)
+        if budget.exhausted():
+            raise self.error(budget)
+        remaining = budget.remaining_ms()
+        dbapi_connection = conn.connection.dbapi_connection
+        if remaining is not None and conn.info.get("query_budget") is not budget:
+            # Une fois par transaction : SET LOCAL expire au commit ou au rollback
+            if conn.dialect.name == "postgresql":
+                cursor.execute(f"SET LOCAL statement_timeout = {max(remaining, 1)}")
+            elif conn.dialect.name == "sqlite":
+                dbapi_connection.set_progress_handler(budget.progress, SQLITE_PROGRESS_STEPS)
+                conn.info["sqlite_progress_handler"] = True
+            conn.info["query_budget"] = budget
+        with budget._lock:
+            budget.connections.add(dbapi_connection)
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        budget = _current_budget.get()
+        if budget is not None:
+            with budget._lock:
+                budget.connections.discard(conn.connection.dbapi_connection)
+
+    def _handle_error(self, exception_context):
+        budget = _current_budget.get()
+        if budget is None:
+            return None
+        if exception_context.connection is not None:
+            with budget._lock:
+                budget.connections.discard(exception_context.connection.connection.dbapi_connection)
+        if _is_cancellation(exception_context.original_exception) and (budget.cancelled or budget.deadline is not None):
+            return self.error(budget)
+        return None
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "default_ms": self.default_ms,
+                "routes_ms": dict(self.routes_ms),
+                "timeouts": dict(self.timeouts),
+                "cancellations": dict(self.cancellations),
+            }
+
+def _is_cancellation(exception) -> bool:
+    code = getattr(exception, "pgcode", None) or getattr(exception, "sqlstate", None)
+    if code == QUERY_CANCELED:
+        return True
+    return type(exception).__module__.startswith("sqlite3") and "interrupted" in str(exception)
+
+def _end_transaction(conn):
+    conn.info.pop("query_budget", None)
+
+def _checkin(dbapi_connection, connection_record):
+    # Connexion rendue au pool : le gestionnaire SQLite ne doit pas survivre à la requête
+    if connection_record is None:
+        return
+    connection_record.info.pop("query_budget", None)
+    if connection_record.info.pop("sqlite_progress_handler", None):
+        dbapi_connection.set_progress_handler(None, 0)
+
+class QueryBudgetMiddleware:
+    """Middleware ASGI : budget SQL de chaque requête HTTP et annulation si le client se déconnecte
+
+    Les messages du client sont lus par une tâche dédiée et transmis à
+    l'application ; un `http.disconnect` avant la fin de la réponse annule
+    les requêtes SQL en cours. Une fois la réponse envoyée, le budget ne
+    s'applique plus.
+    """
+
+    def __init__(self, app, budgets: QueryBudgets):
+        self.app = app
+        self.budgets = budgets
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        budget = QueryBudget(scope)
+
+        async def send_and_track(message):
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                budget.responded = True
+
+        token = _current_budget.set(budget)
+        try:
+            if not self.budgets.cancel_on_disconnect:
+                return await self.app(scope, receive, send_and_track)
+
+            messages: asyncio.Queue = asyncio.Queue()
+
+            async def watch():
+                while True:
+                    message = await receive()
+                    await messages.put(message)
+                    if message["type"] == "http.disconnect":
+                        if not budget.responded:
+                            budget.cancel()
+                        return
+
+            watcher = asyncio.create_task(watch())
+            try:
+                await self.app(scope, messages.get, send_and_track)
+            finally:
+                watcher.cancel()
+        finally:
+            _current_budget.reset(token)
+
+budgets = QueryBudgets(
+    default_ms=settings.query_timeout_ms,
+    routes_ms=settings.query_timeouts_ms,
+    cancel_on_disconnect=settings.query_cancel_on_disconnect
+)
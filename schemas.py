@@ -94,6 +94,36 @@ class ProductSalePointCreate(ProductSalePointBase):
     pass
 
 class ProductSalePoint(ProductSalePointBase):
+    class Config:
+       model_config = ConfigDict(from_attributes=True)
+class PriceAlertBase(BaseModel):
+    id_product: int = Field(..., description="ID du produit surveillé")
+    threshold: float = Field(..., gt=0, description="Seuil : alerte si le prix passe en dessous")
+    city: Optional[str] = Field(None, max_length=100, description="Limiter aux points de vente de cette ville")
+    id_sale_point: Optional[int] = Field(None, description="Limiter à ce point de vente")
+    contact: Optional[str] = Field(None, description="Destinataire de la notification (e-mail, webhook)")
+
+class PriceAlertCreate(PriceAlertBase):
+    pass
+
+class PriceAlert(PriceAlertBase):
+    id: int
+    active: bool
+    created_at: datetime
+
+    class Config:
+       model_config = ConfigDict(from_attributes=True)
+
+class AlertNotification(BaseModel):
+    id: int
+    id_alert: int
+    id_product: int
+    id_sale_point: int
+    id_date: int
+    price: float
+    created_at: datetime
+    delivered_at: Optional[datetime] = None
+
     class Config:
        model_config = ConfigDict(from_attributes=True)
 # ============================================================================
@@ -116,6 +146,28 @@ class PriceComparison(BaseModel):
     class Config:
            model_config = ConfigDict(from_attributes=True)
 		   
+class ProductPriceComparison(BaseModel):
+    product_id: int
+    prices: List[PriceComparison]
+
+class ProductBatchRequest(BaseModel):
+    ids: List[int] = Field(..., min_length=1, max_length=500, description="IDs des produits")
+
+class PriceComparisonBatchRequest(BaseModel):
+    product_ids: List[int] = Field(..., min_length=1, max_length=500, description="IDs des produits")
+    specific_date: Optional[date] = Field(None, description="Date spécifique (YYYY-MM-DD)")
+
+class PriceAsOf(BaseModel):
+    sale_point_id: int
+    sale_point_name: Optional[str] = None
+    price: float
+    date_id: int
+    observed_on: Optional[str] = None
+
+class PriceSnapshot(BaseModel):
+    date: str
+    prices: List[PriceAsOf]
+
 class SalePointSimple(BaseModel):
     id: int
     name: str		   
@@ -124,6 +176,17 @@ class PriceHistoryEntry(BaseModel):
     price: float
     sale_point: SalePointSimple
 
+class PriceHistoryBucket(BaseModel):
+    bucket: str
+    bucket_start: str
+    first_price: float
+    last_price: float
+    min_price: float
+    max_price: float
+    avg_price: float
+    price_count: int
+    sale_point_count: int
+
 
 		   
 
@@ -177,6 +240,86 @@ class PriceTrend(BaseModel):
     max_price: float
     min_price: float
 
+class PriceVolatility(BaseModel):
+    id_product: int
+    title: str
+    sale_point_id: Optional[int] = None
+    group: Optional[str] = None
+    price_count: int
+    avg_price: float
+    min_price: float
+    max_price: float
+    median_price: float
+    p10_price: float
+    p90_price: float
+    stddev_price: Optional[float] = None
+    coefficient_of_variation: Optional[float] = None
+    avg_daily_change_pct: Optional[float] = None
+
+# ============================================================================
+# MODÈLES POUR LES TRAVAUX D'ARRIÈRE-PLAN
+# ============================================================================
+
+class JobCreate(BaseModel):
+    kind: "JobKind" = Field(..., description="Type de travail")
+    params: Dict[str, Any] = Field(default_factory=dict, description="Paramètres transmis à l'analyse")
+
+class Job(BaseModel):
+    id: str
+    kind: str
+    params: Dict[str, Any]
+    status: str
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+
+# ============================================================================
+# MODÈLES POUR LES PANIERS
+# ============================================================================
+
+class BasketItem(BaseModel):
+    product_id: int
+    quantity: float = Field(1, gt=0, description="Quantité achetée")
+
+class BasketCompareRequest(BaseModel):
+    items: List[BasketItem] = Field(..., min_length=1, max_length=500, description="Liste de courses")
+    group_by: "BasketGroupBy" = Field("sale_point", validate_default=True, description="Comparer les points de vente ou les villes")
+    city: Optional[str] = Field(None, description="Limiter aux points de vente d'une ville")
+    min_coverage: float = Field(0.0, ge=0, le=1, description="Part minimale des articles trouvés")
+    split: bool = Field(False, description="Chercher aussi les répartitions entre deux points de vente")
+    limit: int = Field(10, ge=1, le=100, description="Nombre de résultats")
+
+class BasketTotal(BaseModel):
+    sale_point_id: Optional[int] = None
+    sale_point_name: Optional[str] = None
+    city: Optional[str] = None
+    total: float
+    items_found: int
+    coverage: float
+    missing_product_ids: List[int]
+
+class BasketSplitPart(BaseModel):
+    sale_point_id: int
+    sale_point_name: Optional[str] = None
+    product_ids: List[int]
+    subtotal: float
+
+class BasketSplit(BaseModel):
+    sale_points: List[BasketSplitPart]
+    total: float
+    items_found: int
+    coverage: float
+    missing_product_ids: List[int]
+
+class BasketComparison(BaseModel):
+    items: int
+    group_by: str
+    results: List[BasketTotal]
+    splits: Optional[List[BasketSplit]] = None
+    split_exhaustive: Optional[bool] = None
+    elapsed_ms: float
+
 # ============================================================================
 # MODÈLES POUR LES RÉPONSES PAGINÉES
 # ============================================================================
@@ -229,6 +372,26 @@ class SalePointType(str, Enum):
     online = "online"
     other = "other"
 
+class HistoryBucket(str, Enum):
+    day = "day"
+    week = "week"
+    month = "month"
+
+class PriceGroupBy(str, Enum):
+    sale_point = "sale_point"
+    city = "city"
+    type = "type"
+
+class BasketGroupBy(str, Enum):
+    sale_point = "sale_point"
+    city = "city"
+
+class JobKind(str, Enum):
+    price_trends = "price_trends"
+    price_volatility = "price_volatility"
+    price_history = "price_history"
+    export_prices = "export_prices"
+
 # ============================================================================
 # VALIDATEURS PERSONNALISÉS
 # ============================================================================
@@ -251,4 +414,6 @@ Price.model_rebuild()
 Product.model_rebuild()
 SalePoint.model_rebuild()
 Date.model_rebuild()
-ProductSalePoint.model_rebuild()
\ No newline at end of file
+ProductSalePoint.model_rebuild()
+JobCreate.model_rebuild()
+BasketCompareRequest.model_rebuild()
\ No newline at end of file
@@ -0,0 +1,33 @@
+# serve.py
+"""Point d'entrée de production : gunicorn et workers uvicorn configurés par config.Settings
+
+    python serve.py [options gunicorn supplémentaires]
+"""
+import os
+import sys
+
+from uvicorn.workers import UvicornWorker
+
+from config import settings
+
+class Worker(UvicornWorker):
+    """Worker uvicorn : boucle et parseur HTTP choisis par la configuration, drainage à l'arrêt"""
+
+    CONFIG_KWARGS = {
+        "loop": settings.serve_loop,
+        "http": settings.serve_http,
+        "lifespan": "on",
+        "limit_concurrency": settings.serve_limit_concurrency,
+        # Les requêtes en cours sont drainées, puis le lifespan (vidage de la file d'écriture)
+        # dispose d'au moins 5 s avant que gunicorn n'abatte le worker
+        "timeout_graceful_shutdown": max(settings.serve_graceful_timeout_seconds - 5, 1),
+    }
+
+def main():
+    from gunicorn.app.wsgiapp import WSGIApplication
+    config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gunicorn_conf.py")
+    sys.argv = [sys.argv[0], "-c", config_path, *sys.argv[1:], "main:app"]
+    WSGIApplication("%(prog)s [OPTIONS]").run()
+
+if __name__ == "__main__":
+    main()
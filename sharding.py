@@ -0,0 +1,222 @@
+# sharding.py
+import contextvars
+import logging
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+import databases
+import dimension_cache
+import exceptions
+import models
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Tables de dimensions recopiées à l'identique sur chaque shard
+DIMENSION_MODELS = (models.Product, models.SalePoint, models.Date)
+
+class ShardRouter:
+    """Répartit la table `prices` sur plusieurs bases (shards)
+
+    La base principale reste la référence pour les dimensions (produits,
+    points de vente, dates) et les autres tables ; ces dimensions sont
+    recopiées sur chaque shard pour que les jointures y restent locales.
+    Un prix est stocké sur le shard de son point de vente, déterminé par
+    l'identifiant du point de vente (`shard_key="sale_point"`) ou par sa ville
+    (`shard_key="city"`, via `city_map` puis hachage pour les villes non
+    listées). En mode ville, le shard est fixé à la création du point de
+    vente (table `sale_point_shards`) : changer sa ville ne déplace pas ses
+    prix et ne change pas leur routage.
+
+    Sans shard configuré, toutes les opérations s'appliquent à la session
+    principale et le comportement est inchangé.
+    """
+
+    def __init__(self, shard_urls: Dict[str, str], shard_key: str = "sale_point", city_map: Optional[Dict[str, str]] = None):
+        self.names = sorted(shard_urls)
+        self.shard_key = shard_key
+        self.city_map = city_map or {}
+        self._engines = {}
+        self._sessions = {}
+        self._assigned: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        for name in self.names:
+            url = shard_urls[name]
+            engine = create_engine(url, connect_args=databases.connect_args(url))
+            self._engines[name] = engine
+            self._sessions[name] = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        unknown = set(self.city_map.values()) - set(self.names)
+        if unknown:
+            raise ValueError(f"Unknown shards in city map: {sorted(unknown)}")
+        self._executor = ThreadPoolExecutor(max_workers=len(self.names), thread_name_prefix="shard") if self.names else None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.names)
+
+    def after_fork(self):
+        """Dans un worker forké : abandonne les connexions héritées du parent et recrée le pool de threads"""
+        for engine in self._engines.values():
+            engine.dispose(close=False)
+        if self._executor is not None:
+            self._executor = ThreadPoolExecutor(max_workers=len(self.names), thread_name_prefix="shard")
+
+    def create_all(self):
+        for engine in self._engines.values():
+            models.Base.metadata.create_all(bind=engine)
+
+    # ------------------------------------------------------------------
+    # Routage
+    # ------------------------------------------------------------------
+
+    def _hash(self, key: str) -> str:
+        return self.names[zlib.crc32(key.encode("utf-8")) % len(self.names)]
+
+    def _city_shard(self, city: Optional[str]) -> str:
+        return self.city_map.get(city or "") or self._hash(city or "")
+
+    def shard_of(self, db: Session, sale_point_id: int) -> Optional[str]:
+        """Shard contenant les prix d'un point de vente (None sans sharding)"""
+        if not self.enabled:
+            return None
+        if self.shard_key != "city":
+            return self._hash(str(sale_point_id))
+        shard = self._assigned.get(sale_point_id)
+        if shard is not None:
+            return shard
+        assignment = db.get(models.SalePointShard, sale_point_id)
+        if assignment is None:
+            sale_point = dimension_cache.cache.sale_point(db, sale_point_id)
+            if sale_point is None:
+                raise exceptions.SalePointNotFound(str(sale_point_id))
+            # Point de vente créé avant la table d'affectation : sa ville actuelle, figée à sa prochaine modification
+            return self._city_shard(sale_point.city)
+        with self._lock:
+            self._assigned[sale_point_id] = assignment.shard
+        return assignment.shard
+
+    def assign(self, db: Session, sale_point: models.SalePoint):
+        """Fixe le shard d'un point de vente d'après sa ville actuelle (sans commit)
+
+        Appelée à la création, et avant toute modification pour les points de
+        vente qui n'ont pas encore d'affectation.
+        """
+        if not self.enabled or self.shard_key != "city":
+            return
+        if db.get(models.SalePointShard, sale_point.id) is None:
+            db.add(models.SalePointShard(id_sale_point=sale_point.id, shard=self._city_shard(sale_point.city)))
+
+    def unassign(self, sale_point_id: int):
+        """Oublie l'affectation mémorisée d'un point de vente supprimé"""
+        with self._lock:
+            self._assigned.pop(sale_point_id, None)
+
+    def assign_all(self, db: Session):
+        """Fixe le shard de tous les points de vente qui n'en ont pas encore"""
+        if not self.enabled or self.shard_key != "city":
+            return
+        assigned = {row.id_sale_point for row in db.query(models.SalePointShard.id_sale_point)}
+        missing = [sp for sp in db.query(models.SalePoint) if sp.id not in assigned]
+        for sale_point in missing:
+            self.assign(db, sale_point)
+        db.commit()
+        logger.info(f"{len(missing)} points de vente affectés à un shard")
+
+    def partition(self, db: Session, prices: Iterable) -> Dict[Optional[str], list]:
+        """Regroupe des prix par shard de destination"""
+        groups: Dict[Optional[str], list] = {}
+        for price in prices:
+            groups.setdefault(self.shard_of(db, price.id_sale_point), []).append(price)
+        return groups
+
+    @contextmanager
+    def session(self, db: Session, shard: Optional[str]):
+        """Session du shard, ou la session principale si shard est None"""
+        if shard is None:
+            yield db
+            return
+        shard_db = self._sessions[shard]()
+        try:
+            yield shard_db
+        finally:
+            shard_db.close()
+
+    # ------------------------------------------------------------------
+    # Lectures réparties
+    # ------------------------------------------------------------------
+
+    def fan_out(self, db: Session, fn: Callable[[Session], Any]) -> List[Any]:
+        """Exécute fn sur chaque shard en parallèle et retourne la liste des résultats"""
+        if not self.enabled:
+            return [fn(db)]
+
+        def run(name: str):
+            with self.session(db, name) as shard_db:
+                return fn(shard_db)
+
+        # Chaque shard s'exécute dans une copie du contexte de l'appelant (profilage de la requête)
+        contexts = [contextvars.copy_context() for _ in self.names]
+        return list(self._executor.map(lambda context, name: context.run(run, name), contexts, self.names))
+
+    # ------------------------------------------------------------------
+    # Réplication des dimensions
+    # ------------------------------------------------------------------
+
+    def _replicate(self, fn: Callable[[Session], None]):
+        for name in self.names:
+            with self.session(None, name) as shard_db:
+                try:
+                    fn(shard_db)
+                    shard_db.commit()
+                except Exception:
+                    shard_db.rollback()
+                    logger.exception(f"Réplication vers le shard {name} échouée")
+                    raise
+
+    def replicate_upsert(self, instance):
+        """Recopie une ligne de dimension (création ou modification) sur chaque shard"""
+        if not self.enabled:
+            return
+        values = {c.key: getattr(instance, c.key) for c in instance.__table__.columns}
+        self._replicate(lambda shard_db: shard_db.merge(type(instance)(**values)))
+
+    def replicate_delete(self, model, instance_id: int):
+        """Supprime une ligne de dimension sur chaque shard"""
+        if not self.enabled:
+            return
+
+        def delete(shard_db: Session):
+            instance = shard_db.get(model, instance_id)
+            if instance is not None:
+                shard_db.delete(instance)
+
+        self._replicate(delete)
+
+    def sync_dimensions(self, db: Session):
+        """Recopie toutes les dimensions de la base principale (ajout d'un shard)"""
+        for model in DIMENSION_MODELS:
+            rows = [
+                {c.key: getattr(r, c.key) for c in model.__table__.columns}
+                for r in db.query(model).all()
+            ]
+            self._replicate(lambda shard_db: [shard_db.merge(model(**row)) for row in rows])
+            logger.info(f"{len(rows)} lignes de {model.__tablename__} recopiées sur {len(self.names)} shards")
+
+router = ShardRouter(settings.shard_urls, settings.shard_key, settings.shard_city_map)
+
+if __name__ == "__main__":
+    # Initialise les shards : python sharding.py
+    from databases import SessionLocal
+    router.create_all()
+    db = SessionLocal()
+    try:
+        router.sync_dimensions(db)
+        router.assign_all(db)
+    finally:
+        db.close()
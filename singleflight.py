@@ -0,0 +1,143 @@
+# singleflight.py
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import tracing
+from config import settings
+from exceptions import QueryTimeout
+
+logger = logging.getLogger(__name__)
+
+class _Call:
+    """Exécution en cours partagée entre plusieurs appelants"""
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Regroupe les appels concurrents identiques sur une seule exécution
+
+    Dans un même processus, les appels portant la même clé attendent le
+    résultat de l'appel déjà en cours au lieu de relancer la requête. Si une
+    URL Redis est configurée, un verrou partagé étend ce comportement aux
+    autres workers : le détenteur du verrou publie son résultat (JSON) pendant
+    `result_ttl_ms`, les autres workers le relisent au lieu d'interroger la base.
+
+    Si l'exécution partagée est annulée parce que le client de l'appelant qui
+    la porte s'est déconnecté, les autres appelants la relancent (l'un d'eux
+    la porte à son tour) au lieu de recevoir cette annulation.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        redis_url: Optional[str] = None,
+        lock_timeout_ms: int = 5000,
+        result_ttl_ms: int = 500
+    ):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._redis = None
+        self._lock_timeout_ms = lock_timeout_ms
+        self._result_ttl_ms = result_ttl_ms
+        self.executions = 0
+        self.shared = 0
+        if enabled and redis_url:
+            import redis  # dépendance optionnelle
+            self._redis = redis.Redis.from_url(redis_url)
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Exécute fn une seule fois pour tous les appels concurrents de même clé"""
+        if not self.enabled:
+            return fn()
+
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                else:
+                    self.shared += 1
+                    tracing.count("singleflight.shared")
+
+            if leader:
+                break
+            call.event.wait()
+            if isinstance(call.error, QueryTimeout) and call.error.cancelled:
+                # Annulation propre au client du meneur : relancer l'exécution
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._execute(key, fn)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+        return call.result
+
+    def _execute(self, key: str, fn: Callable[[], Any]) -> Any:
+        if self._redis is None:
+            self.executions += 1
+            return fn()
+
+        lock_key = f"singleflight:lock:{key}"
+        result_key = f"singleflight:result:{key}"
+        try:
+            acquired = self._redis.set(lock_key, 1, nx=True, px=self._lock_timeout_ms)
+        except Exception as e:
+            logger.warning(f"Verrou single-flight indisponible, exécution locale : {e}")
+            self.executions += 1
+            return fn()
+
+        if acquired:
+            try:
+                self.executions += 1
+                result = fn()
+                self._redis.set(result_key, json.dumps(result), px=self._result_ttl_ms)
+                return result
+            finally:
+                self._redis.delete(lock_key)
+
+        # Un autre worker exécute déjà la requête : attendre son résultat
+        deadline = time.monotonic() + self._lock_timeout_ms / 1000
+        while time.monotonic() < deadline:
+            cached = self._redis.get(result_key)
+            if cached is not None:
+                self.shared += 1
+                return json.loads(cached)
+            if not self._redis.exists(lock_key):
+                break
+            time.sleep(0.01)
+        self.executions += 1
+        return fn()
+
+    def stats(self) -> Dict[str, int]:
+        """Compteurs d'exécutions réelles et d'appels mutualisés"""
+        with self._lock:
+            in_flight = len(self._calls)
+        return {
+            "executions": self.executions,
+            "shared": self.shared,
+            "in_flight": in_flight
+        }
+
+group = SingleFlight(
+    enabled=settings.singleflight_enabled,
+    redis_url=settings.singleflight_redis_url,
+    lock_timeout_ms=settings.singleflight_lock_timeout_ms,
+    result_ttl_ms=settings.singleflight_result_ttl_ms
+)
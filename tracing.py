@@ -0,0 +1,382 @@
+# tracing.py
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Span courant de la requête (copié dans les threads qui exécutent l'endpoint)
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+# En-tête W3C Trace Context : version-trace_id-parent_id-flags
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+class Span:
+    """Opération chronométrée d'une trace (requête HTTP, fonction crud ou requête SQL)"""
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace_id: str, parent_id: Optional[str], name: str, kind: str = "internal"):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes: Dict[str, Any] = {}
+        self.error: Optional[str] = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def child(self, name: str, kind: str = "internal") -> "Span":
+        return Span(self.trace_id, self.span_id, name, kind)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_ns": self.start_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+def count(name: str, n: int = 1):
+    """Incrémente un attribut du span courant (succès de cache, appels mutualisés) ; sans trace, ne fait rien"""
+    span = _current_span.get()
+    if span is not None:
+        span.attributes[name] = span.attributes.get(name, 0) + n
+
+# ============================================================================
+# EXPORTATEURS
+# ============================================================================
+
+class FileExporter:
+    """Un span JSON par ligne (jq, benchmarks/trace_collector.py --report)"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans: List[Span]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for span in spans:
+                f.write(json.dumps(span.to_dict(), default=str) + "\n")
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+OTLP_KINDS = {"internal": 1, "server": 2, "client": 3}
+
+class OtlpExporter:
+    """Envoi OTLP/HTTP en JSON (collecteur OpenTelemetry, Jaeger, Tempo...)"""
+
+    def __init__(self, endpoint: str, service_name: str, timeout: float = 5.0):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+
+    def payload(self, spans: List[Span]) -> dict:
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{
+                "scope": {"name": "entrepot.tracing"},
+                "spans": [{
+                    "traceId": span.trace_id,
+                    "spanId": span.span_id,
+                    "parentSpanId": span.parent_id or "",
+                    "name": span.name,
+                    "kind": OTLP_KINDS[span.kind],
+                    "startTimeUnixNano": str(span.start_ns),
+                    "endTimeUnixNano": str(span.end_ns),
+                    "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in span.attributes.items()],
+                    "status": {"code": 2, "message": span.error} if span.error else {"code": 0},
+                } for span in spans]
+            }]
+        }]}
+
+    def export(self, spans: List[Span]):
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(self.payload(spans)).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+# ============================================================================
+# TRACEUR
+# ============================================================================
+
+class Tracer:
+    """Spans des requêtes HTTP, des fonctions crud et des requêtes SQL
+
+    Désactivé par défaut : rien n'est installé. Activé, une trace commence à
+    chaque requête HTTP (ou continue celle de l'en-tête `traceparent`) ; la
+    décision d'échantillonnage du parent est respectée, sinon `sample_ratio`
+    s'applique. Les spans terminés sont exportés par lots depuis un thread
+    dédié ; si l'export prend du retard, les spans en excès sont abandonnés
+    plutôt que de ralentir les requêtes.
+    """
+
+    def __init__(self, enabled: bool = False, sample_ratio: float = 1.0, exporter=None,
+                 batch_size: int = 512, flush_seconds: float = 2.0, max_queue: int = 10000):
+        self.enabled = enabled
+        self.sample_ratio = sample_ratio
+        self.exporter = exporter
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._installed = False
+        self.exported = 0
+        self.dropped = 0
+
+    # ------------------------------------------------------------------
+    # Traces
+    # ------------------------------------------------------------------
+
+    def start_trace(self, name: str, traceparent: Optional[str] = None) -> Optional[Span]:
+        """Span racine d'une requête entrante, None si la trace n'est pas échantillonnée"""
+        match = TRACEPARENT.match(traceparent.strip().lower()) if traceparent else None
+        if match:
+            trace_id, parent_id, flags = match.groups()
+            if not int(flags, 16) & 1:
+                return None
+        else:
+            if random.random() >= self.sample_ratio:
+                return None
+            trace_id, parent_id = f"{random.getrandbits(128):032x}", None
+        return Span(trace_id, parent_id, name, "server")
+
+    def finish(self, span: Span):
+        span.end_ns = time.time_ns()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    # ------------------------------------------------------------------
+    # Instrumentation
+    # ------------------------------------------------------------------
+
+    def install(self, *modules):
+        """Instrumente SQLAlchemy (tous les moteurs) et les fonctions publiques des modules donnés"""
+        if not self.enabled or self._installed:
+            return
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Engine, "handle_error", _handle_error)
+        for module in modules:
+            prefix = module.__name__
+            for name, fn in list(vars(module).items()):
+                if _traceable(module, name, fn):
+                    setattr(module, name, self._wrap(f"{prefix}.{name}", fn))
+        self._installed = True
+
+    def _wrap(self, span_name: str, fn):
+        @functools.wraps(fn)
+        def traced(*args, **kwargs):
+            parent = _current_span.get()
+            if parent is None:
+                return fn(*args, **kwargs)
+            span = parent.child(span_name)
+            token = _current_span.set(span)
+            try:
+                result = fn(*args, **kwargs)
+                if isinstance(result, list) or (hasattr(result, "__len__") and not isinstance(result, (str, bytes, dict, tuple))):
+                    span.attributes["rows"] = len(result)
+                return result
+            except Exception as e:
+                span.error = f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                _current_span.reset(token)
+                self.finish(span)
+        return traced
+
+    # ------------------------------------------------------------------
+    # Export
+    # ------------------------------------------------------------------
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=10)
+        self._thread = None
+
+    def _run(self):
+        while True:
+            stopping = self._stop.wait(self.flush_seconds)
+            while self._flush() == self.batch_size:
+                pass
+            if stopping:
+                return
+
+    def _flush(self) -> int:
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            try:
+                self.exporter.export(batch)
+                self.exported += len(batch)
+            except Exception as e:
+                self.dropped += len(batch)
+                logger.warning(f"Export de {len(batch)} spans échoué : {e}")
+        return len(batch)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "sample_ratio": self.sample_ratio,
+            "exporter": type(self.exporter).__name__ if self.exporter else None,
+            "queued": self._queue.qsize(),
+            "exported": self.exported,
+            "dropped": self.dropped,
+        }
+
+def _traceable(module, name: str, fn) -> bool:
+    # Fonctions publiques du module qui reçoivent une session (crud.get_price(db, ...))
+    if name.startswith("_") or not inspect.isfunction(fn) or fn.__module__ != module.__name__:
+        return False
+    if inspect.isgeneratorfunction(fn):
+        return False
+    parameters = list(inspect.signature(fn).parameters)
+    return bool(parameters) and parameters[0] == "db"
+
+# ============================================================================
+# INSTRUMENTATION SQL
+# ============================================================================
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    parent = _current_span.get()
+    if parent is None:
+        return
+    span = parent.child("sql", "client")
+    span.attributes["db.system"] = conn.dialect.name
+    span.attributes["db.statement"] = statement if len(statement) <= 2000 else statement[:2000] + "..."
+    if executemany:
+        span.attributes["db.executemany"] = len(parameters)
+    conn.info.setdefault("trace_spans", []).append(span)
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    spans = conn.info.get("trace_spans")
+    if spans:
+        span = spans.pop()
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            span.attributes["db.rows"] = cursor.rowcount
+        tracer.finish(span)
+
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    spans = conn.info.get("trace_spans") if conn is not None else None
+    if spans:
+        span = spans.pop()
+        span.error = f"{type(exception_context.original_exception).__name__}: {exception_context.original_exception}"
+        tracer.finish(span)
+
+# ============================================================================
+# MIDDLEWARE HTTP
+# ============================================================================
+
+class TracingMiddleware:
+    """Middleware ASGI : span racine de chaque requête échantillonnée
+
+    La trace continue celle de l'en-tête `traceparent` entrant ; la réponse
+    porte l'en-tête `traceresponse` qui donne l'identifiant de la trace.
+    """
+
+    def __init__(self, app, tracer: "Tracer"):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        traceparent = dict(scope["headers"]).get(b"traceparent")
+        span = self.tracer.start_trace(
+            f"{scope['method']} {scope['path']}",
+            traceparent.decode("latin-1") if traceparent else None
+        )
+        if span is None:
+            return await self.app(scope, receive, send)
+
+        span.attributes["http.method"] = scope["method"]
+        span.attributes["http.target"] = scope["path"]
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                span.attributes["http.status_code"] = message["status"]
+                if message["status"] >= 500:
+                    span.error = f"HTTP {message['status']}"
+                message["headers"] = list(message.get("headers", [])) + [(b"traceresponse", span.traceparent.encode())]
+            await send(message)
+
+        token = _current_span.set(span)
+        try:
+            await self.app(scope, receive, send_with_trace)
+        except Exception as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            route = scope.get("route")
+            if route is not None and hasattr(route, "path"):
+                # Nom par gabarit de route : les spans d'un même endpoint se regroupent
+                span.name = f"{scope['method']} {route.path}"
+                span.attributes["http.route"] = route.path
+            self.tracer.finish(span)
+
+def _exporter():
+    if settings.tracing_exporter == "otlp":
+        return OtlpExporter(settings.tracing_otlp_endpoint, settings.tracing_service_name)
+    return FileExporter(settings.tracing_file_path)
+
+tracer = Tracer(
+    enabled=settings.tracing_enabled,
+    sample_ratio=settings.tracing_sample_ratio,
+    exporter=_exporter() if settings.tracing_enabled else None,
+    batch_size=settings.tracing_batch_size,
+    flush_seconds=settings.tracing_flush_seconds
+)
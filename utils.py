@@ -1,6 +1,9 @@
 # utils.py
 from datetime import datetime, date
-from typing import Optional, Dict, Any
+from itertools import islice
+from typing import Optional, Dict, Any, List
+import io
+import json
 import re
 
 def validate_date_format(date_str: str) -> bool:
@@ -58,3 +61,91 @@ def format_error_response(error: str, details: Optional[str] = None) -> Dict[str
     if details:
         response["details"] = details
     return response
+
+def date_to_key(value: date) -> int:
+    """Convertit une date en clé entière triable (YYYYMMDD)"""
+    return value.year * 10000 + value.month * 100 + value.day
+
+def key_to_date(key: int) -> date:
+    """Convertit une clé entière YYYYMMDD en date"""
+    year, rest = divmod(int(key), 10000)
+    month, day = divmod(rest, 100)
+    return date(year, month, day)
+
+def percentile_cont(sorted_values: List[float], fraction: float) -> Optional[float]:
+    """Percentile avec interpolation linéaire (équivalent de percentile_cont SQL)"""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    weight = position - lower
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * weight
+
+def largest_triangle_three_buckets(points: List[tuple], threshold: int) -> List[int]:
+    """Réduit une série (x, y) à `threshold` points par l'algorithme LTTB, retourne les indices conservés"""
+    size = len(points)
+    if threshold >= size or threshold < 3:
+        return list(range(size))
+
+    selected = [0]
+    bucket_size = (size - 2) / (threshold - 2)
+    previous = 0
+    for i in range(threshold - 2):
+        # Moyenne du bucket suivant, utilisée comme troisième sommet du triangle
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, size)
+        next_points = points[next_start:next_end]
+        avg_x = sum(p[0] for p in next_points) / len(next_points)
+        avg_y = sum(p[1] for p in next_points) / len(next_points)
+
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        prev_x, prev_y = points[previous]
+        best_area, best_index = -1.0, start
+        for j in range(start, end):
+            x, y = points[j]
+            area = abs((prev_x - avg_x) * (y - prev_y) - (prev_x - x) * (avg_y - prev_y))
+            if area > best_area:
+                best_area, best_index = area, j
+        selected.append(best_index)
+        previous = best_index
+    selected.append(size - 1)
+    return selected
+
+# Tâches exécutables dans le pool de processus (voir offload.py) : elles
+# reçoivent des colonnes numériques indexables et ne touchent pas à la base
+
+def lttb_indices(columns: Dict[str, Any], threshold: int) -> List[int]:
+    """LTTB sur les colonnes x et y"""
+    return largest_triangle_three_buckets(list(zip(columns["x"], columns["y"])), threshold)
+
+def encode_price_history(columns: Dict[str, Any], sale_point_names: Dict[int, str], chunk_size: int = 10000) -> bytes:
+    """Encode l'historique des prix en JSON à partir de ses colonnes
+
+    L'encodage se fait par tranches de `chunk_size` lignes : seuls les
+    dictionnaires d'une tranche existent à un instant donné.
+    """
+    rows = zip(
+        columns["date_id"], columns["day"], columns["month"], columns["year"],
+        columns["price"], columns["sale_point_id"]
+    )
+    out = io.BytesIO()
+    out.write(b"[")
+    separator = b""
+    while True:
+        entries = [
+            {
+                "date": {"id": date_id, "day": day, "month": month, "year": year},
+                "price": price,
+                "sale_point": {"id": sale_point_id, "name": sale_point_names.get(sale_point_id)}
+            }
+            for date_id, day, month, year, price, sale_point_id in islice(rows, chunk_size)
+        ]
+        if not entries:
+            break
+        out.write(separator)
+        out.write(json.dumps(entries, separators=(",", ":"))[1:-1].encode("utf-8"))
+        separator = b","
+    out.write(b"]")
+    return out.getvalue()